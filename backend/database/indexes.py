@@ -0,0 +1,220 @@
+"""Declarative index specs, background reconciliation and query plan checks"""
+import os
+from typing import Dict, List, Optional
+from pymongo import ASCENDING, DESCENDING, IndexModel
+from pymongo.errors import OperationFailure
+from services.search_index import RECENCY_FIELDS
+import logging
+
+logger = logging.getLogger(__name__)
+
+# Drop indexes that aren't declared below (off by default so hand-made
+# indexes on a shared cluster survive)
+DROP_UNMANAGED_INDEXES = os.getenv("DROP_UNMANAGED_INDEXES", "False").lower() == "true"
+
+VOICE_CONVERSATION_TTL = int(os.getenv("VOICE_CONVERSATION_TTL", 1800))
+
+
+def search_index_keys(collection: str) -> list:
+    """Search index of a collection: terms within each user, newest first
+
+    Walked in recency order with the terms matched on index keys, so a
+    search stops at its candidate limit instead of sorting every match.
+    """
+    return [("user_id", ASCENDING), (RECENCY_FIELDS[collection], DESCENDING), ("search_terms", ASCENDING)]
+
+
+# Every index the application relies on, per collection. Names are left to
+# pymongo so they match indexes created by earlier releases.
+INDEX_SPECS: Dict[str, List[IndexModel]] = {
+    "users": [
+        IndexModel([("email", ASCENDING)], unique=True),
+    ],
+    "sessions": [
+        IndexModel([("token", ASCENDING)], unique=True),
+        IndexModel([("user_id", ASCENDING)]),
+        # Expire each session at its own expires_at
+        IndexModel([("expires_at", ASCENDING)], expireAfterSeconds=0),
+    ],
+    "bookmarks": [
+        IndexModel([("user_id", ASCENDING), ("url", ASCENDING)], unique=True),
+        IndexModel([("user_id", ASCENDING), ("created_at", DESCENDING), ("_id", DESCENDING)]),
+        IndexModel(search_index_keys("bookmarks")),
+        # Finds documents the startup backfill has to reindex
+        IndexModel([("terms_version", ASCENDING)]),
+    ],
+    "history": [
+        IndexModel([("user_id", ASCENDING), ("url", ASCENDING)], unique=True),
+        IndexModel([("user_id", ASCENDING), ("visited_at", DESCENDING), ("_id", DESCENDING)]),
+        IndexModel(search_index_keys("history")),
+        # Finds documents the startup backfill has to reindex
+        IndexModel([("terms_version", ASCENDING)]),
+    ],
+    "settings": [
+        IndexModel([("user_id", ASCENDING)], unique=True),
+    ],
+    "history_archive": [
+        IndexModel([("user_id", ASCENDING), ("month", ASCENDING)], unique=True),
+        IndexModel(search_index_keys("history_archive")),
+        # Finds documents the startup backfill has to reindex
+        IndexModel([("terms_version", ASCENDING)]),
+    ],
+    "daily_insights": [
+        IndexModel([("user_id", ASCENDING), ("day", ASCENDING)], unique=True),
+    ],
+    "focus_sessions": [
+        IndexModel([("user_id", ASCENDING), ("active", ASCENDING)]),
+        IndexModel([("user_id", ASCENDING), ("created_at", DESCENDING), ("_id", DESCENDING)]),
+    ],
+    "downloads": [
+        IndexModel([("user_id", ASCENDING), ("started_at", DESCENDING), ("_id", DESCENDING)]),
+    ],
+    "voice_conversations": [
+        IndexModel([("updated_at", ASCENDING)], expireAfterSeconds=VOICE_CONVERSATION_TTL),
+    ],
+    "page_contexts": [
+        IndexModel([("expires_at", ASCENDING)], expireAfterSeconds=0),
+    ],
+}
+
+# Indexes from earlier releases that the specs above now cover
+RETIRED_INDEXES: Dict[str, List[str]] = {
+    "bookmarks": ["created_at_-1", "user_id_1_search_terms_1"],
+    "history": ["user_id_1_visited_at_-1", "url_1", "user_id_1_search_terms_1"],
+    "history_archive": ["user_id_1_search_terms_1"],
+    "focus_sessions": ["created_at_-1"],
+}
+
+# Representative route queries checked with explain(): (name, collection, filter, sort)
+ROUTE_QUERIES = [
+    ("auth.login", "users", {"email": "user@example.com"}, None),
+    ("auth.verify", "sessions", {"token": "token"}, None),
+    ("data.get_bookmarks", "bookmarks", {"user_id": "default_user"}, [("created_at", -1), ("_id", -1)]),
+    ("data.search_bookmarks", "bookmarks", {"user_id": "default_user", "search_terms": {"$all": [{"$regex": "^a"}]}}, [("created_at", -1)]),
+    ("data.add_history", "history", {"user_id": "default_user", "url": "https://example.com"}, None),
+    ("data.get_history", "history", {"user_id": "default_user"}, [("visited_at", -1), ("_id", -1)]),
+    ("data.search_history", "history", {"user_id": "default_user", "search_terms": {"$all": [{"$regex": "^a"}]}}, [("visited_at", -1)]),
+    ("data.insights", "daily_insights", {"user_id": "default_user", "day": {"$gte": "2024-01-01"}}, None),
+    ("data.search_history.archive", "history_archive", {"user_id": "default_user", "search_terms": {"$all": [{"$regex": "^a"}]}}, [("month", -1)]),
+    ("data.get_settings", "settings", {"user_id": "default_user"}, None),
+    ("focus.active", "focus_sessions", {"user_id": "default_user", "active": True}, None),
+    ("focus.history", "focus_sessions", {"user_id": "default_user"}, [("created_at", -1), ("_id", -1)]),
+    ("downloads.list", "downloads", {"user_id": "default_user"}, [("started_at", -1), ("_id", -1)]),
+]
+
+index_status = {"state": "pending", "created": [], "updated": [], "dropped": [], "errors": []}
+
+
+def _same_index(existing: dict, model: IndexModel) -> bool:
+    """Whether an existing index matches the declared options we manage"""
+    spec = model.document
+    return (
+        bool(existing.get("unique")) == bool(spec.get("unique"))
+        and existing.get("expireAfterSeconds") == spec.get("expireAfterSeconds")
+    )
+
+
+async def reconcile_indexes(database):
+    """Bring every collection's indexes in line with INDEX_SPECS"""
+    index_status.update(state="running", created=[], updated=[], dropped=[], errors=[])
+    for collection_name, models in INDEX_SPECS.items():
+        collection = database[collection_name]
+        try:
+            existing = await collection.index_information()
+        except OperationFailure as e:
+            index_status["errors"].append(f"{collection_name}: {e}")
+            continue
+
+        declared = {model.document["name"] for model in models}
+        missing = []
+        for model in models:
+            name = model.document["name"]
+            current = existing.get(name)
+            if current is None:
+                missing.append(model)
+            elif not _same_index(current, model):
+                if "expireAfterSeconds" in model.document and current.get("expireAfterSeconds") is not None:
+                    # TTLs can be changed in place
+                    try:
+                        await database.command(
+                            "collMod", collection_name,
+                            index={"name": name, "expireAfterSeconds": model.document["expireAfterSeconds"]}
+                        )
+                        index_status["updated"].append(f"{collection_name}.{name}")
+                    except OperationFailure as e:
+                        index_status["errors"].append(f"{collection_name}.{name}: {e}")
+                else:
+                    index_status["errors"].append(f"{collection_name}.{name}: options differ from spec")
+
+        # One at a time, so a failing build (e.g. duplicates under a new
+        # unique index) doesn't take the others down with it
+        for model in missing:
+            try:
+                names = await collection.create_indexes([model])
+                index_status["created"] += [f"{collection_name}.{name}" for name in names]
+            except OperationFailure as e:
+                index_status["errors"].append(f"{collection_name}.{model.document['name']}: {e}")
+
+        retired = set(RETIRED_INDEXES.get(collection_name, []))
+        for name in existing:
+            if name == "_id_" or name in declared:
+                continue
+            if name in retired or DROP_UNMANAGED_INDEXES:
+                try:
+                    await collection.drop_index(name)
+                    index_status["dropped"].append(f"{collection_name}.{name}")
+                except OperationFailure as e:
+                    index_status["errors"].append(f"{collection_name}.{name}: {e}")
+
+    index_status["state"] = "failed" if index_status["errors"] else "done"
+    for error in index_status["errors"]:
+        logger.warning(f"Index reconciliation: {error}")
+    logger.info(
+        f"Indexes reconciled: {len(index_status['created'])} created, "
+        f"{len(index_status['updated'])} updated, {len(index_status['dropped'])} dropped"
+    )
+
+
+def _plan_stages(plan: dict) -> List[str]:
+    """All stage names in a winning plan tree"""
+    stages = []
+    stack = [plan]
+    while stack:
+        node = stack.pop()
+        if not isinstance(node, dict):
+            continue
+        if "stage" in node:
+            stages.append(node["stage"])
+        for key in ("inputStage", "queryPlan"):
+            if key in node:
+                stack.append(node[key])
+        stack.extend(node.get("inputStages", []))
+    return stages
+
+
+async def verify_query_plans(database, queries: Optional[list] = None) -> List[dict]:
+    """Explain each route query and flag any that would scan a whole collection or sort in memory"""
+    report = []
+    for name, collection_name, query, sort in queries or ROUTE_QUERIES:
+        cursor = database[collection_name].find(query).limit(1)
+        if sort:
+            cursor = cursor.sort(sort)
+        try:
+            explanation = await cursor.explain()
+        except OperationFailure as e:
+            report.append({"query": name, "collection": collection_name, "error": str(e)})
+            continue
+        stages = _plan_stages(explanation.get("queryPlanner", {}).get("winningPlan", {}))
+        report.append({
+            "query": name,
+            "collection": collection_name,
+            "stages": stages,
+            "collscan": "COLLSCAN" in stages,
+            "blocking_sort": "SORT" in stages
+        })
+    for entry in report:
+        if entry.get("collscan"):
+            logger.warning(f"Query {entry['query']} on {entry['collection']} uses a COLLSCAN")
+        if entry.get("blocking_sort"):
+            logger.warning(f"Query {entry['query']} on {entry['collection']} sorts in memory")
+    return report
@@ -106,6 +106,10 @@ class SettingsModel(BaseModel):
     focus_mode_enabled: bool = False
     focus_mode_strict: bool = False
     
+    # History retention (0 keeps everything)
+    history_retention_days: int = 0
+    history_max_entries: int = 0
+    
     updated_at: datetime = Field(default_factory=datetime.utcnow)
 
     class Config:
@@ -147,12 +151,16 @@ class DownloadModel(BaseModel):
     file_size: Optional[int] = None  # bytes
     mime_type: Optional[str] = None
     save_path: Optional[str] = None
-    status: str = "in_progress"  # in_progress, completed, failed, cancelled
+    status: str = "in_progress"  # in_progress, paused, completed, failed, cancelled
     progress: float = 0.0  # 0-100
     downloaded_bytes: int = 0
     started_at: datetime = Field(default_factory=datetime.utcnow)
     completed_at: Optional[datetime] = None
     error_message: Optional[str] = None
+    # Server-side downloads (fetched by the download engine rather than the client)
+    server_side: bool = False
+    expected_sha256: Optional[str] = None
+    sha256: Optional[str] = None
 
     class Config:
         populate_by_name = True
@@ -0,0 +1,417 @@
+"""MongoDB storage backend"""
+import asyncio
+import logging
+from datetime import datetime
+from typing import AsyncIterator, Dict, List, Optional, Tuple
+from bson import ObjectId
+from pymongo import ReturnDocument, UpdateOne
+from pymongo.errors import BulkWriteError, DuplicateKeyError
+from database.mongodb import connect_to_mongo, close_mongo_connection, get_database
+from database.indexes import index_status, verify_query_plans, search_index_keys
+from database.storage import Storage, Page, HistoryVisit, SEARCH_COLLECTIONS, fresh_search_fields
+from services import search_index, pagination
+
+logger = logging.getLogger(__name__)
+
+# Search terms are only used for querying; list endpoints leave them out
+_NO_TERMS = {field: 0 for field in search_index.INDEX_FIELDS}
+
+# Per-operation write errors worth retrying: concurrent upserts and replica set elections
+_RETRYABLE_WRITE_CODES = {6, 7, 89, 91, 189, 9001, 10107, 11000, 11600, 11602, 13435, 13436}
+
+
+class MongoStorage(Storage):
+    """Storage on a MongoDB server through Motor"""
+
+    name = "mongodb"
+
+    @property
+    def db(self):
+        return get_database()
+
+    async def connect(self):
+        await connect_to_mongo()
+
+    async def close(self):
+        await close_mongo_connection()
+
+    async def index_report(self) -> dict:
+        plans = await verify_query_plans(self.db)
+        return {
+            "backend": self.name,
+            "indexes": index_status,
+            "collscans": [plan["query"] for plan in plans if plan.get("collscan")],
+            "plans": plans
+        }
+
+    async def watch(self, collections: List[str]) -> AsyncIterator[Tuple[str, Optional[str], Optional[dict]]]:
+        """Change stream over collections, resumed with backoff
+
+        Needs a replica set; on a standalone server this yields nothing.
+        """
+        try:
+            hello = await self.db.command("hello")
+        except Exception as e:
+            logger.warning(f"Change stream disabled, server check failed: {e}")
+            return
+        if not hello.get("setName"):
+            logger.info("Change stream disabled: MongoDB is not a replica set")
+            return
+
+        pipeline = [{"$match": {"ns.coll": {"$in": collections}}}]
+        resume_token = None
+        delay = 1
+        while True:
+            try:
+                async with self.db.watch(pipeline, full_document="updateLookup",
+                                         resume_after=resume_token) as stream:
+                    self.watching = True
+                    delay = 1
+                    async for change in stream:
+                        resume_token = stream.resume_token
+                        doc = change.get("fullDocument")
+                        # Deletes don't carry the user id (or a document)
+                        yield change["ns"]["coll"], (doc or {}).get("user_id"), doc
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                logger.warning(f"Change stream interrupted, retrying in {delay}s: {e}")
+            finally:
+                self.watching = False
+            # Anything may have changed while we weren't listening
+            for collection in collections:
+                yield collection, None, None
+            await asyncio.sleep(delay)
+            delay = min(delay * 2, 60)
+
+    # ============ Bookmarks ============
+
+    async def insert_bookmark(self, doc: dict) -> str:
+        result = await self.db.bookmarks.insert_one(doc)
+        return str(result.inserted_id)
+
+    async def list_bookmarks(self, user_id: str, folder: Optional[str], limit: int,
+                             cursor: Optional[str] = None) -> Page:
+        return await pagination.fetch_page(
+            self.db.bookmarks, self._bookmark_query(user_id, folder), "created_at", limit, cursor, _NO_TERMS
+        )
+
+    def iter_bookmarks(self, user_id: str, folder: Optional[str] = None, limit: Optional[int] = None,
+                       cursor: Optional[str] = None) -> AsyncIterator[dict]:
+        return pagination.iter_documents(
+            self.db.bookmarks, self._bookmark_query(user_id, folder), "created_at", limit, cursor, _NO_TERMS
+        )
+
+    @staticmethod
+    def _bookmark_query(user_id: str, folder: Optional[str]) -> dict:
+        query = {"user_id": user_id}
+        if folder:
+            query["folder"] = folder
+        return query
+
+    async def delete_bookmark(self, user_id: str, bookmark_id: str) -> bool:
+        result = await self.db.bookmarks.delete_one({"_id": ObjectId(bookmark_id), "user_id": user_id})
+        return result.deleted_count > 0
+
+    # ============ History ============
+
+    async def upsert_history(self, user_id: str, visit: HistoryVisit) -> str:
+        url = visit[0]
+        doc = await self.db.history.find_one_and_update(
+            {"user_id": user_id, "url": url},
+            self._history_upsert(*visit),
+            upsert=True,
+            projection={"_id": 1},
+            return_document=ReturnDocument.AFTER
+        )
+        return str(doc["_id"])
+
+    async def upsert_history_batch(self, user_id: str, visits: List[HistoryVisit]) -> Dict[str, int]:
+        operations = [
+            UpdateOne({"user_id": user_id, "url": visit[0]}, self._history_upsert(*visit), upsert=True)
+            for visit in visits
+        ]
+        if not operations:
+            return {"inserted": 0, "updated": 0}
+        result = await self.db.history.bulk_write(operations, ordered=False)
+        return {"inserted": result.upserted_count, "updated": result.matched_count}
+
+    @staticmethod
+    def _history_upsert(url: str, title: str, favicon: Optional[str], visited_at, visits: int) -> dict:
+        """Update document shared by single and batched history upserts"""
+        return {
+            "$set": {
+                "title": title,
+                "favicon": favicon,
+                **search_index.search_fields(url, title)
+            },
+            # $max keeps the newest timestamp when queued visits arrive late
+            "$max": {"visited_at": visited_at},
+            "$inc": {"visit_count": visits},
+            "$setOnInsert": {"last_visit_duration": None}
+        }
+
+    async def list_history(self, user_id: str, limit: int, cursor: Optional[str] = None) -> Page:
+        return await pagination.fetch_page(
+            self.db.history, {"user_id": user_id}, "visited_at", limit, cursor, _NO_TERMS
+        )
+
+    def iter_history(self, user_id: str, limit: Optional[int] = None,
+                     cursor: Optional[str] = None) -> AsyncIterator[dict]:
+        return pagination.iter_documents(
+            self.db.history, {"user_id": user_id}, "visited_at", limit, cursor, _NO_TERMS
+        )
+
+    async def clear_history(self, user_id: str) -> int:
+        result = await self.db.history.delete_many({"user_id": user_id})
+        return result.deleted_count
+
+    async def history_users(self) -> List[str]:
+        return await self.db.history.distinct("user_id")
+
+    async def count_history(self, user_id: str, before: Optional[datetime] = None) -> int:
+        query = {"user_id": user_id}
+        if before:
+            query["visited_at"] = {"$lt": before}
+        return await self.db.history.count_documents(query)
+
+    async def oldest_history(self, user_id: str, limit: int) -> List[dict]:
+        cursor = self.db.history.find({"user_id": user_id}, _NO_TERMS).sort([("visited_at", 1), ("_id", 1)]).limit(limit)
+        return await cursor.to_list(length=limit)
+
+    async def delete_history(self, user_id: str, ids: Optional[list] = None,
+                             before: Optional[datetime] = None) -> int:
+        query = {"user_id": user_id}
+        if ids is not None:
+            query["_id"] = {"$in": [ObjectId(doc_id) for doc_id in ids]}
+        if before:
+            query["visited_at"] = {"$lt": before}
+        result = await self.db.history.delete_many(query)
+        return result.deleted_count
+
+    async def search_candidates(self, collection: str, user_id: str, terms: List[str], limit: int) -> List[dict]:
+        # Hinted: the recency-ordered terms index serves the sort, so the scan stops at limit
+        cursor = self.db[collection].find(search_index.build_filter(user_id, terms)) \
+            .sort(search_index.RECENCY_FIELDS[collection], -1).hint(search_index_keys(collection)).limit(limit)
+        return await cursor.to_list(length=limit)
+
+    async def backfill_search_terms(self, batch_size: int = 500) -> int:
+        # Indexed on terms_version, so a start with nothing stale reads nothing
+        stale = {"terms_version": {"$not": {"$gte": search_index.TERMS_VERSION}}}
+        updated = 0
+        for name in SEARCH_COLLECTIONS:
+            collection = self.db[name]
+            while True:
+                # Updated documents leave the filter, so each batch is a fresh query
+                docs = await collection.find(stale, {"url": 1, "title": 1, "tags": 1, "packed": 1}) \
+                    .limit(batch_size).to_list(length=batch_size)
+                if not docs:
+                    break
+                await collection.bulk_write([
+                    UpdateOne({"_id": doc["_id"]}, {"$set": fresh_search_fields(name, doc)}) for doc in docs
+                ], ordered=False)
+                updated += len(docs)
+        return updated
+
+    # ============ History archive ============
+
+    async def find_archive_bucket(self, user_id: str, month: str) -> Optional[dict]:
+        return await self.db.history_archive.find_one({"user_id": user_id, "month": month})
+
+    async def save_archive_bucket(self, doc: dict):
+        doc = {key: value for key, value in doc.items() if key != "_id"}
+        await self.db.history_archive.replace_one(
+            {"user_id": doc["user_id"], "month": doc["month"]}, doc, upsert=True
+        )
+
+    async def list_archive_buckets(self, user_id: str) -> List[dict]:
+        cursor = self.db.history_archive.find({"user_id": user_id}).sort("month", 1)
+        return await cursor.to_list(length=None)
+
+    async def delete_archive_buckets(self, user_id: str, months: Optional[List[str]] = None) -> int:
+        query = {"user_id": user_id}
+        if months is not None:
+            query["month"] = {"$in": months}
+        result = await self.db.history_archive.delete_many(query)
+        return result.deleted_count
+
+    # ============ Insights ============
+
+    async def increment_rollups(self, increments: Dict[Tuple[str, str], Dict[str, int]]) -> Dict[Tuple[str, str], Dict[str, int]]:
+        keys = list(increments)
+        operations = [
+            UpdateOne({"user_id": user_id, "day": day}, {"$inc": increments[(user_id, day)]}, upsert=True)
+            for user_id, day in keys
+        ]
+        if not operations:
+            return {}
+        try:
+            await self.db.daily_insights.bulk_write(operations, ordered=False)
+        except BulkWriteError as e:
+            # Unordered: every operation not listed here was applied and must not be sent again
+            retry = {}
+            for error in e.details.get("writeErrors", []):
+                key = keys[error["index"]]
+                if error.get("code") in _RETRYABLE_WRITE_CODES:
+                    retry[key] = increments[key]
+                else:
+                    logger.error(f"Dropping rollup increments for {key}: {error.get('errmsg')}")
+            return retry
+        return {}
+
+    async def list_rollups(self, user_id: str, since_day: str) -> List[dict]:
+        cursor = self.db.daily_insights.find({"user_id": user_id, "day": {"$gte": since_day}})
+        return await cursor.to_list(length=None)
+
+    async def delete_rollups(self, user_id: str) -> int:
+        result = await self.db.daily_insights.delete_many({"user_id": user_id})
+        return result.deleted_count
+
+    # ============ Settings ============
+
+    async def find_settings(self, user_id: str) -> Optional[dict]:
+        return await self.db.settings.find_one({"user_id": user_id})
+
+    async def find_or_create_settings(self, user_id: str, defaults: dict) -> dict:
+        try:
+            return await self.db.settings.find_one_and_update(
+                {"user_id": user_id},
+                {"$setOnInsert": defaults},
+                upsert=True,
+                return_document=ReturnDocument.AFTER
+            )
+        except DuplicateKeyError:
+            # A concurrent first read inserted them between our match and insert
+            return await self.db.settings.find_one({"user_id": user_id})
+
+    async def update_settings(self, user_id: str, fields: dict) -> bool:
+        result = await self.db.settings.update_one(
+            {"user_id": user_id},
+            {"$set": fields},
+            upsert=True
+        )
+        return result.modified_count > 0 or result.upserted_id is not None
+
+    # ============ Focus sessions ============
+
+    async def start_focus_session(self, doc: dict) -> str:
+        await self.db.focus_sessions.update_many(
+            {"user_id": doc["user_id"], "active": True},
+            {"$set": {"active": False, "ended_at": datetime.utcnow()}}
+        )
+        result = await self.db.focus_sessions.insert_one(doc)
+        return str(result.inserted_id)
+
+    async def find_active_focus_session(self, user_id: str) -> Optional[dict]:
+        return await self.db.focus_sessions.find_one({"user_id": user_id, "active": True})
+
+    async def record_focus_check(self, session_id, allowed: bool) -> Optional[dict]:
+        return await self.db.focus_sessions.find_one_and_update(
+            {"_id": ObjectId(session_id)},
+            {
+                "$inc": {
+                    "urls_checked": 1,
+                    "urls_allowed": 1 if allowed else 0,
+                    "urls_blocked": 0 if allowed else 1
+                }
+            },
+            return_document=ReturnDocument.AFTER
+        )
+
+    async def end_focus_session(self, session_id) -> Optional[str]:
+        session = await self.db.focus_sessions.find_one_and_update(
+            {"_id": ObjectId(session_id), "active": True},
+            {"$set": {"active": False, "ended_at": datetime.utcnow()}},
+            projection={"user_id": 1}
+        )
+        return session["user_id"] if session else None
+
+    async def list_focus_sessions(self, user_id: str, limit: int, cursor: Optional[str] = None) -> Page:
+        return await pagination.fetch_page(self.db.focus_sessions, {"user_id": user_id}, "created_at", limit, cursor)
+
+    def iter_focus_sessions(self, user_id: str, limit: Optional[int] = None,
+                            cursor: Optional[str] = None) -> AsyncIterator[dict]:
+        return pagination.iter_documents(self.db.focus_sessions, {"user_id": user_id}, "created_at", limit, cursor)
+
+    # ============ Downloads ============
+
+    async def insert_download(self, doc: dict) -> str:
+        result = await self.db.downloads.insert_one(doc)
+        return str(result.inserted_id)
+
+    async def find_download(self, download_id: str) -> Optional[dict]:
+        return await self.db.downloads.find_one({"_id": ObjectId(download_id)})
+
+    async def update_download(self, download_id: str, fields: dict) -> bool:
+        result = await self.db.downloads.update_one({"_id": ObjectId(download_id)}, {"$set": fields})
+        return result.modified_count > 0
+
+    async def delete_download(self, download_id: str) -> bool:
+        result = await self.db.downloads.delete_one({"_id": ObjectId(download_id)})
+        return result.deleted_count > 0
+
+    async def delete_downloads(self, user_id: str, status: Optional[str] = None) -> int:
+        query = {"user_id": user_id}
+        if status:
+            query["status"] = status
+        result = await self.db.downloads.delete_many(query)
+        return result.deleted_count
+
+    async def list_downloads_by_status(self, status: str, limit: int = 1000) -> List[dict]:
+        return await self.db.downloads.find({"status": status}).sort("started_at", 1).to_list(limit)
+
+    async def list_downloads(self, user_id: str, limit: int, cursor: Optional[str] = None) -> Page:
+        return await pagination.fetch_page(self.db.downloads, {"user_id": user_id}, "started_at", limit, cursor)
+
+    def iter_downloads(self, user_id: str, limit: Optional[int] = None,
+                       cursor: Optional[str] = None) -> AsyncIterator[dict]:
+        return pagination.iter_documents(self.db.downloads, {"user_id": user_id}, "started_at", limit, cursor)
+
+    # ============ Users and auth sessions ============
+
+    async def insert_user(self, doc: dict) -> str:
+        result = await self.db.users.insert_one(doc)
+        return str(result.inserted_id)
+
+    async def find_user(self, user_id: str) -> Optional[dict]:
+        return await self.db.users.find_one({"_id": ObjectId(user_id)})
+
+    async def find_user_by_email(self, email: str) -> Optional[dict]:
+        return await self.db.users.find_one({"email": email})
+
+    async def update_user(self, user_id: str, fields: dict) -> bool:
+        result = await self.db.users.update_one({"_id": ObjectId(user_id)}, {"$set": fields})
+        return result.matched_count > 0
+
+    async def insert_session(self, doc: dict):
+        await self.db.sessions.insert_one(doc)
+
+    async def find_session(self, token: str) -> Optional[dict]:
+        return await self.db.sessions.find_one({"token": token})
+
+    async def delete_session(self, token: str) -> bool:
+        result = await self.db.sessions.delete_one({"token": token})
+        return result.deleted_count > 0
+
+    # ============ Voice conversations ============
+
+    async def load_conversation(self, conversation_id: str) -> Optional[dict]:
+        return await self.db.voice_conversations.find_one({"_id": conversation_id})
+
+    async def save_conversation(self, doc: dict):
+        await self.db.voice_conversations.replace_one({"_id": doc["_id"]}, doc, upsert=True)
+
+    async def delete_conversation(self, conversation_id: str) -> bool:
+        result = await self.db.voice_conversations.delete_one({"_id": conversation_id})
+        return result.deleted_count > 0
+
+    # ============ Page contexts ============
+
+    async def find_page_context(self, handle: str) -> Optional[dict]:
+        return await self.db.page_contexts.find_one({"_id": handle})
+
+    async def save_page_context(self, doc: dict):
+        await self.db.page_contexts.replace_one({"_id": doc["_id"]}, doc, upsert=True)
+
+    async def touch_page_context(self, handle: str, expires_at: datetime):
+        await self.db.page_contexts.update_one({"_id": handle}, {"$set": {"expires_at": expires_at}})
@@ -1,8 +1,9 @@
 """MongoDB database configuration and connection"""
 from motor.motor_asyncio import AsyncIOMotorClient
-from pymongo import ASCENDING, DESCENDING
+import asyncio
 import os
 from dotenv import load_dotenv
+from database.indexes import reconcile_indexes, index_status
 
 load_dotenv()
 
@@ -13,6 +14,7 @@ DATABASE_NAME = os.getenv("DATABASE_NAME", "lernova_db")
 # Global database client
 client: AsyncIOMotorClient = None
 database = None
+index_task: asyncio.Task = None
 
 
 async def connect_to_mongo():
@@ -22,8 +24,9 @@ async def connect_to_mongo():
         client = AsyncIOMotorClient(MONGODB_URL)
         database = client[DATABASE_NAME]
         
-        # Create indexes
-        await create_indexes()
+        # Build indexes in the background so startup doesn't wait on them
+        global index_task
+        index_task = asyncio.create_task(create_indexes())
         
         print(f"✅ Connected to MongoDB: {DATABASE_NAME}")
     except Exception as e:
@@ -40,25 +43,12 @@ async def close_mongo_connection():
 
 
 async def create_indexes():
-    """Create database indexes for better performance"""
+    """Reconcile declared indexes; failures are logged, not raised"""
     try:
-        # Bookmarks indexes
-        await database.bookmarks.create_index([("user_id", ASCENDING), ("url", ASCENDING)], unique=True)
-        await database.bookmarks.create_index([("created_at", DESCENDING)])
-        
-        # History indexes
-        await database.history.create_index([("user_id", ASCENDING), ("visited_at", DESCENDING)])
-        await database.history.create_index([("url", ASCENDING)])
-        
-        # Settings indexes
-        await database.settings.create_index([("user_id", ASCENDING)], unique=True)
-        
-        # Focus mode indexes
-        await database.focus_sessions.create_index([("user_id", ASCENDING), ("active", ASCENDING)])
-        await database.focus_sessions.create_index([("created_at", DESCENDING)])
-        
-        print("✅ Database indexes created")
+        await reconcile_indexes(database)
+        print("✅ Database indexes reconciled")
     except Exception as e:
+        index_status["state"] = "failed"
         print(f"⚠️ Error creating indexes: {e}")
 
 
@@ -0,0 +1,762 @@
+"""SQLite storage backend for the single-user desktop build"""
+import os
+import base64
+import asyncio
+import sqlite3
+import logging
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timedelta
+from typing import AsyncIterator, Dict, List, Optional, Tuple
+import orjson
+from bson import ObjectId
+from database.storage import Storage, Page, HistoryVisit, SEARCH_COLLECTIONS, fresh_search_fields
+from services import search_index, pagination
+from services.serialization import bson_default
+
+logger = logging.getLogger(__name__)
+
+SQLITE_PATH = os.getenv("SQLITE_PATH", "lernova.db")
+VOICE_CONVERSATION_TTL = int(os.getenv("VOICE_CONVERSATION_TTL", 1800))
+# Seconds between sweeps of expired sessions, conversations and page contexts
+SQLITE_PRUNE_INTERVAL = float(os.getenv("SQLITE_PRUNE_INTERVAL", 600))
+
+# Each table stores the whole document as JSON in "doc", plus copies of the
+# fields it is filtered and sorted on as real columns so they can be indexed.
+# Column names match the document fields they mirror.
+TABLES: Dict[str, dict] = {
+    "bookmarks": {
+        "columns": ["user_id", "url", "folder", "created_at"],
+        "indexes": [
+            ("UNIQUE", ["user_id", "url"]),
+            ("", ["user_id", "created_at DESC", "id DESC"]),
+            ("", ["user_id", "folder", "created_at DESC", "id DESC"]),
+        ],
+        "terms": True,
+    },
+    "history": {
+        "columns": ["user_id", "url", "visited_at"],
+        "indexes": [
+            ("UNIQUE", ["user_id", "url"]),
+            ("", ["user_id", "visited_at DESC", "id DESC"]),
+        ],
+        "terms": True,
+    },
+    "history_archive": {
+        "columns": ["user_id", "month"],
+        "indexes": [("UNIQUE", ["user_id", "month"])],
+        "terms": True,
+    },
+    "daily_insights": {
+        "columns": ["user_id", "day"],
+        "indexes": [("UNIQUE", ["user_id", "day"])],
+    },
+    "settings": {
+        "columns": ["user_id"],
+        "indexes": [("UNIQUE", ["user_id"])],
+    },
+    "focus_sessions": {
+        "columns": ["user_id", "active", "created_at"],
+        "indexes": [
+            ("", ["user_id", "active"]),
+            ("", ["user_id", "created_at DESC", "id DESC"]),
+        ],
+    },
+    "downloads": {
+        "columns": ["user_id", "status", "started_at"],
+        "indexes": [("", ["user_id", "started_at DESC", "id DESC"])],
+    },
+    "users": {
+        "columns": ["email"],
+        "indexes": [("UNIQUE", ["email"])],
+    },
+    "sessions": {
+        "columns": ["token", "user_id", "expires_at"],
+        "indexes": [
+            ("UNIQUE", ["token"]),
+            ("", ["user_id"]),
+            ("", ["expires_at"]),
+        ],
+    },
+    "voice_conversations": {
+        "columns": ["updated_at"],
+        "indexes": [("", ["updated_at"])],
+        # Conversation ids are client strings, not ObjectIds
+        "object_ids": False,
+    },
+    "page_contexts": {
+        "columns": ["expires_at"],
+        "indexes": [("", ["expires_at"])],
+        # Keyed by content hash
+        "object_ids": False,
+    },
+}
+
+# Fields decoded back to datetimes when reading documents
+DATETIME_FIELDS = {
+    "created_at", "updated_at", "visited_at", "started_at", "completed_at",
+    "ended_at", "expires_at", "last_login",
+}
+# Fields holding bytes, kept as base64 inside the JSON document
+BINARY_FIELDS = {"packed"}
+
+# Representative route queries checked with EXPLAIN QUERY PLAN:
+# (name, table, filter columns, sort column)
+ROUTE_QUERIES = [
+    ("auth.login", "users", ["email"], None),
+    ("auth.verify", "sessions", ["token"], None),
+    ("data.get_bookmarks", "bookmarks", ["user_id"], "created_at"),
+    ("data.get_bookmarks.folder", "bookmarks", ["user_id", "folder"], "created_at"),
+    ("data.add_history", "history", ["user_id", "url"], None),
+    ("data.get_history", "history", ["user_id"], "visited_at"),
+    ("data.get_settings", "settings", ["user_id"], None),
+    ("focus.active", "focus_sessions", ["user_id", "active"], None),
+    ("focus.history", "focus_sessions", ["user_id"], "created_at"),
+    ("downloads.list", "downloads", ["user_id"], "started_at"),
+]
+
+
+def _column_value(value):
+    """Representation of a document field in an indexed column"""
+    if isinstance(value, datetime):
+        # Fixed width, so text order is time order
+        return value.isoformat(timespec="microseconds")
+    if isinstance(value, bool):
+        return int(value)
+    if isinstance(value, ObjectId):
+        return str(value)
+    return value
+
+
+def _unexpired(doc: Optional[dict]) -> Optional[dict]:
+    """doc, or None once its expires_at has passed (pruning only runs periodically)"""
+    if doc is None or doc["expires_at"] <= datetime.utcnow():
+        return None
+    return doc
+
+
+# terms_version of a document, 0 when it predates versioning; an indexed expression
+_TERMS_VERSION = "COALESCE(json_extract(doc, '$.terms_version'), 0)"
+
+
+def _prefix_end(prefix: str) -> str:
+    """Smallest string greater than every string starting with prefix"""
+    return prefix[:-1] + chr(ord(prefix[-1]) + 1)
+
+
+def _select_sql(table: str, where: List[str], sort_key: Optional[str] = None, after: bool = False) -> str:
+    sql = f"SELECT id, doc FROM {table}"
+    clauses = [f"{column} = ?" for column in where]
+    if after:
+        clauses.append(f"({sort_key} < ? OR ({sort_key} = ? AND id < ?))")
+    if clauses:
+        sql += " WHERE " + " AND ".join(clauses)
+    if sort_key:
+        sql += f" ORDER BY {sort_key} DESC, id DESC"
+    return sql + " LIMIT ?"
+
+
+class SQLiteStorage(Storage):
+    """Storage in a local SQLite file (WAL mode)
+
+    One connection is used from a single worker thread, which serializes
+    writes without blocking the event loop. Read-modify-write updates run
+    inside a transaction on that thread, so they are atomic for the one
+    process that owns the file.
+    """
+
+    name = "sqlite"
+
+    def __init__(self, path: str = SQLITE_PATH):
+        self.path = path
+        self.conn: Optional[sqlite3.Connection] = None
+        self.executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="sqlite")
+        self.pruner: Optional[asyncio.Task] = None
+
+    async def _run(self, fn, *args):
+        """Run fn(*args) on the database thread"""
+        return await asyncio.get_running_loop().run_in_executor(self.executor, self._call, fn, args)
+
+    def _call(self, fn, args):
+        if self.conn is None:
+            self._open()
+        return fn(*args)
+
+    def _open(self):
+        conn = sqlite3.connect(self.path)
+        conn.execute("PRAGMA journal_mode=WAL")
+        # Durable across application crashes; only an OS crash can lose the last commits
+        conn.execute("PRAGMA synchronous=NORMAL")
+        conn.execute("PRAGMA busy_timeout=5000")
+        conn.execute("PRAGMA temp_store=MEMORY")
+        with conn:
+            for table, spec in TABLES.items():
+                columns = ", ".join(spec["columns"])
+                conn.execute(f"CREATE TABLE IF NOT EXISTS {table} (id TEXT PRIMARY KEY, {columns}, doc TEXT NOT NULL)")
+                for unique, columns in spec["indexes"]:
+                    name = f"{table}_" + "_".join(column.split()[0] for column in columns)
+                    conn.execute(f"CREATE {unique} INDEX IF NOT EXISTS {name} ON {table} ({', '.join(columns)})")
+                if spec.get("terms"):
+                    conn.execute(
+                        f"CREATE TABLE IF NOT EXISTS {table}_terms "
+                        f"(user_id TEXT, term TEXT, doc_id TEXT, PRIMARY KEY (user_id, term, doc_id)) WITHOUT ROWID"
+                    )
+                    conn.execute(f"CREATE INDEX IF NOT EXISTS {table}_terms_doc_id ON {table}_terms (doc_id)")
+                    # Finds documents the startup backfill has to reindex
+                    conn.execute(f"CREATE INDEX IF NOT EXISTS {table}_terms_version ON {table} ({_TERMS_VERSION})")
+        self.conn = conn
+        logger.info(f"Opened SQLite database: {self.path}")
+
+    async def connect(self):
+        await self._run(self._prune)
+        self.pruner = asyncio.create_task(self._prune_periodically())
+
+    async def close(self):
+        if self.pruner is not None:
+            self.pruner.cancel()
+            await asyncio.gather(self.pruner, return_exceptions=True)
+        await self._run(self._close)
+        self.executor.shutdown(wait=True)
+
+    def _close(self):
+        if self.conn is not None:
+            self.conn.execute("PRAGMA optimize")
+            self.conn.close()
+            self.conn = None
+
+    def _prune(self):
+        """Remove expired rows (Mongo does this with TTL indexes)"""
+        now = datetime.utcnow()
+        with self.conn:
+            self.conn.execute("DELETE FROM sessions WHERE expires_at < ?", (_column_value(now),))
+            stale = now - timedelta(seconds=VOICE_CONVERSATION_TTL)
+            self.conn.execute("DELETE FROM voice_conversations WHERE updated_at < ?", (_column_value(stale),))
+            self.conn.execute("DELETE FROM page_contexts WHERE expires_at < ?", (_column_value(now),))
+
+    async def _prune_periodically(self):
+        """Keep pruning while the process runs, as Mongo's TTL monitor does"""
+        while True:
+            await asyncio.sleep(SQLITE_PRUNE_INTERVAL)
+            try:
+                await self._run(self._prune)
+            except Exception as e:
+                logger.error(f"SQLite pruning failed: {e}")
+
+    async def index_report(self) -> dict:
+        plans = await self._run(self._explain)
+        return {
+            "backend": self.name,
+            "collscans": [plan["query"] for plan in plans if plan["collscan"]],
+            "plans": plans
+        }
+
+    def _explain(self) -> List[dict]:
+        report = []
+        for name, table, where, sort_key in ROUTE_QUERIES:
+            sql = _select_sql(table, where, sort_key, after=bool(sort_key))
+            params = [None] * (sql.count("?"))
+            steps = [row[3] for row in self.conn.execute(f"EXPLAIN QUERY PLAN {sql}", params)]
+            report.append({
+                "query": name,
+                "table": table,
+                "plan": steps,
+                # A SCAN without an index reads the whole table
+                "collscan": any(step.startswith("SCAN") and "INDEX" not in step for step in steps),
+                "temp_sort": any("TEMP B-TREE" in step for step in steps)
+            })
+        return report
+
+    # ============ Documents ============
+
+    @staticmethod
+    def _decode(table: str, row) -> dict:
+        doc = orjson.loads(row[1])
+        for field in DATETIME_FIELDS.intersection(doc):
+            if isinstance(doc[field], str):
+                doc[field] = datetime.fromisoformat(doc[field])
+        for field in BINARY_FIELDS.intersection(doc):
+            doc[field] = base64.b64decode(doc[field])
+        doc_id = row[0]
+        if TABLES[table].get("object_ids", True):
+            doc_id = ObjectId(doc_id)
+        return {"_id": doc_id, **doc}
+
+    def _write(self, table: str, doc: dict, replace: bool = False) -> str:
+        """Insert (or replace by id) a document and its indexed columns"""
+        doc = dict(doc)
+        doc_id = str(doc.pop("_id", None) or ObjectId())
+        for field in BINARY_FIELDS.intersection(doc):
+            doc[field] = base64.b64encode(doc[field]).decode()
+        spec = TABLES[table]
+        columns = ["id"] + spec["columns"] + ["doc"]
+        values = [doc_id] + [_column_value(doc.get(column)) for column in spec["columns"]]
+        values.append(orjson.dumps(doc, default=bson_default).decode())
+        verb = "INSERT OR REPLACE" if replace else "INSERT"
+        self.conn.execute(
+            f"{verb} INTO {table} ({', '.join(columns)}) VALUES ({', '.join('?' * len(columns))})",
+            values
+        )
+        if spec.get("terms"):
+            self.conn.execute(f"DELETE FROM {table}_terms WHERE doc_id = ?", (doc_id,))
+            self.conn.executemany(
+                f"INSERT OR IGNORE INTO {table}_terms (user_id, term, doc_id) VALUES (?, ?, ?)",
+                [(doc.get("user_id"), term, doc_id) for term in doc.get("search_terms", [])]
+            )
+        return doc_id
+
+    def _insert(self, table: str, doc: dict) -> str:
+        with self.conn:
+            return self._write(table, doc)
+
+    def _find_one(self, table: str, where: dict) -> Optional[dict]:
+        row = self.conn.execute(
+            _select_sql(table, list(where)),
+            [_column_value(value) for value in where.values()] + [1]
+        ).fetchone()
+        return self._decode(table, row) if row else None
+
+    def _find_by_id(self, table: str, doc_id) -> Optional[dict]:
+        row = self.conn.execute(f"SELECT id, doc FROM {table} WHERE id = ?", (str(doc_id),)).fetchone()
+        return self._decode(table, row) if row else None
+
+    def _update(self, table: str, doc_id, fields: dict) -> Optional[dict]:
+        """Set fields on a document by id, returning the updated document"""
+        with self.conn:
+            doc = self._find_by_id(table, doc_id)
+            if doc is None:
+                return None
+            doc.update(fields)
+            self._write(table, doc, replace=True)
+            return doc
+
+    def _delete(self, table: str, where: dict) -> int:
+        clauses = " AND ".join(f"{column} = ?" for column in where)
+        params = [_column_value(value) for value in where.values()]
+        with self.conn:
+            if TABLES[table].get("terms"):
+                self.conn.execute(
+                    f"DELETE FROM {table}_terms WHERE doc_id IN (SELECT id FROM {table} WHERE {clauses})", params
+                )
+            return self.conn.execute(f"DELETE FROM {table} WHERE {clauses}", params).rowcount
+
+    def _select(self, table: str, where: dict, sort_key: str, limit: int,
+                after: Optional[Tuple[object, str]] = None) -> List[dict]:
+        params = [_column_value(value) for value in where.values()]
+        if after:
+            value = _column_value(after[0])
+            params += [value, value, str(after[1])]
+        rows = self.conn.execute(_select_sql(table, list(where), sort_key, bool(after)), params + [limit])
+        return [self._decode(table, row) for row in rows]
+
+    async def _page(self, table: str, where: dict, sort_key: str, limit: int,
+                    cursor: Optional[str] = None, strip_terms: bool = False) -> Page:
+        limit = pagination.clamp_limit(limit)
+        after = pagination.decode_cursor(cursor) if cursor else None
+        # Fetch one extra document to learn whether another page exists
+        docs = await self._run(self._select, table, where, sort_key, limit + 1, after)
+        next_cursor = None
+        if len(docs) > limit:
+            docs = docs[:limit]
+            next_cursor = pagination.encode_cursor(docs[-1].get(sort_key), docs[-1]["_id"])
+        if strip_terms:
+            for doc in docs:
+                search_index.strip_index_fields(doc)
+        return docs, next_cursor
+
+    async def _iter(self, table: str, where: dict, sort_key: str, limit: Optional[int] = None,
+                    cursor: Optional[str] = None, strip_terms: bool = False) -> AsyncIterator[dict]:
+        """Documents in batches, continuing by keyset so no cursor spans awaits"""
+        after = pagination.decode_cursor(cursor) if cursor else None
+        remaining = limit
+        while remaining is None or remaining > 0:
+            batch = pagination.STREAM_BATCH_SIZE if remaining is None else min(remaining, pagination.STREAM_BATCH_SIZE)
+            docs = await self._run(self._select, table, where, sort_key, batch, after)
+            for doc in docs:
+                if strip_terms:
+                    search_index.strip_index_fields(doc)
+                yield doc
+            if len(docs) < batch:
+                return
+            if remaining is not None:
+                remaining -= len(docs)
+            after = (docs[-1].get(sort_key), docs[-1]["_id"])
+
+    # ============ Bookmarks ============
+
+    async def insert_bookmark(self, doc: dict) -> str:
+        return await self._run(self._insert, "bookmarks", doc)
+
+    @staticmethod
+    def _bookmark_query(user_id: str, folder: Optional[str]) -> dict:
+        query = {"user_id": user_id}
+        if folder:
+            query["folder"] = folder
+        return query
+
+    async def list_bookmarks(self, user_id: str, folder: Optional[str], limit: int,
+                             cursor: Optional[str] = None) -> Page:
+        return await self._page("bookmarks", self._bookmark_query(user_id, folder), "created_at",
+                                limit, cursor, strip_terms=True)
+
+    def iter_bookmarks(self, user_id: str, folder: Optional[str] = None, limit: Optional[int] = None,
+                       cursor: Optional[str] = None) -> AsyncIterator[dict]:
+        return self._iter("bookmarks", self._bookmark_query(user_id, folder), "created_at",
+                          limit, cursor, strip_terms=True)
+
+    async def delete_bookmark(self, user_id: str, bookmark_id: str) -> bool:
+        return await self._run(self._delete, "bookmarks", {"id": bookmark_id, "user_id": user_id}) > 0
+
+    # ============ History ============
+
+    def _upsert_visit(self, user_id: str, visit: HistoryVisit) -> Tuple[str, bool]:
+        """Apply one coalesced visit, returning (id, inserted)"""
+        url, title, favicon, visited_at, visits = visit
+        doc = self._find_one("history", {"user_id": user_id, "url": url})
+        inserted = doc is None
+        if inserted:
+            doc = {"user_id": user_id, "url": url, "visit_count": 0,
+                   "visited_at": visited_at, "last_visit_duration": None}
+        doc.update(title=title, favicon=favicon, **search_index.search_fields(url, title))
+        # Keep the newest timestamp when queued visits arrive late
+        doc["visited_at"] = max(doc["visited_at"], visited_at)
+        doc["visit_count"] = doc.get("visit_count", 0) + visits
+        return self._write("history", doc, replace=not inserted), inserted
+
+    async def upsert_history(self, user_id: str, visit: HistoryVisit) -> str:
+        def upsert():
+            with self.conn:
+                return self._upsert_visit(user_id, visit)[0]
+        return await self._run(upsert)
+
+    async def upsert_history_batch(self, user_id: str, visits: List[HistoryVisit]) -> Dict[str, int]:
+        def upsert():
+            counts = {"inserted": 0, "updated": 0}
+            with self.conn:
+                for visit in visits:
+                    _, inserted = self._upsert_visit(user_id, visit)
+                    counts["inserted" if inserted else "updated"] += 1
+            return counts
+        return await self._run(upsert)
+
+    async def list_history(self, user_id: str, limit: int, cursor: Optional[str] = None) -> Page:
+        return await self._page("history", {"user_id": user_id}, "visited_at", limit, cursor, strip_terms=True)
+
+    def iter_history(self, user_id: str, limit: Optional[int] = None,
+                     cursor: Optional[str] = None) -> AsyncIterator[dict]:
+        return self._iter("history", {"user_id": user_id}, "visited_at", limit, cursor, strip_terms=True)
+
+    async def clear_history(self, user_id: str) -> int:
+        return await self._run(self._delete, "history", {"user_id": user_id})
+
+    async def history_users(self) -> List[str]:
+        def select():
+            return [row[0] for row in self.conn.execute("SELECT DISTINCT user_id FROM history")]
+        return await self._run(select)
+
+    async def count_history(self, user_id: str, before: Optional[datetime] = None) -> int:
+        def count():
+            sql, params = "SELECT COUNT(*) FROM history WHERE user_id = ?", [user_id]
+            if before:
+                sql += " AND visited_at < ?"
+                params.append(_column_value(before))
+            return self.conn.execute(sql, params).fetchone()[0]
+        return await self._run(count)
+
+    async def oldest_history(self, user_id: str, limit: int) -> List[dict]:
+        def select():
+            rows = self.conn.execute(
+                "SELECT id, doc FROM history WHERE user_id = ? ORDER BY visited_at, id LIMIT ?", (user_id, limit)
+            )
+            docs = [self._decode("history", row) for row in rows]
+            for doc in docs:
+                search_index.strip_index_fields(doc)
+            return docs
+        return await self._run(select)
+
+    async def delete_history(self, user_id: str, ids: Optional[list] = None,
+                             before: Optional[datetime] = None) -> int:
+        def delete():
+            clauses, params = ["user_id = ?"], [user_id]
+            if ids is not None:
+                clauses.append(f"id IN ({', '.join('?' * len(ids))})")
+                params += [str(doc_id) for doc_id in ids]
+            if before:
+                clauses.append("visited_at < ?")
+                params.append(_column_value(before))
+            where = " AND ".join(clauses)
+            with self.conn:
+                self.conn.execute(f"DELETE FROM history_terms WHERE doc_id IN (SELECT id FROM history WHERE {where})", params)
+                return self.conn.execute(f"DELETE FROM history WHERE {where}", params).rowcount
+        return await self._run(delete)
+
+    async def search_candidates(self, collection: str, user_id: str, terms: List[str], limit: int) -> List[dict]:
+        def search():
+            # One index range scan per term, intersected
+            subquery = " INTERSECT ".join(
+                f"SELECT doc_id FROM {collection}_terms WHERE user_id = ? AND term >= ? AND term < ?"
+                for _ in terms
+            )
+            params = []
+            for term in terms:
+                params += [user_id, term, _prefix_end(term)]
+            recency = search_index.RECENCY_FIELDS[collection]
+            rows = self.conn.execute(
+                f"SELECT id, doc FROM {collection} WHERE id IN ({subquery}) "
+                f"ORDER BY {recency} DESC, id DESC LIMIT ?", params + [limit]
+            )
+            return [self._decode(collection, row) for row in rows]
+        return await self._run(search)
+
+    async def backfill_search_terms(self, batch_size: int = 500) -> int:
+        def backfill(table: str) -> int:
+            rows = self.conn.execute(
+                f"SELECT id, doc FROM {table} WHERE {_TERMS_VERSION} < ? LIMIT ?",
+                (search_index.TERMS_VERSION, batch_size)
+            ).fetchall()
+            with self.conn:
+                for row in rows:
+                    doc = self._decode(table, row)
+                    doc.update(fresh_search_fields(table, doc))
+                    self._write(table, doc, replace=True)
+            return len(rows)
+
+        updated = 0
+        for table in SEARCH_COLLECTIONS:
+            # One batch per call so other requests interleave; rewritten rows leave the filter
+            while True:
+                count = await self._run(backfill, table)
+                updated += count
+                if count < batch_size:
+                    break
+        return updated
+
+    # ============ History archive ============
+
+    async def find_archive_bucket(self, user_id: str, month: str) -> Optional[dict]:
+        return await self._run(self._find_one, "history_archive", {"user_id": user_id, "month": month})
+
+    async def save_archive_bucket(self, doc: dict):
+        def save():
+            with self.conn:
+                existing = self._find_one("history_archive", {"user_id": doc["user_id"], "month": doc["month"]})
+                self._write("history_archive", {**doc, "_id": existing["_id"] if existing else None},
+                            replace=existing is not None)
+        await self._run(save)
+
+    async def list_archive_buckets(self, user_id: str) -> List[dict]:
+        def select():
+            rows = self.conn.execute("SELECT id, doc FROM history_archive WHERE user_id = ? ORDER BY month", (user_id,))
+            return [self._decode("history_archive", row) for row in rows]
+        return await self._run(select)
+
+    async def delete_archive_buckets(self, user_id: str, months: Optional[List[str]] = None) -> int:
+        if months is None:
+            return await self._run(self._delete, "history_archive", {"user_id": user_id})
+        deleted = 0
+        for month in months:
+            deleted += await self._run(self._delete, "history_archive", {"user_id": user_id, "month": month})
+        return deleted
+
+    # ============ Insights ============
+
+    async def increment_rollups(self, increments: Dict[Tuple[str, str], Dict[str, int]]) -> Dict[Tuple[str, str], Dict[str, int]]:
+        def increment():
+            with self.conn:
+                for (user_id, day), counters in increments.items():
+                    doc = self._find_one("daily_insights", {"user_id": user_id, "day": day})
+                    inserted = doc is None
+                    if inserted:
+                        doc = {"user_id": user_id, "day": day}
+                    for path, amount in counters.items():
+                        *parents, field = path.split(".", 1)
+                        target = doc
+                        for parent in parents:
+                            target = target.setdefault(parent, {})
+                        target[field] = target.get(field, 0) + amount
+                    self._write("daily_insights", doc, replace=not inserted)
+        # One transaction: it either all applies or raises
+        await self._run(increment)
+        return {}
+
+    async def list_rollups(self, user_id: str, since_day: str) -> List[dict]:
+        def select():
+            rows = self.conn.execute(
+                "SELECT id, doc FROM daily_insights WHERE user_id = ? AND day >= ?", (user_id, since_day)
+            )
+            return [self._decode("daily_insights", row) for row in rows]
+        return await self._run(select)
+
+    async def delete_rollups(self, user_id: str) -> int:
+        return await self._run(self._delete, "daily_insights", {"user_id": user_id})
+
+    # ============ Settings ============
+
+    async def find_settings(self, user_id: str) -> Optional[dict]:
+        return await self._run(self._find_one, "settings", {"user_id": user_id})
+
+    async def find_or_create_settings(self, user_id: str, defaults: dict) -> dict:
+        def find_or_create():
+            with self.conn:
+                doc = self._find_one("settings", {"user_id": user_id})
+                if doc is None:
+                    doc = {**defaults, "user_id": user_id}
+                    doc["_id"] = ObjectId(self._write("settings", doc))
+                return doc
+        return await self._run(find_or_create)
+
+    async def update_settings(self, user_id: str, fields: dict) -> bool:
+        def update():
+            with self.conn:
+                doc = self._find_one("settings", {"user_id": user_id})
+                if doc is None:
+                    self._write("settings", {"user_id": user_id, **fields})
+                    return True
+                changed = any(doc.get(key) != value for key, value in fields.items())
+                doc.update(fields)
+                self._write("settings", doc, replace=True)
+                return changed
+        return await self._run(update)
+
+    # ============ Focus sessions ============
+
+    async def start_focus_session(self, doc: dict) -> str:
+        def start():
+            with self.conn:
+                active = self._select("focus_sessions", {"user_id": doc["user_id"], "active": True}, "created_at", 100)
+                for session in active:
+                    session.update(active=False, ended_at=datetime.utcnow())
+                    self._write("focus_sessions", session, replace=True)
+                return self._write("focus_sessions", doc)
+        return await self._run(start)
+
+    async def find_active_focus_session(self, user_id: str) -> Optional[dict]:
+        return await self._run(self._find_one, "focus_sessions", {"user_id": user_id, "active": True})
+
+    async def record_focus_check(self, session_id, allowed: bool) -> Optional[dict]:
+        def record():
+            with self.conn:
+                doc = self._find_by_id("focus_sessions", session_id)
+                if doc is None:
+                    return None
+                doc["urls_checked"] = doc.get("urls_checked", 0) + 1
+                key = "urls_allowed" if allowed else "urls_blocked"
+                doc[key] = doc.get(key, 0) + 1
+                self._write("focus_sessions", doc, replace=True)
+                return doc
+        return await self._run(record)
+
+    async def end_focus_session(self, session_id) -> Optional[str]:
+        def end():
+            with self.conn:
+                doc = self._find_by_id("focus_sessions", session_id)
+                if doc is None or not doc.get("active"):
+                    return None
+                doc.update(active=False, ended_at=datetime.utcnow())
+                self._write("focus_sessions", doc, replace=True)
+                return doc["user_id"]
+        return await self._run(end)
+
+    async def list_focus_sessions(self, user_id: str, limit: int, cursor: Optional[str] = None) -> Page:
+        return await self._page("focus_sessions", {"user_id": user_id}, "created_at", limit, cursor)
+
+    def iter_focus_sessions(self, user_id: str, limit: Optional[int] = None,
+                            cursor: Optional[str] = None) -> AsyncIterator[dict]:
+        return self._iter("focus_sessions", {"user_id": user_id}, "created_at", limit, cursor)
+
+    # ============ Downloads ============
+
+    async def insert_download(self, doc: dict) -> str:
+        return await self._run(self._insert, "downloads", doc)
+
+    async def find_download(self, download_id: str) -> Optional[dict]:
+        return await self._run(self._find_by_id, "downloads", download_id)
+
+    async def update_download(self, download_id: str, fields: dict) -> bool:
+        def update():
+            doc = self._find_by_id("downloads", download_id)
+            if doc is None or all(doc.get(key) == value for key, value in fields.items()):
+                return False
+            return self._update("downloads", download_id, fields) is not None
+        return await self._run(update)
+
+    async def delete_download(self, download_id: str) -> bool:
+        return await self._run(self._delete, "downloads", {"id": download_id}) > 0
+
+    async def delete_downloads(self, user_id: str, status: Optional[str] = None) -> int:
+        where = {"user_id": user_id}
+        if status:
+            where["status"] = status
+        return await self._run(self._delete, "downloads", where)
+
+    async def list_downloads_by_status(self, status: str, limit: int = 1000) -> List[dict]:
+        docs = await self._run(self._select, "downloads", {"status": status}, "started_at", limit)
+        return docs[::-1]
+
+    async def list_downloads(self, user_id: str, limit: int, cursor: Optional[str] = None) -> Page:
+        return await self._page("downloads", {"user_id": user_id}, "started_at", limit, cursor)
+
+    def iter_downloads(self, user_id: str, limit: Optional[int] = None,
+                       cursor: Optional[str] = None) -> AsyncIterator[dict]:
+        return self._iter("downloads", {"user_id": user_id}, "started_at", limit, cursor)
+
+    # ============ Users and auth sessions ============
+
+    async def insert_user(self, doc: dict) -> str:
+        return await self._run(self._insert, "users", doc)
+
+    async def find_user(self, user_id: str) -> Optional[dict]:
+        return await self._run(self._find_by_id, "users", user_id)
+
+    async def find_user_by_email(self, email: str) -> Optional[dict]:
+        return await self._run(self._find_one, "users", {"email": email})
+
+    async def update_user(self, user_id: str, fields: dict) -> bool:
+        return await self._run(self._update, "users", user_id, fields) is not None
+
+    async def insert_session(self, doc: dict):
+        await self._run(self._insert, "sessions", doc)
+
+    async def find_session(self, token: str) -> Optional[dict]:
+        return _unexpired(await self._run(self._find_one, "sessions", {"token": token}))
+
+    async def delete_session(self, token: str) -> bool:
+        return await self._run(self._delete, "sessions", {"token": token}) > 0
+
+    # ============ Voice conversations ============
+
+    async def load_conversation(self, conversation_id: str) -> Optional[dict]:
+        doc = await self._run(self._find_by_id, "voice_conversations", conversation_id)
+        # Expired but not yet pruned
+        if doc is None or doc["updated_at"] < datetime.utcnow() - timedelta(seconds=VOICE_CONVERSATION_TTL):
+            return None
+        return doc
+
+    async def save_conversation(self, doc: dict):
+        def save():
+            with self.conn:
+                self._write("voice_conversations", doc, replace=True)
+        await self._run(save)
+
+    async def delete_conversation(self, conversation_id: str) -> bool:
+        return await self._run(self._delete, "voice_conversations", {"id": conversation_id}) > 0
+
+    # ============ Page contexts ============
+
+    async def find_page_context(self, handle: str) -> Optional[dict]:
+        return _unexpired(await self._run(self._find_by_id, "page_contexts", handle))
+
+    async def save_page_context(self, doc: dict):
+        def save():
+            with self.conn:
+                self._write("page_contexts", doc, replace=True)
+        await self._run(save)
+
+    async def touch_page_context(self, handle: str, expires_at: datetime):
+        # Patches the stored JSON in place instead of rewriting a large document
+        def touch():
+            value = _column_value(expires_at)
+            with self.conn:
+                self.conn.execute(
+                    "UPDATE page_contexts SET expires_at = ?, doc = json_set(doc, '$.expires_at', ?) WHERE id = ?",
+                    (value, value, handle)
+                )
+        await self._run(touch)
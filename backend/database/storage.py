@@ -0,0 +1,320 @@
+"""Storage interface behind DatabaseService, auth and downloads"""
+import os
+from abc import ABC, abstractmethod
+from datetime import datetime
+from typing import AsyncIterator, Dict, List, Optional, Tuple
+
+# "mongodb" for the server, "sqlite" for the single-user desktop build
+STORAGE_BACKEND = os.getenv("STORAGE_BACKEND", "mongodb").lower()
+
+# A page of documents and the continuation token for the next one
+Page = Tuple[List[dict], Optional[str]]
+# (url, title, favicon, visited_at, visits) for one coalesced history upsert
+HistoryVisit = Tuple[str, str, Optional[str], datetime, int]
+
+
+class Storage(ABC):
+    """Document storage for every collection the API uses
+
+    Documents go in and come out shaped like the Mongo documents the
+    routes have always returned ("_id" is an ObjectId, timestamps are
+    naive UTC datetimes), so callers don't care which backend is active.
+    List methods page newest first with the keyset cursors from
+    services.pagination.
+    """
+
+    name = "abstract"
+    # True while change notifications from other processes are flowing
+    watching = False
+
+    async def connect(self):
+        """Open connections and start any background maintenance"""
+
+    async def close(self):
+        """Release connections"""
+
+    async def index_report(self) -> dict:
+        """Index state and whether representative queries use them"""
+        return {"backend": self.name}
+
+    async def watch(self, collections: List[str]) -> AsyncIterator[Tuple[str, Optional[str], Optional[dict]]]:
+        """Yield (collection, user_id, document) for writes, including other processes'
+
+        user_id is None when the change can't be attributed to one user;
+        document is the written document as it now stands, when known.
+        Backends without other writers yield nothing.
+        """
+        return
+        yield
+
+    # ============ Bookmarks ============
+
+    @abstractmethod
+    async def insert_bookmark(self, doc: dict) -> str:
+        ...
+
+    @abstractmethod
+    async def list_bookmarks(self, user_id: str, folder: Optional[str], limit: int,
+                             cursor: Optional[str] = None) -> Page:
+        ...
+
+    @abstractmethod
+    def iter_bookmarks(self, user_id: str, folder: Optional[str] = None, limit: Optional[int] = None,
+                       cursor: Optional[str] = None) -> AsyncIterator[dict]:
+        ...
+
+    @abstractmethod
+    async def delete_bookmark(self, user_id: str, bookmark_id: str) -> bool:
+        """Delete one of a user's bookmarks (False if they have none with this id)"""
+
+    # ============ History ============
+
+    @abstractmethod
+    async def upsert_history(self, user_id: str, visit: HistoryVisit) -> str:
+        """Record visits to a URL, returning the history entry's id"""
+
+    @abstractmethod
+    async def upsert_history_batch(self, user_id: str, visits: List[HistoryVisit]) -> Dict[str, int]:
+        """Record visits to many URLs, returning inserted and updated counts"""
+
+    @abstractmethod
+    async def list_history(self, user_id: str, limit: int, cursor: Optional[str] = None) -> Page:
+        ...
+
+    @abstractmethod
+    def iter_history(self, user_id: str, limit: Optional[int] = None,
+                     cursor: Optional[str] = None) -> AsyncIterator[dict]:
+        ...
+
+    @abstractmethod
+    async def clear_history(self, user_id: str) -> int:
+        ...
+
+    @abstractmethod
+    async def search_candidates(self, collection: str, user_id: str, terms: List[str], limit: int) -> List[dict]:
+        """Bookmarks or history whose search_terms prefix-match every term"""
+
+    @abstractmethod
+    async def history_users(self) -> List[str]:
+        """Every user with hot history entries"""
+
+    @abstractmethod
+    async def count_history(self, user_id: str, before: Optional[datetime] = None) -> int:
+        ...
+
+    @abstractmethod
+    async def oldest_history(self, user_id: str, limit: int) -> List[dict]:
+        """A user's least recently visited history entries, oldest first"""
+
+    @abstractmethod
+    async def delete_history(self, user_id: str, ids: Optional[list] = None,
+                             before: Optional[datetime] = None) -> int:
+        """Delete a user's history entries by id or last visit time"""
+
+    async def backfill_search_terms(self, batch_size: int = 500) -> int:
+        """Recompute search_terms that are missing or older than the tokenizer (terms_version)"""
+        return 0
+
+    # ============ History archive ============
+
+    @abstractmethod
+    async def find_archive_bucket(self, user_id: str, month: str) -> Optional[dict]:
+        ...
+
+    @abstractmethod
+    async def save_archive_bucket(self, doc: dict):
+        """Create or replace the bucket for doc's (user_id, month)"""
+
+    @abstractmethod
+    async def list_archive_buckets(self, user_id: str) -> List[dict]:
+        """A user's archive buckets, oldest month first"""
+
+    @abstractmethod
+    async def delete_archive_buckets(self, user_id: str, months: Optional[List[str]] = None) -> int:
+        """Delete some (or all) of a user's archive buckets"""
+
+    # ============ Insights ============
+
+    @abstractmethod
+    async def increment_rollups(self, increments: Dict[Tuple[str, str], Dict[str, int]]) -> Dict[Tuple[str, str], Dict[str, int]]:
+        """Add counters to daily rollups keyed by (user_id, day), creating them as needed
+
+        Counter paths are "field" or "field.key"; keys contain no dots and
+        are never empty. Returns the increments that failed but may succeed
+        if retried; ones that can never succeed are logged and dropped.
+        Raising means none of them should be considered applied.
+        """
+
+    @abstractmethod
+    async def list_rollups(self, user_id: str, since_day: str) -> List[dict]:
+        """A user's daily rollups from since_day (YYYY-MM-DD) on"""
+
+    @abstractmethod
+    async def delete_rollups(self, user_id: str) -> int:
+        ...
+
+    # ============ Settings ============
+
+    @abstractmethod
+    async def find_settings(self, user_id: str) -> Optional[dict]:
+        ...
+
+    @abstractmethod
+    async def find_or_create_settings(self, user_id: str, defaults: dict) -> dict:
+        """A user's settings, created from defaults in one step if they have none"""
+
+    @abstractmethod
+    async def update_settings(self, user_id: str, fields: dict) -> bool:
+        """Set fields on a user's settings, creating them if needed"""
+
+    # ============ Focus sessions ============
+
+    @abstractmethod
+    async def start_focus_session(self, doc: dict) -> str:
+        """End the user's active sessions and insert a new one"""
+
+    @abstractmethod
+    async def find_active_focus_session(self, user_id: str) -> Optional[dict]:
+        ...
+
+    @abstractmethod
+    async def record_focus_check(self, session_id, allowed: bool) -> Optional[dict]:
+        """Count a URL check, returning the updated session"""
+
+    @abstractmethod
+    async def end_focus_session(self, session_id) -> Optional[str]:
+        """End an active session, returning its owner (None if not active)"""
+
+    @abstractmethod
+    async def list_focus_sessions(self, user_id: str, limit: int, cursor: Optional[str] = None) -> Page:
+        ...
+
+    @abstractmethod
+    def iter_focus_sessions(self, user_id: str, limit: Optional[int] = None,
+                            cursor: Optional[str] = None) -> AsyncIterator[dict]:
+        ...
+
+    # ============ Downloads ============
+
+    @abstractmethod
+    async def insert_download(self, doc: dict) -> str:
+        ...
+
+    @abstractmethod
+    async def find_download(self, download_id: str) -> Optional[dict]:
+        ...
+
+    @abstractmethod
+    async def update_download(self, download_id: str, fields: dict) -> bool:
+        ...
+
+    @abstractmethod
+    async def delete_download(self, download_id: str) -> bool:
+        ...
+
+    @abstractmethod
+    async def delete_downloads(self, user_id: str, status: Optional[str] = None) -> int:
+        ...
+
+    @abstractmethod
+    async def list_downloads_by_status(self, status: str, limit: int = 1000) -> List[dict]:
+        """Downloads of all users in a status, oldest first"""
+
+    @abstractmethod
+    async def list_downloads(self, user_id: str, limit: int, cursor: Optional[str] = None) -> Page:
+        ...
+
+    @abstractmethod
+    def iter_downloads(self, user_id: str, limit: Optional[int] = None,
+                       cursor: Optional[str] = None) -> AsyncIterator[dict]:
+        ...
+
+    # ============ Users and auth sessions ============
+
+    @abstractmethod
+    async def insert_user(self, doc: dict) -> str:
+        ...
+
+    @abstractmethod
+    async def find_user(self, user_id: str) -> Optional[dict]:
+        ...
+
+    @abstractmethod
+    async def find_user_by_email(self, email: str) -> Optional[dict]:
+        ...
+
+    @abstractmethod
+    async def update_user(self, user_id: str, fields: dict) -> bool:
+        ...
+
+    @abstractmethod
+    async def insert_session(self, doc: dict):
+        ...
+
+    @abstractmethod
+    async def find_session(self, token: str) -> Optional[dict]:
+        ...
+
+    @abstractmethod
+    async def delete_session(self, token: str) -> bool:
+        ...
+
+    # ============ Voice conversations ============
+
+    @abstractmethod
+    async def load_conversation(self, conversation_id: str) -> Optional[dict]:
+        ...
+
+    @abstractmethod
+    async def save_conversation(self, doc: dict):
+        ...
+
+    @abstractmethod
+    async def delete_conversation(self, conversation_id: str) -> bool:
+        ...
+
+    # ============ Page contexts ============
+
+    @abstractmethod
+    async def find_page_context(self, handle: str) -> Optional[dict]:
+        ...
+
+    @abstractmethod
+    async def save_page_context(self, doc: dict):
+        """Insert or replace a context document (_id is its content hash)"""
+
+    @abstractmethod
+    async def touch_page_context(self, handle: str, expires_at: datetime):
+        ...
+
+
+# Collections whose documents carry search_terms
+SEARCH_COLLECTIONS = ("bookmarks", "history", "history_archive")
+
+
+def fresh_search_fields(collection: str, doc: dict) -> dict:
+    """search_terms and terms_version the current tokenizer gives a document of a search collection"""
+    # Imported here: both modules import this one
+    from services import search_index, history_archive
+    if collection == "history_archive":
+        terms = history_archive.bucket_terms(history_archive.unpack(doc["packed"]))
+        return {"search_terms": terms, "terms_version": search_index.TERMS_VERSION}
+    return search_index.search_fields(doc.get("url", ""), doc.get("title", ""), doc.get("tags"))
+
+
+_storage: Optional[Storage] = None
+
+
+def get_storage() -> Storage:
+    """The configured storage backend (created on first use)"""
+    global _storage
+    if _storage is None:
+        if STORAGE_BACKEND == "sqlite":
+            from database.sqlite_storage import SQLiteStorage
+            _storage = SQLiteStorage()
+        elif STORAGE_BACKEND == "mongodb":
+            from database.mongo_storage import MongoStorage
+            _storage = MongoStorage()
+        else:
+            raise ValueError(f"Unknown STORAGE_BACKEND: {STORAGE_BACKEND}")
+    return _storage
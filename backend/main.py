@@ -2,13 +2,22 @@ from dotenv import load_dotenv
 import os
 load_dotenv()
 print("Loaded GROQ_API_KEY:", os.getenv("GROQ_API_KEY"))
-from fastapi import FastAPI, WebSocket, WebSocketDisconnect
+from fastapi import FastAPI
 from fastapi.middleware.cors import CORSMiddleware
 from fastapi.responses import JSONResponse
 import logging
+import asyncio
 
-from database.mongodb import connect_to_mongo, close_mongo_connection
-from routes import ai, voice, browser, proxy, data, focus, auth, downloads, voice_navigation
+from database.storage import get_storage
+from routes import ai, voice, browser, proxy, data, focus, auth, downloads, voice_navigation, realtime
+from services.command_cache import command_cache
+from services.database_service import db_service
+from services.insights import insights
+from services.history_archive import history_compactor
+from services.serialization import BSONResponse
+from services.http_client import close_http_client
+from services.download_engine import download_engine
+from services.download_progress import download_progress
 
 # Load environment variables
 
@@ -21,20 +30,48 @@ logger = logging.getLogger(__name__)
 app = FastAPI(
     title="Lernova Browser API",
     description="AI-powered browser with focus mode and intelligent features",
-    version="2.0.0"
+    version="2.0.0",
+    default_response_class=BSONResponse
 )
 
 # Startup and shutdown events
 @app.on_event("startup")
 async def startup_event():
     """Initialize database connection on startup"""
-    await connect_to_mongo()
+    await get_storage().connect()
+    command_cache.warm_up()
+    # (Re)index documents with missing or outdated search terms without delaying startup
+    app.state.search_backfill = asyncio.create_task(backfill_search_terms())
+    app.state.change_stream = asyncio.create_task(db_service.watch_changes())
+    app.state.insights = asyncio.create_task(insights.run())
+    app.state.history_compactor = asyncio.create_task(history_compactor.run())
+    app.state.download_progress = asyncio.create_task(download_progress.run())
+    app.state.download_resume = asyncio.create_task(download_engine.resume_pending())
     logger.info("✅ Lernova API started successfully")
 
+async def backfill_search_terms():
+    try:
+        updated = await db_service.backfill_search_terms()
+        if updated:
+            logger.info(f"Backfilled search terms on {updated} documents")
+    except Exception as e:
+        logger.error(f"Search term backfill failed: {e}")
+
 @app.on_event("shutdown")
 async def shutdown_event():
     """Close database connection on shutdown"""
-    await close_mongo_connection()
+    app.state.change_stream.cancel()
+    app.state.history_compactor.cancel()
+    # Cancelling the aggregator flushes its buffered counters
+    app.state.insights.cancel()
+    await asyncio.gather(app.state.insights, return_exceptions=True)
+    # Saves segment offsets so interrupted downloads resume on the next start
+    await download_engine.shutdown()
+    # Writes progress still held in memory
+    app.state.download_progress.cancel()
+    await asyncio.gather(app.state.download_progress, return_exceptions=True)
+    await close_http_client()
+    await get_storage().close()
     logger.info("✅ Lernova API shutdown complete")
 
 # CORS Configuration
@@ -57,6 +94,7 @@ app.include_router(proxy.router, prefix="/api/proxy", tags=["Proxy"])
 app.include_router(data.router, prefix="/api/data", tags=["Data Management"])
 app.include_router(focus.router, prefix="/api", tags=["Focus Mode"])
 app.include_router(downloads.router, prefix="/api", tags=["Downloads"])
+app.include_router(realtime.router, tags=["Realtime"])
 
 @app.get("/")
 async def root():
@@ -79,21 +117,10 @@ async def health_check():
     """Health check endpoint"""
     return {"status": "healthy"}
 
-@app.websocket("/ws")
-async def websocket_endpoint(websocket: WebSocket):
-    """WebSocket endpoint for real-time communication"""
-    await websocket.accept()
-    logger.info("WebSocket connection established")
-    
-    try:
-        while True:
-            data = await websocket.receive_text()
-            logger.info(f"Received: {data}")
-            
-            # Echo back for now - can be extended for real-time features
-            await websocket.send_text(f"Echo: {data}")
-    except WebSocketDisconnect:
-        logger.info("WebSocket connection closed")
+@app.get("/health/indexes")
+async def index_health():
+    """Index status and full-scan check of route queries"""
+    return await get_storage().index_report()
 
 if __name__ == "__main__":
     import uvicorn
@@ -1,4 +1,4 @@
-from pydantic import BaseModel, Field
+from pydantic import BaseModel, Field, model_validator
 from typing import Optional, List, Dict, Any
 from enum import Enum
 
@@ -33,6 +33,7 @@ class AIRequest(BaseModel):
     """AI assistant request"""
     query: str
     context: Optional[str] = Field(None, description="Page content or context")
+    context_handle: Optional[str] = Field(None, description="Handle of a registered page context, instead of context")
     page_url: Optional[str] = Field(None, description="Current page URL")
 
 class AIResponse(BaseModel):
@@ -44,15 +45,33 @@ class AIResponse(BaseModel):
 
 class SummarizeRequest(BaseModel):
     """Page summarization request"""
-    content: str = Field(..., description="Page content to summarize")
+    content: Optional[str] = Field(None, description="Page content to summarize; fetched from url when omitted")
+    context_handle: Optional[str] = Field(None, description="Handle of a registered page context, instead of content")
     url: Optional[str] = Field(None, description="Page URL")
 
+    @model_validator(mode="after")
+    def content_or_url(self):
+        if not self.content and not self.context_handle and not self.url:
+            raise ValueError("content, context_handle or url is required")
+        return self
+
 class QuestionRequest(BaseModel):
     """Question answering request"""
     question: str
-    context: str = Field(..., description="Page content or PDF text")
+    context: Optional[str] = Field(None, description="Page content or PDF text; fetched from url when omitted")
+    context_handle: Optional[str] = Field(None, description="Handle of a registered page context, instead of context")
     url: Optional[str] = None
 
+    @model_validator(mode="after")
+    def context_or_url(self):
+        if not self.context and not self.context_handle and not self.url:
+            raise ValueError("context, context_handle or url is required")
+        return self
+
+class PageContextRequest(BaseModel):
+    """Page text to register once and refer to by handle"""
+    text: str = Field(..., min_length=1, description="Page content or PDF text")
+
 class TTSRequest(BaseModel):
     """Text-to-speech request"""
     text: str
@@ -1,9 +1,12 @@
 from fastapi import APIRouter, HTTPException
-from models import AIRequest, AIResponse, SummarizeRequest, QuestionRequest, TTSRequest
+from models import AIRequest, AIResponse, SummarizeRequest, QuestionRequest, TTSRequest, PageContextRequest
 from pydantic import BaseModel
 from typing import List, Dict, Optional
 from services.langchain_utils import langchain_service
 from services.eleven_labs import eleven_labs_client
+from services.model_router import model_router
+from services.readability import readable_pages
+from services.page_context import page_contexts, PageContext, PAGE_CONTEXT_MAX_CHARS
 import logging
 import json
 import re
@@ -72,6 +75,28 @@ async def generate_website_suggestions(query: str, ai_response: str) -> List[Dic
         return []
 
 
+async def registered_context(handle: str) -> PageContext:
+    context = await page_contexts.get(handle)
+    if context is None:
+        raise HTTPException(status_code=404, detail="Unknown or expired context handle; register the page again")
+    return context
+
+
+async def page_context(content: Optional[str], handle: Optional[str], url: Optional[str]) -> PageContext:
+    """The page a request refers to: a registered handle, text sent inline, or the readable text of url"""
+    if handle:
+        return await registered_context(handle)
+    if content:
+        return await page_contexts.build(content)
+    if not url.startswith(('http://', 'https://')):
+        raise HTTPException(status_code=400, detail="Invalid URL")
+    page = await readable_pages.get(url)
+    text = f"{page['title']}\n\n{page['text']}" if page['title'] else page['text']
+    # Registered so follow-up questions about the page skip re-chunking
+    context, _ = await page_contexts.register(text)
+    return context
+
+
 class HighlightRequest(BaseModel):
     topic: str
     pageTitle: str
@@ -85,10 +110,14 @@ class WebsiteSuggestionRequest(BaseModel):
 async def chat(request: AIRequest):
     """General AI chat endpoint"""
     try:
+        context = request.context
+        if request.context_handle:
+            context = (await registered_context(request.context_handle)).text
+
         # Generate text response
         text_response = await langchain_service.general_chat(
             query=request.query,
-            context=request.context
+            context=context
         )
         
         # Generate voice response
@@ -108,19 +137,44 @@ async def chat(request: AIRequest):
             audio_base64=audio_base64,
             suggested_websites=suggested_websites
         )
+    except HTTPException:
+        raise
     except Exception as e:
         logger.error(f"Chat error: {e}")
         raise HTTPException(status_code=500, detail=str(e))
 
+@router.post("/context")
+async def register_context(request: PageContextRequest):
+    """Register page text once; later requests pass the returned handle instead of the text"""
+    if len(request.text) > PAGE_CONTEXT_MAX_CHARS:
+        raise HTTPException(status_code=413, detail=f"Context exceeds {PAGE_CONTEXT_MAX_CHARS} characters")
+    try:
+        context, created = await page_contexts.register(request.text)
+        return {**context.summary(), "created": created}
+    except Exception as e:
+        logger.error(f"Register context error: {e}")
+        raise HTTPException(status_code=500, detail=str(e))
+
+@router.get("/context/{handle}")
+async def get_context(handle: str):
+    """Whether a handle (SHA-256 of the UTF-8 text) is registered, so clients can skip the upload"""
+    context = await registered_context(handle)
+    return context.summary()
+
+async def summary_text(request: SummarizeRequest) -> str:
+    """The summary alone, for callers that send its audio another way"""
+    context = await page_context(request.content, request.context_handle, request.url)
+    return await langchain_service.summarize_content(
+        content=context.text,
+        url=request.url,
+        chunks=context.chunks
+    )
+
 @router.post("/summarize", response_model=AIResponse)
 async def summarize(request: SummarizeRequest):
     """Summarize webpage content"""
     try:
-        # Generate summary
-        summary = await langchain_service.summarize_content(
-            content=request.content,
-            url=request.url
-        )
+        summary = await summary_text(request)
         
         # Generate voice
         audio_base64 = await eleven_labs_client.text_to_speech(summary)
@@ -129,20 +183,27 @@ async def summarize(request: SummarizeRequest):
             text=summary,
             audio_base64=audio_base64
         )
+    except HTTPException:
+        raise
     except Exception as e:
         logger.error(f"Summarize error: {e}")
         raise HTTPException(status_code=500, detail=str(e))
 
+async def answer_text(request: QuestionRequest) -> str:
+    """The answer alone, for callers that send its audio another way"""
+    context = await page_context(request.context, request.context_handle, request.url)
+    return await langchain_service.answer_question(
+        question=request.question,
+        context=context.text,
+        url=request.url,
+        chunks=context.relevant_chunks(request.question)
+    )
+
 @router.post("/question", response_model=AIResponse)
 async def answer_question(request: QuestionRequest):
     """Answer question based on context"""
     try:
-        # Generate answer
-        answer = await langchain_service.answer_question(
-            question=request.question,
-            context=request.context,
-            url=request.url
-        )
+        answer = await answer_text(request)
         
         # Generate voice
         audio_base64 = await eleven_labs_client.text_to_speech(answer)
@@ -151,6 +212,8 @@ async def answer_question(request: QuestionRequest):
             text=answer,
             audio_base64=audio_base64
         )
+    except HTTPException:
+        raise
     except Exception as e:
         logger.error(f"Question error: {e}")
         raise HTTPException(status_code=500, detail=str(e))
@@ -197,6 +260,11 @@ async def suggest_websites(request: WebsiteSuggestionRequest):
         logger.error(f"Website suggestion error: {e}")
         raise HTTPException(status_code=500, detail=str(e))
 
+@router.get("/router-stats")
+async def router_stats():
+    """Model router configuration and per-endpoint decisions"""
+    return model_router.stats()
+
 @router.post("/highlight-important")
 async def highlight_important(request: HighlightRequest):
     """Analyze page content and identify important sections based on topic"""
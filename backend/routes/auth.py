@@ -1,14 +1,18 @@
 """Authentication routes for user login/signup"""
-from fastapi import APIRouter, HTTPException, Response
+from fastapi import APIRouter, Depends, HTTPException, Response
 from pydantic import BaseModel, EmailStr
 from typing import Optional
 from datetime import datetime, timedelta
-import hashlib
 import secrets
-from database.mongodb import get_database
+from database.storage import get_storage
+from services.password_hashing import password_hasher, needs_rehash, HashingOverloaded
+from services.session_cache import session_cache, current_user
 
 router = APIRouter()
 
+SESSION_DAYS = 30
+
+
 
 class UserSignup(BaseModel):
     email: EmailStr
@@ -28,9 +32,10 @@ class UserResponse(BaseModel):
     session_token: str
 
 
-def hash_password(password: str) -> str:
-    """Hash password using SHA-256"""
-    return hashlib.sha256(password.encode()).hexdigest()
+def overloaded() -> HTTPException:
+    """503 for when the password hashing queue is full"""
+    return HTTPException(status_code=503, detail="Too many sign-in attempts, retry shortly",
+                         headers={"Retry-After": "2"})
 
 
 def generate_session_token() -> str:
@@ -38,36 +43,49 @@ def generate_session_token() -> str:
     return secrets.token_urlsafe(32)
 
 
+async def create_session(user_id: str, email: str, name: str) -> str:
+    """Store a new session and cache it, so the client's first verify is free"""
+    session_token = generate_session_token()
+    expires_at = datetime.utcnow() + timedelta(days=SESSION_DAYS)
+    await get_storage().insert_session({
+        "user_id": user_id,
+        "token": session_token,
+        "created_at": datetime.utcnow(),
+        # Removed by the sessions TTL index once past
+        "expires_at": expires_at
+    })
+    session_cache.remember(session_token, {"user_id": user_id, "email": email, "name": name, "expires_at": expires_at})
+    return session_token
+
+
 @router.post("/signup", response_model=UserResponse)
 async def signup(user: UserSignup):
     """Register a new user"""
-    db = get_database()
+    store = get_storage()
     
     # Check if user already exists
-    existing_user = await db.users.find_one({"email": user.email})
+    existing_user = await store.find_user_by_email(user.email)
     if existing_user:
         raise HTTPException(status_code=400, detail="Email already registered")
     
+    try:
+        password_hash = await password_hasher.hash(user.password)
+    except HashingOverloaded:
+        raise overloaded()
+    
     # Create new user
     user_doc = {
         "email": user.email,
         "name": user.name,
-        "password_hash": hash_password(user.password),
+        "password_hash": password_hash,
         "created_at": datetime.utcnow(),
         "last_login": datetime.utcnow()
     }
     
-    result = await db.users.insert_one(user_doc)
-    user_id = str(result.inserted_id)
+    user_id = await store.insert_user(user_doc)
     
     # Create session
-    session_token = generate_session_token()
-    await db.sessions.insert_one({
-        "user_id": user_id,
-        "token": session_token,
-        "created_at": datetime.utcnow(),
-        "expires_at": datetime.utcnow() + timedelta(days=30)
-    })
+    session_token = await create_session(user_id, user.email, user.name)
     
     return UserResponse(
         user_id=user_id,
@@ -80,31 +98,28 @@ async def signup(user: UserSignup):
 @router.post("/login", response_model=UserResponse)
 async def login(user: UserLogin):
     """Login user"""
-    db = get_database()
+    store = get_storage()
     
     # Find user
-    user_doc = await db.users.find_one({"email": user.email})
-    if not user_doc:
-        raise HTTPException(status_code=401, detail="Invalid credentials")
-    
-    # Verify password
-    if user_doc["password_hash"] != hash_password(user.password):
+    user_doc = await store.find_user_by_email(user.email)
+    
+    # Verify password (unknown emails take as long, so they can't be told apart)
+    try:
+        valid = await password_hasher.verify(user.password, user_doc["password_hash"] if user_doc else None)
+        update = {"last_login": datetime.utcnow()}
+        # Upgrade legacy SHA-256 (or weaker scrypt) hashes while we have the password
+        if valid and needs_rehash(user_doc["password_hash"]):
+            update["password_hash"] = await password_hasher.hash(user.password)
+    except HashingOverloaded:
+        raise overloaded()
+    if not valid:
         raise HTTPException(status_code=401, detail="Invalid credentials")
     
     # Update last login
-    await db.users.update_one(
-        {"_id": user_doc["_id"]},
-        {"$set": {"last_login": datetime.utcnow()}}
-    )
+    await store.update_user(str(user_doc["_id"]), update)
     
     # Create new session
-    session_token = generate_session_token()
-    await db.sessions.insert_one({
-        "user_id": str(user_doc["_id"]),
-        "token": session_token,
-        "created_at": datetime.utcnow(),
-        "expires_at": datetime.utcnow() + timedelta(days=30)
-    })
+    session_token = await create_session(str(user_doc["_id"]), user_doc["email"], user_doc["name"])
     
     return UserResponse(
         user_id=str(user_doc["_id"]),
@@ -117,49 +132,35 @@ async def login(user: UserLogin):
 @router.post("/logout")
 async def logout(session_token: str):
     """Logout user by invalidating session"""
-    db = get_database()
-    
-    result = await db.sessions.delete_one({"token": session_token})
-    if result.deleted_count == 0:
+    session_cache.invalidate(session_token)
+    deleted = await get_storage().delete_session(session_token)
+    if not deleted:
         raise HTTPException(status_code=404, detail="Session not found")
     
     return {"success": True, "message": "Logged out successfully"}
 
 
 @router.get("/verify")
-async def verify_session(session_token: str):
+async def verify_session(user: dict = Depends(current_user)):
     """Verify if session is valid"""
-    db = get_database()
-    
-    session = await db.sessions.find_one({"token": session_token})
-    if not session:
-        raise HTTPException(status_code=401, detail="Invalid session")
-    
-    # Check if expired
-    if session["expires_at"] < datetime.utcnow():
-        await db.sessions.delete_one({"token": session_token})
-        raise HTTPException(status_code=401, detail="Session expired")
-    
-    # Get user info
-    user = await db.users.find_one({"_id": session["user_id"]})
-    if not user:
-        raise HTTPException(status_code=404, detail="User not found")
-    
     return {
         "valid": True,
-        "user_id": str(user["_id"]),
+        "user_id": user["user_id"],
         "email": user["email"],
         "name": user["name"]
     }
 
 
+@router.get("/hash-stats")
+async def hash_stats():
+    """Password hashing pool utilization and queue depth"""
+    return password_hasher.stats()
+
+
 @router.get("/user/{user_id}")
 async def get_user(user_id: str):
     """Get user information"""
-    db = get_database()
-    from bson import ObjectId
-    
-    user = await db.users.find_one({"_id": ObjectId(user_id)})
+    user = await get_storage().find_user(user_id)
     if not user:
         raise HTTPException(status_code=404, detail="User not found")
     
@@ -1,9 +1,13 @@
 """Routes for bookmarks, history, and settings"""
-from fastapi import APIRouter, HTTPException
+from fastapi import APIRouter, Depends, HTTPException
+from fastapi.responses import StreamingResponse
 from typing import List, Optional
-from pydantic import BaseModel
-from datetime import datetime
+from pydantic import BaseModel, field_validator
+from datetime import datetime, timezone
 from services.database_service import db_service
+from services.pagination import InvalidCursor, decode_cursor
+from services.serialization import BSONResponse
+from services.session_cache import current_user_id
 from database.models import BookmarkModel, HistoryModel
 
 router = APIRouter()
@@ -25,6 +29,22 @@ class HistoryCreate(BaseModel):
     favicon: Optional[str] = None
 
 
+class HistoryVisit(HistoryCreate):
+    visited_at: Optional[datetime] = None
+
+    @field_validator("visited_at")
+    @classmethod
+    def naive_utc(cls, value: Optional[datetime]) -> Optional[datetime]:
+        """Stored timestamps are naive UTC (datetime.utcnow()); mixing in aware ones can't be compared"""
+        if value is not None and value.tzinfo is not None:
+            value = value.astimezone(timezone.utc).replace(tzinfo=None)
+        return value
+
+
+class HistoryBatch(BaseModel):
+    visits: List[HistoryVisit]
+
+
 class SettingsUpdate(BaseModel):
     default_search_engine: Optional[str] = None
     homepage_url: Optional[str] = None
@@ -38,17 +58,19 @@ class SettingsUpdate(BaseModel):
     ai_auto_summarize: Optional[bool] = None
     focus_mode_enabled: Optional[bool] = None
     focus_mode_strict: Optional[bool] = None
+    history_retention_days: Optional[int] = None
+    history_max_entries: Optional[int] = None
 
 
 # ============ Bookmarks Routes ============
 
 @router.post("/bookmarks")
-async def add_bookmark(bookmark: BookmarkCreate, user_id: str = "default_user"):
+async def add_bookmark(bookmark: BookmarkCreate, user_id: str = Depends(current_user_id)):
     """Add a new bookmark"""
     try:
         bookmark_model = BookmarkModel(
             user_id=user_id,
-            **bookmark.dict()
+            **bookmark.model_dump()
         )
         bookmark_id = await db_service.add_bookmark(bookmark_model)
         return {"success": True, "bookmark_id": bookmark_id}
@@ -57,34 +79,45 @@ async def add_bookmark(bookmark: BookmarkCreate, user_id: str = "default_user"):
 
 
 @router.get("/bookmarks")
-async def get_bookmarks(user_id: str = "default_user", folder: Optional[str] = None):
-    """Get all bookmarks"""
+async def get_bookmarks(user_id: str = Depends(current_user_id), folder: Optional[str] = None, limit: int = 1000,
+                        cursor: Optional[str] = None, format: str = "json"):
+    """Get bookmarks, a page at a time or streamed as NDJSON"""
     try:
-        bookmarks = await db_service.get_bookmarks(user_id, folder)
-        return {"success": True, "bookmarks": bookmarks}
+        if cursor:
+            decode_cursor(cursor)
+        if format == "ndjson":
+            return StreamingResponse(db_service.stream_bookmarks(user_id, folder, cursor), media_type="application/x-ndjson")
+        bookmarks, next_cursor = await db_service.get_bookmarks(user_id, folder, limit, cursor)
+        return BSONResponse({"success": True, "bookmarks": bookmarks, "next_cursor": next_cursor})
+    except InvalidCursor as e:
+        raise HTTPException(status_code=400, detail=str(e))
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
 
 
 @router.delete("/bookmarks/{bookmark_id}")
-async def delete_bookmark(bookmark_id: str):
+async def delete_bookmark(bookmark_id: str, user_id: str = Depends(current_user_id)):
     """Delete a bookmark"""
     try:
-        success = await db_service.delete_bookmark(bookmark_id)
+        # Another user's bookmark is reported exactly like a missing one
+        success = await db_service.delete_bookmark(user_id, bookmark_id)
         if success:
             return {"success": True, "message": "Bookmark deleted"}
         else:
             raise HTTPException(status_code=404, detail="Bookmark not found")
+    except HTTPException:
+        raise
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
 
 
 @router.get("/bookmarks/search")
-async def search_bookmarks(query: str, user_id: str = "default_user"):
+async def search_bookmarks(query: str, user_id: str = Depends(current_user_id), page: int = 1, page_size: int = 50):
     """Search bookmarks"""
     try:
-        bookmarks = await db_service.search_bookmarks(user_id, query)
-        return {"success": True, "bookmarks": bookmarks}
+        page, page_size = max(page, 1), min(max(page_size, 1), 100)
+        found = await db_service.search_bookmarks(user_id, query, page, page_size)
+        return BSONResponse({"success": True, "bookmarks": found["results"], "page": page, "has_more": found["has_more"]})
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
 
@@ -92,13 +125,13 @@ async def search_bookmarks(query: str, user_id: str = "default_user"):
 # ============ History Routes ============
 
 @router.post("/history")
-async def add_history(history: HistoryCreate, user_id: str = "default_user"):
+async def add_history(history: HistoryCreate, user_id: str = Depends(current_user_id)):
     """Add browsing history"""
     try:
         print(history)
         history_model = HistoryModel(
             user_id=user_id,
-            **history.dict()
+            **history.model_dump()
         )
         history_id = await db_service.add_history(history_model)
         return {"success": True, "history_id": history_id}
@@ -107,31 +140,84 @@ async def add_history(history: HistoryCreate, user_id: str = "default_user"):
         raise HTTPException(status_code=500, detail=str(e))
 
 
+@router.post("/history/batch")
+async def add_history_batch(batch: HistoryBatch, user_id: str = Depends(current_user_id)):
+    """Add many queued history visits in one request"""
+    try:
+        visits = [
+            HistoryModel(
+                user_id=user_id,
+                **visit.model_dump(exclude_none=True)
+            )
+            for visit in batch.visits
+        ]
+        result = await db_service.add_history_batch(user_id, visits)
+        return {"success": True, **result}
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=str(e))
+
+
 @router.get("/history")
-async def get_history(user_id: str = "default_user", limit: int = 100):
-    """Get browsing history"""
+async def get_history(user_id: str = Depends(current_user_id), limit: int = 100, cursor: Optional[str] = None,
+                      format: str = "json"):
+    """Get browsing history, a page at a time or streamed as NDJSON"""
     try:
-        print(user_id)
-        history = await db_service.get_history(user_id, limit)
-        print(history)
-        return {"success": True, "history": history}
+        if cursor:
+            decode_cursor(cursor)
+        if format == "ndjson":
+            return StreamingResponse(db_service.stream_history(user_id, None, cursor), media_type="application/x-ndjson")
+        history, next_cursor = await db_service.get_history(user_id, limit, cursor)
+        return BSONResponse({"success": True, "history": history, "next_cursor": next_cursor})
+    except InvalidCursor as e:
+        raise HTTPException(status_code=400, detail=str(e))
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
 
 
 @router.get("/history/search")
-async def search_history(query: str, user_id: str = "default_user"):
-    """Search browsing history"""
+async def search_history(query: str, user_id: str = Depends(current_user_id), page: int = 1, page_size: int = 50,
+                         include_archive: bool = False):
+    """Search browsing history (include_archive also searches compacted history)"""
     try:
+        page, page_size = max(page, 1), min(max(page_size, 1), 100)
+        found = await db_service.search_history(user_id, query, page, page_size, include_archive)
+        return BSONResponse({"success": True, "history": found["results"], "page": page, "has_more": found["has_more"]})
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=str(e))
+
 
-        history = await db_service.search_history(user_id, query)
-        return {"success": True, "history": history}
+@router.post("/history/compact")
+async def compact_history(user_id: str = Depends(current_user_id)):
+    """Apply retention settings and archive cold history now"""
+    try:
+        result = await db_service.compact_history(user_id)
+        return {"success": True, **result}
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=str(e))
+
+
+@router.get("/suggest")
+async def suggest(prefix: str, user_id: str = Depends(current_user_id), limit: int = 8):
+    """Address bar completions ranked by frecency"""
+    try:
+        suggestions = await db_service.suggest(user_id, prefix, min(max(limit, 1), 20))
+        return {"success": True, "suggestions": suggestions}
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=str(e))
+
+
+@router.get("/insights")
+async def get_insights(user_id: str = Depends(current_user_id), days: int = 7):
+    """Visits per day, domain and hour, top pages and focus counts"""
+    try:
+        report = await db_service.get_insights(user_id, min(max(days, 1), 366))
+        return {"success": True, "days": min(max(days, 1), 366), "insights": report}
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
 
 
 @router.delete("/history")
-async def clear_history(user_id: str = "default_user"):
+async def clear_history(user_id: str = Depends(current_user_id)):
     """Clear all browsing history"""
     try:
         count = await db_service.clear_history(user_id)
@@ -143,21 +229,27 @@ async def clear_history(user_id: str = "default_user"):
 # ============ Settings Routes ============
 
 @router.get("/settings")
-async def get_settings(user_id: str = "default_user"):
+async def get_settings(user_id: str = Depends(current_user_id)):
     """Get user settings"""
     try:
         settings = await db_service.get_settings(user_id)
-        return {"success": True, "settings": settings}
+        return BSONResponse({"success": True, "settings": settings})
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
 
 
+@router.get("/cache-stats")
+async def cache_stats():
+    """Hit ratios of the settings, focus session and auth session caches"""
+    return db_service.cache_stats()
+
+
 @router.put("/settings")
-async def update_settings(settings: SettingsUpdate, user_id: str = "default_user"):
+async def update_settings(settings: SettingsUpdate, user_id: str = Depends(current_user_id)):
     """Update user settings"""
     try:
         # Only update provided fields
-        settings_dict = {k: v for k, v in settings.dict().items() if v is not None}
+        settings_dict = {k: v for k, v in settings.model_dump().items() if v is not None}
         
         success = await db_service.update_settings(user_id, settings_dict)
         if success:
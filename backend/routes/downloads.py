@@ -1,11 +1,18 @@
 """Routes for download management"""
-from fastapi import APIRouter, HTTPException
+from fastapi import APIRouter, Depends, HTTPException, WebSocket, WebSocketDisconnect
+from fastapi.responses import FileResponse, StreamingResponse
 from typing import List, Optional
 from pydantic import BaseModel
 from datetime import datetime
-from database.mongodb import get_database
+import asyncio
+import orjson
 from database.models import DownloadModel
-from bson import ObjectId
+from services import pagination
+from services.database_service import db_service
+from services.download_engine import download_engine
+from services.download_progress import download_progress
+from services.serialization import BSONResponse, bson_default
+from services.session_cache import current_user_id, websocket_user_id
 
 router = APIRouter()
 
@@ -16,6 +23,9 @@ class DownloadCreate(BaseModel):
     file_size: Optional[int] = None
     mime_type: Optional[str] = None
     save_path: Optional[str] = None
+    # Have the server fetch the file (segmented, resumable) instead of only tracking it
+    server_side: bool = False
+    sha256: Optional[str] = None
 
 
 class DownloadUpdate(BaseModel):
@@ -26,102 +36,190 @@ class DownloadUpdate(BaseModel):
 
 
 @router.post("/downloads")
-async def create_download(download: DownloadCreate, user_id: str = "default_user"):
-    """Create a new download entry"""
+async def create_download(download: DownloadCreate, user_id: str = Depends(current_user_id)):
+    """Create a new download entry (server_side: the server downloads it)"""
+    if download.server_side and not download.url.startswith(('http://', 'https://')):
+        raise HTTPException(status_code=400, detail="Invalid URL")
     try:
-        db = get_database()
+        fields = download.model_dump(exclude={"sha256"})
+        if download.server_side:
+            # The engine picks the path under DOWNLOADS_DIR; never write where a client says
+            fields["save_path"] = None
         download_model = DownloadModel(
             user_id=user_id,
-            **download.dict()
+            expected_sha256=download.sha256,
+            **fields
         )
-        result = await db.downloads.insert_one(download_model.dict(by_alias=True, exclude={"id"}))
-        return {"success": True, "download_id": str(result.inserted_id)}
+        download_id = await db_service.add_download(download_model)
+        if download.server_side:
+            download_engine.start(download_id)
+        return {"success": True, "download_id": download_id}
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
 
 
 @router.get("/downloads")
-async def get_downloads(user_id: str = "default_user", limit: int = 100):
-    """Get all downloads for a user"""
+async def get_downloads(user_id: str = Depends(current_user_id), limit: int = 100, cursor: Optional[str] = None,
+                        format: str = "json"):
+    """Get downloads for a user, a page at a time or streamed as NDJSON"""
     try:
-        db = get_database()
-        cursor = db.downloads.find({"user_id": user_id}).sort("started_at", -1).limit(limit)
-        downloads = await cursor.to_list(length=limit)
+        if cursor:
+            pagination.decode_cursor(cursor)
+        if format == "ndjson":
+            return StreamingResponse(db_service.stream_downloads(user_id, cursor), media_type="application/x-ndjson")
         
-        for download in downloads:
-            download["_id"] = str(download["_id"])
-        
-        return {"success": True, "downloads": downloads}
+        downloads, next_cursor = await db_service.get_downloads(user_id, limit, cursor)
+        downloads = [download_progress.overlay(download) for download in downloads]
+        return BSONResponse({"success": True, "downloads": downloads, "next_cursor": next_cursor})
+    except pagination.InvalidCursor as e:
+        raise HTTPException(status_code=400, detail=str(e))
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
 
 
+@router.get("/downloads/progress-stats")
+async def progress_stats():
+    """Progress updates received versus database writes, and push subscribers"""
+    return {"progress": download_progress.stats(), "engine": download_engine.stats()}
+
+
+@router.websocket("/downloads/ws")
+async def downloads_socket(websocket: WebSocket):
+    """Pushes progress of the user's downloads: a snapshot, then merged updates"""
+    user_id = await websocket_user_id(websocket)
+    if user_id is None:
+        await websocket.close(code=4401)
+        return
+    await websocket.accept()
+    subscriber = download_progress.subscribe(user_id)
+
+    async def push():
+        while True:
+            batch = await subscriber.next_batch()
+            await websocket.send_text(orjson.dumps({"type": "progress", "downloads": batch}, default=bson_default).decode())
+
+    pusher = None
+    try:
+        snapshot = download_progress.snapshot(user_id)
+        await websocket.send_text(orjson.dumps({"type": "snapshot", "downloads": snapshot}, default=bson_default).decode())
+        pusher = asyncio.create_task(push())
+        # Nothing is expected from the client; receiving notices the disconnect
+        while True:
+            await websocket.receive_text()
+    except WebSocketDisconnect:
+        pass
+    finally:
+        if pusher is not None:
+            pusher.cancel()
+        download_progress.unsubscribe(subscriber)
+
+
+async def _own_download(download_id: str, user_id: str) -> dict:
+    download = await db_service.get_download(download_id)
+    # Someone else's download is reported exactly like a missing one
+    if not download or download.get("user_id") != user_id:
+        raise HTTPException(status_code=404, detail="Download not found")
+    return download
+
+
 @router.get("/downloads/{download_id}")
-async def get_download(download_id: str):
+async def get_download(download_id: str, user_id: str = Depends(current_user_id)):
     """Get a specific download"""
     try:
-        db = get_database()
-        download = await db.downloads.find_one({"_id": ObjectId(download_id)})
-        
-        if not download:
-            raise HTTPException(status_code=404, detail="Download not found")
-        
-        download["_id"] = str(download["_id"])
-        return {"success": True, "download": download}
+        download = await _own_download(download_id, user_id)
+        return BSONResponse({"success": True, "download": download_progress.overlay(download)})
+    except HTTPException:
+        raise
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
 
 
 @router.put("/downloads/{download_id}")
-async def update_download(download_id: str, update: DownloadUpdate):
-    """Update download status/progress"""
+async def update_download(download_id: str, update: DownloadUpdate, user_id: str = Depends(current_user_id)):
+    """Update download status/progress (progress is saved periodically, status changes at once)"""
     try:
-        db = get_database()
-        update_data = {k: v for k, v in update.dict().items() if v is not None}
+        download = await _own_download(download_id, user_id)
+        if download.get("server_side"):
+            # The engine reports these itself; use pause/resume/delete to control them
+            raise HTTPException(status_code=409, detail="Server-side downloads can't be updated by clients")
+        update_data = {k: v for k, v in update.model_dump().items() if v is not None}
         
         # Add completion time if status is completed
         if update_data.get("status") == "completed":
             update_data["completed_at"] = datetime.utcnow()
         
-        result = await db.downloads.update_one(
-            {"_id": ObjectId(download_id)},
-            {"$set": update_data}
-        )
+        updated = await download_progress.update(download_id, update_data)
         
-        if result.modified_count == 0:
+        if not updated:
             raise HTTPException(status_code=404, detail="Download not found")
         
         return {"success": True, "message": "Download updated"}
+    except HTTPException:
+        raise
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
 
 
 @router.delete("/downloads/{download_id}")
-async def delete_download(download_id: str):
-    """Delete a download entry"""
+async def delete_download(download_id: str, user_id: str = Depends(current_user_id)):
+    """Delete a download entry (stopping it if the server is downloading it)"""
     try:
-        db = get_database()
-        result = await db.downloads.delete_one({"_id": ObjectId(download_id)})
+        await _own_download(download_id, user_id)
+        await download_engine.cancel(download_id)
+        download_progress.discard(download_id)
+        deleted = await db_service.delete_download(download_id)
         
-        if result.deleted_count == 0:
+        if not deleted:
             raise HTTPException(status_code=404, detail="Download not found")
         
         return {"success": True, "message": "Download deleted"}
+    except HTTPException:
+        raise
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
 
 
 @router.delete("/downloads")
-async def clear_downloads(user_id: str = "default_user", status: Optional[str] = None):
+async def clear_downloads(user_id: str = Depends(current_user_id), status: Optional[str] = None):
     """Clear downloads (optionally by status)"""
     try:
-        db = get_database()
-        query = {"user_id": user_id}
-        
-        if status:
-            query["status"] = status
-        
-        result = await db.downloads.delete_many(query)
-        return {"success": True, "deleted_count": result.deleted_count}
+        download_progress.discard_user(user_id, status)
+        deleted_count = await db_service.clear_downloads(user_id, status)
+        return {"success": True, "deleted_count": deleted_count}
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
+
+
+async def _server_download(download_id: str, user_id: str) -> dict:
+    download = await _own_download(download_id, user_id)
+    if not download.get("server_side"):
+        raise HTTPException(status_code=404, detail="Server-side download not found")
+    return download
+
+
+@router.post("/downloads/{download_id}/pause")
+async def pause_download(download_id: str, user_id: str = Depends(current_user_id)):
+    """Pause a server-side download, keeping its partial file"""
+    await _server_download(download_id, user_id)
+    paused = await download_engine.pause(download_id)
+    return {"success": paused, "message": "Download paused" if paused else "Download is not running"}
+
+
+@router.post("/downloads/{download_id}/resume")
+async def resume_download(download_id: str, user_id: str = Depends(current_user_id)):
+    """Resume a paused, failed or interrupted server-side download where it stopped"""
+    download = await _server_download(download_id, user_id)
+    if download["status"] == "completed":
+        raise HTTPException(status_code=409, detail="Download already completed")
+    started = download_engine.start(download_id)
+    return {"success": True, "message": "Download resumed" if started else "Download is already running"}
+
+
+@router.get("/downloads/{download_id}/file")
+async def download_file(download_id: str, user_id: str = Depends(current_user_id)):
+    """The file of a completed server-side download"""
+    download = await _server_download(download_id, user_id)
+    if download["status"] != "completed":
+        raise HTTPException(status_code=409, detail="Download not completed")
+    return FileResponse(download["save_path"], filename=download["filename"],
+                        media_type=download.get("mime_type") or "application/octet-stream")
@@ -1,10 +1,14 @@
 """Routes for Focus Mode"""
-from fastapi import APIRouter, HTTPException
+from fastapi import APIRouter, Depends, HTTPException
+from fastapi.responses import StreamingResponse
 from pydantic import BaseModel
 from typing import List, Optional
 from services.focus_mode import focus_service
 from services.database_service import db_service
 from database.models import FocusSessionModel
+from services.pagination import InvalidCursor, decode_cursor
+from services.serialization import BSONResponse
+from services.session_cache import current_user_id
 
 router = APIRouter()
 
@@ -30,7 +34,7 @@ class BatchURLCheckRequest(BaseModel):
 # ============ Focus Mode Routes ============
 
 @router.post("/focus/start")
-async def start_focus_session(session: FocusSessionCreate, user_id: str = "default_user"):
+async def start_focus_session(session: FocusSessionCreate, user_id: str = Depends(current_user_id)):
     """Start a new focus mode session"""
     try:
         # Get user settings to check if strict mode is enabled
@@ -60,13 +64,13 @@ async def start_focus_session(session: FocusSessionCreate, user_id: str = "defau
 
 
 @router.get("/focus/active")
-async def get_active_focus_session(user_id: str = "default_user"):
+async def get_active_focus_session(user_id: str = Depends(current_user_id)):
     """Get active focus mode session"""
     try:
         session = await db_service.get_active_focus_session(user_id)
         
         if session:
-            return {"success": True, "session": session, "active": True}
+            return BSONResponse({"success": True, "session": session, "active": True})
         else:
             return {"success": True, "session": None, "active": False}
     except Exception as e:
@@ -74,7 +78,7 @@ async def get_active_focus_session(user_id: str = "default_user"):
 
 
 @router.post("/focus/check-url")
-async def check_url(request: URLCheckRequest, user_id: str = "default_user"):
+async def check_url(request: URLCheckRequest, user_id: str = Depends(current_user_id)):
     """Check if URL is allowed in current focus session"""
     try:
         # Get active focus session
@@ -140,7 +144,7 @@ async def check_url(request: URLCheckRequest, user_id: str = "default_user"):
 
 
 @router.post("/focus/check-urls")
-async def check_multiple_urls(request: BatchURLCheckRequest, user_id: str = "default_user"):
+async def check_multiple_urls(request: BatchURLCheckRequest, user_id: str = Depends(current_user_id)):
     """Check multiple URLs at once"""
     try:
         session = await db_service.get_active_focus_session(user_id)
@@ -176,7 +180,7 @@ async def check_multiple_urls(request: BatchURLCheckRequest, user_id: str = "def
 
 
 @router.post("/focus/end")
-async def end_focus_session(user_id: str = "default_user"):
+async def end_focus_session(user_id: str = Depends(current_user_id)):
     """End the active focus session"""
     try:
         session = await db_service.get_active_focus_session(user_id)
@@ -204,10 +208,17 @@ async def end_focus_session(user_id: str = "default_user"):
 
 
 @router.get("/focus/history")
-async def get_focus_history(user_id: str = "default_user", limit: int = 10):
-    """Get focus mode session history"""
+async def get_focus_history(user_id: str = Depends(current_user_id), limit: int = 10, cursor: Optional[str] = None,
+                            format: str = "json"):
+    """Get focus mode session history, a page at a time or streamed as NDJSON"""
     try:
-        history = await db_service.get_focus_history(user_id, limit)
-        return {"success": True, "history": history}
+        if cursor:
+            decode_cursor(cursor)
+        if format == "ndjson":
+            return StreamingResponse(db_service.stream_focus_history(user_id, None, cursor), media_type="application/x-ndjson")
+        history, next_cursor = await db_service.get_focus_history(user_id, limit, cursor)
+        return BSONResponse({"success": True, "history": history, "next_cursor": next_cursor})
+    except InvalidCursor as e:
+        raise HTTPException(status_code=400, detail=str(e))
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
@@ -1,54 +1,309 @@
 from fastapi import APIRouter, HTTPException, Request
-from fastapi.responses import Response
-import requests
+from fastapi.responses import Response, StreamingResponse
+from starlette.background import BackgroundTask
+import os
+import time
+import asyncio
+import httpx
 import logging
+from typing import Optional
+from services.http_client import get_http_client, host_limiter
+from services.readability import readable_pages
+from services.http_cache import (
+    http_cache, CacheEntry, cache_key, is_storable, parse_cache_control, vary_values,
+    PROXY_CACHE_MAX_ENTRY_BYTES
+)
 
 logger = logging.getLogger(__name__)
 router = APIRouter()
 
+# Largest upstream body the proxy will relay
+PROXY_MAX_BODY_BYTES = int(os.getenv("PROXY_MAX_BODY_BYTES", 20 * 1024 * 1024))
+
+CORS_HEADERS = {
+    'Access-Control-Allow-Origin': '*',
+    'Access-Control-Allow-Methods': 'GET, POST, OPTIONS',
+    'Access-Control-Allow-Headers': '*',
+    'Access-Control-Expose-Headers': 'X-Cache, Age',
+}
+
+# Client headers forwarded upstream
+REQUEST_HEADERS = ('accept', 'accept-language', 'accept-encoding', 'range', 'if-none-match', 'if-modified-since')
+CONDITIONAL_HEADERS = ('if-none-match', 'if-modified-since')
+# Upstream headers relayed back. The body is relayed still encoded, so
+# content-encoding and content-length describe exactly the bytes sent.
+RESPONSE_HEADERS = (
+    'content-type', 'content-encoding', 'content-length', 'content-language', 'content-range',
+    'accept-ranges', 'etag', 'last-modified', 'cache-control', 'expires', 'vary'
+)
+# Headers a 304 carries (RFC 9110 15.4.5)
+NOT_MODIFIED_HEADERS = ('etag', 'last-modified', 'cache-control', 'expires', 'vary', 'content-location')
+
+# Background revalidations, referenced so they aren't garbage collected mid-flight
+_revalidations = set()
+
+
+async def _open(url: str, headers: dict):
+    """Send a streamed GET holding a per-host slot; the caller releases both"""
+    # Hold a per-host slot until the body is fully relayed
+    slot = await host_limiter.acquire(url)
+    client = get_http_client()
+    try:
+        upstream = await client.send(client.build_request("GET", url, headers=headers), stream=True)
+    except httpx.TimeoutException as e:
+        slot.release()
+        logger.error(f"Proxy fetch timeout: {e}")
+        raise HTTPException(status_code=504, detail=f"Upstream timed out: {url}")
+    except httpx.HTTPError as e:
+        slot.release()
+        logger.error(f"Proxy fetch error: {e}")
+        raise HTTPException(status_code=502, detail=f"Failed to fetch URL: {str(e)}")
+    return upstream, slot
+
+
+def _storable(upstream: httpx.Response, request_headers) -> bool:
+    # Content reached through a temporary redirect belongs to the target, not this URL
+    if any(hop.status_code not in (301, 308) for hop in upstream.history):
+        return False
+    return is_storable(upstream.status_code, request_headers, upstream.headers)
+
+
+def _new_entry(key: str, upstream: httpx.Response, body: bytes, request_headers, request_time: float) -> CacheEntry:
+    return CacheEntry(
+        key, upstream.status_code, {name.lower(): value for name, value in upstream.headers.items()}, body,
+        vary_values(upstream.headers, request_headers), request_time, time.time()
+    )
+
+
+def _etag_matches(if_none_match: str, etag: str) -> bool:
+    """Weak comparison (RFC 9110 13.1.2)"""
+    if if_none_match.strip() == "*":
+        return True
+    bare = etag.removeprefix("W/")
+    return any(tag.strip().removeprefix("W/") == bare for tag in if_none_match.split(","))
+
+
+def _not_modified_for(entry: CacheEntry, request: Request) -> bool:
+    """Whether the client's own conditional request is satisfied by the stored response"""
+    if entry.status != 200:
+        return False
+    if_none_match = request.headers.get('if-none-match')
+    if if_none_match:
+        return 'etag' in entry.headers and _etag_matches(if_none_match, entry.headers['etag'])
+    if_modified_since = request.headers.get('if-modified-since')
+    if if_modified_since and 'last-modified' in entry.headers:
+        return entry.headers['last-modified'] == if_modified_since
+    return False
+
+
+def _cached_response(entry: CacheEntry, request: Request, status: str) -> Response:
+    http_cache.record(status.lower())
+    extra = {'Age': str(int(entry.age())), 'X-Cache': status, **CORS_HEADERS}
+    if _not_modified_for(entry, request):
+        headers = {name: entry.headers[name] for name in NOT_MODIFIED_HEADERS if name in entry.headers}
+        return Response(status_code=304, headers={**headers, **extra})
+    headers = {name: entry.headers[name] for name in RESPONSE_HEADERS if name in entry.headers}
+    # Recomputed from the stored body
+    headers.pop('content-length', None)
+    headers.setdefault('content-type', 'text/html')
+    return Response(content=entry.body, status_code=entry.status, headers={**headers, **extra})
+
+
+async def _read_raw(upstream: httpx.Response, limit: int):
+    """The undecoded body, or None once it grows past limit"""
+    chunks, size = [], 0
+    async for chunk in upstream.aiter_raw():
+        size += len(chunk)
+        if size > limit:
+            return None
+        chunks.append(chunk)
+    return b"".join(chunks)
+
+
+async def _revalidate(entry: CacheEntry, url: str, headers: dict, request_headers):
+    """Refresh a stale entry in the background while it keeps being served
+
+    headers must not carry the client's validators: a 304 has to answer the
+    entry's own, which are added here.
+    """
+    request_time = time.time()
+    try:
+        upstream, slot = await _open(url, {**headers, **entry.validators()})
+    except HTTPException:
+        return
+    try:
+        if upstream.status_code == 304:
+            entry.refresh(upstream.headers, request_time, time.time())
+            await http_cache.put(entry)
+        elif _storable(upstream, request_headers):
+            body = await _read_raw(upstream, PROXY_CACHE_MAX_ENTRY_BYTES)
+            if body is not None:
+                await http_cache.put(_new_entry(entry.key, upstream, body, request_headers, request_time))
+        else:
+            await http_cache.delete(entry.key)
+    except httpx.HTTPError as e:
+        logger.warning(f"Proxy cache revalidation failed for {url}: {e}")
+    finally:
+        await upstream.aclose()
+        slot.release()
+
+
+def _revalidate_in_background(entry: CacheEntry, url: str, headers: dict, request_headers):
+    if entry.key in http_cache.revalidating:
+        return
+    http_cache.revalidating.add(entry.key)
+
+    async def run():
+        try:
+            await _revalidate(entry, url, headers, request_headers)
+        finally:
+            http_cache.revalidating.discard(entry.key)
+
+    task = asyncio.create_task(run())
+    _revalidations.add(task)
+    task.add_done_callback(_revalidations.discard)
+
+
 @router.get("/fetch")
-async def proxy_fetch(url: str):
+async def proxy_fetch(url: str, request: Request):
     """
     Proxy endpoint to fetch web content and bypass CORS
     Usage: /api/proxy/fetch?url=https://example.com
+    Responses carry X-Cache: HIT, STALE, REVALIDATED, MISS or BYPASS
     """
-    try:
-        # Validate URL
-        if not url.startswith(('http://', 'https://')):
-            raise HTTPException(status_code=400, detail="Invalid URL")
-        
-        # Fetch the content
-        response = requests.get(
-            url,
-            headers={
-                'User-Agent': 'Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36'
-            },
-            timeout=10
-        )
-        
-        # Return the content with CORS headers
-        return Response(
-            content=response.content,
-            status_code=response.status_code,
-            media_type=response.headers.get('content-type', 'text/html'),
-            headers={
-                'Access-Control-Allow-Origin': '*',
-                'Access-Control-Allow-Methods': 'GET, POST, OPTIONS',
-                'Access-Control-Allow-Headers': '*',
-            }
-        )
-        
-    except requests.RequestException as e:
-        logger.error(f"Proxy fetch error: {e}")
-        raise HTTPException(status_code=500, detail=f"Failed to fetch URL: {str(e)}")
+    # Validate URL
+    if not url.startswith(('http://', 'https://')):
+        raise HTTPException(status_code=400, detail="Invalid URL")
+
+    headers = {name: request.headers[name] for name in REQUEST_HEADERS if name in request.headers}
+    request_cc = parse_cache_control(request.headers.get('cache-control'))
+    # Partial content and no-store requests go straight through
+    if 'range' in headers or 'no-store' in request_cc:
+        http_cache.record("bypass")
+        upstream, slot = await _open(url, headers)
+        return await _relay(url, upstream, slot, "BYPASS")
+
+    key = cache_key(url, headers.get('accept-encoding', ''))
+    entry = await http_cache.get(key)
+    if entry is not None and not entry.matches(request.headers):
+        entry = None
+
+    if entry is not None:
+        # Revalidate with the stored validators; the client's own are answered from the entry
+        forwarded = {name: value for name, value in headers.items() if name not in CONDITIONAL_HEADERS}
+        staleness = entry.staleness()
+        validate = entry.needs_revalidation() or 'no-cache' in request_cc or request_cc.get('max-age') == '0'
+        if not validate and staleness <= 0:
+            return _cached_response(entry, request, "HIT")
+        if not validate and entry.may_serve_stale() and staleness <= entry.stale_while_revalidate():
+            _revalidate_in_background(entry, url, forwarded, request.headers)
+            return _cached_response(entry, request, "STALE")
+
+        request_time = time.time()
+        try:
+            upstream, slot = await _open(url, {**forwarded, **entry.validators()})
+        except HTTPException:
+            if entry.may_serve_stale() and staleness <= entry.stale_if_error():
+                return _cached_response(entry, request, "STALE")
+            raise
+        if upstream.status_code == 304:
+            await upstream.aclose()
+            slot.release()
+            entry.refresh(upstream.headers, request_time, time.time())
+            await http_cache.put(entry)
+            return _cached_response(entry, request, "REVALIDATED")
+        if upstream.status_code >= 500 and entry.may_serve_stale() and staleness <= entry.stale_if_error():
+            await upstream.aclose()
+            slot.release()
+            return _cached_response(entry, request, "STALE")
+        http_cache.record("miss")
+        return await _relay(url, upstream, slot, "MISS", key, request.headers, request_time)
+
+    http_cache.record("miss")
+    request_time = time.time()
+    upstream, slot = await _open(url, headers)
+    # The client's own validators went upstream, so the response may be a 304 meant for it alone
+    conditional = any(name in headers for name in CONDITIONAL_HEADERS)
+    return await _relay(url, upstream, slot, "MISS", None if conditional else key, request.headers, request_time)
+
+
+async def _relay(url: str, upstream: httpx.Response, slot: asyncio.Semaphore, status: str,
+                 key: Optional[str] = None, request_headers=None, request_time: float = 0.0) -> Response:
+    """Stream an upstream response, keeping a copy for the cache when it is storable and small enough"""
+    declared = upstream.headers.get('content-length')
+    if declared and declared.isdigit() and int(declared) > PROXY_MAX_BODY_BYTES:
+        await upstream.aclose()
+        slot.release()
+        raise HTTPException(status_code=413, detail=f"Upstream body exceeds {PROXY_MAX_BODY_BYTES} bytes")
+
+    keep = key is not None and _storable(upstream, request_headers)
+    if keep and declared and declared.isdigit() and int(declared) > PROXY_CACHE_MAX_ENTRY_BYTES:
+        keep = False
+    released = False
+
+    async def release():
+        nonlocal released
+        if not released:
+            released = True
+            await upstream.aclose()
+            slot.release()
+
+    async def relay():
+        nonlocal keep
+        sent = 0
+        kept = []
+        try:
+            async for chunk in upstream.aiter_raw():
+                sent += len(chunk)
+                if sent > PROXY_MAX_BODY_BYTES:
+                    # Headers are already out; cutting the stream is the only signal left
+                    logger.warning(f"Proxy body over {PROXY_MAX_BODY_BYTES} bytes, truncated: {url}")
+                    keep = False
+                    break
+                if keep:
+                    if sent > PROXY_CACHE_MAX_ENTRY_BYTES:
+                        keep, kept = False, []
+                    else:
+                        kept.append(chunk)
+                yield chunk
+            if keep:
+                await http_cache.put(_new_entry(key, upstream, b"".join(kept), request_headers, request_time))
+        except httpx.HTTPError as e:
+            logger.error(f"Proxy stream error: {e}")
+        finally:
+            await release()
+
+    response_headers = {name: upstream.headers[name] for name in RESPONSE_HEADERS if name in upstream.headers}
+    response_headers.setdefault('content-type', 'text/html')
+    return StreamingResponse(
+        relay(),
+        status_code=upstream.status_code,
+        headers={**response_headers, 'X-Cache': status, **CORS_HEADERS},
+        # Also runs if the client went away before the body was read
+        background=BackgroundTask(release)
+    )
+
+@router.get("/readable")
+async def proxy_readable(url: str, response: Response):
+    """
+    Main text of a page, without navigation, ads and scripts
+    Usage: /api/proxy/readable?url=https://example.com/article
+    """
+    if not url.startswith(('http://', 'https://')):
+        raise HTTPException(status_code=400, detail="Invalid URL")
+
+    page = await readable_pages.get(url)
+    response.headers['X-Cache'] = page.pop('cache')
+    response.headers.update(CORS_HEADERS)
+    return page
+
+@router.get("/cache-stats")
+async def proxy_cache_stats():
+    """Hit ratio and size of the proxy's HTTP and readable-text caches"""
+    return {"http": http_cache.stats(), "readable": readable_pages.stats()}
 
 @router.options("/fetch")
+@router.options("/readable")
 async def proxy_options():
     """Handle OPTIONS preflight requests"""
-    return Response(
-        headers={
-            'Access-Control-Allow-Origin': '*',
-            'Access-Control-Allow-Methods': 'GET, POST, OPTIONS',
-            'Access-Control-Allow-Headers': '*',
-        }
-    )
+    return Response(headers=CORS_HEADERS)
@@ -0,0 +1,252 @@
+"""The multiplexed /ws endpoint and the ops it serves
+
+Ops reuse the HTTP routes' handlers and request models, so a request over
+the socket behaves exactly like the matching HTTP call.
+"""
+from fastapi import APIRouter, HTTPException, WebSocket
+from pydantic import BaseModel
+from typing import Awaitable, Callable, Optional
+import os
+import re
+import tempfile
+import logging
+from models import AIRequest, AIResponse, SummarizeRequest, QuestionRequest, TTSRequest, PageContextRequest, CommandResponse
+from routes import ai, data, focus, downloads
+from services.langchain_utils import langchain_service
+from services.groq_client import groq_client
+from services.eleven_labs import eleven_labs_client
+from services.database_service import db_service
+from services.download_progress import download_progress
+from services.live_updates import live_updates, settings_state, focus_state
+from services.realtime import realtime, Connection, AudioReply, CLOSE_UNAUTHORIZED
+from services.session_cache import websocket_user_id
+
+logger = logging.getLogger(__name__)
+router = APIRouter()
+
+
+class AudioFormat(BaseModel):
+    format: str = "wav"
+
+
+class CommandText(BaseModel):
+    text: str
+
+
+class SuggestQuery(BaseModel):
+    prefix: str
+    limit: int = 8
+
+
+class DownloadRef(BaseModel):
+    download_id: str
+
+
+@router.websocket("/ws")
+async def realtime_socket(websocket: WebSocket):
+    """One connection per client for requests, streamed replies and pushes (see services/realtime.py)"""
+    user_id = await websocket_user_id(websocket)
+    if user_id is None:
+        await websocket.close(code=CLOSE_UNAUTHORIZED)
+        return
+    await websocket.accept()
+    await realtime.serve(websocket, user_id)
+
+
+@router.get("/ws/stats")
+async def realtime_stats():
+    """Open connections, running requests and frames exchanged, and settings/focus change pushes"""
+    return {**realtime.stats(), "live_updates": live_updates.stats()}
+
+
+# ============ AI ============
+
+@realtime.op("ai", "chat", AIRequest)
+async def ai_chat(connection: Connection, request: AIRequest):
+    """The reply streamed as it is generated; ask ai.tts for audio once it is complete"""
+    context = request.context
+    if request.context_handle:
+        context = (await ai.registered_context(request.context_handle)).text
+    async for piece in langchain_service.stream_chat(request.query, context):
+        yield piece
+
+
+async def _spoken(text: str, voice_id: Optional[str] = None) -> AudioReply:
+    """text as an AIResponse, its audio sent in binary frames rather than as base64"""
+    audio = await eleven_labs_client.text_to_speech(text, voice_id, return_base64=False)
+    return AudioReply(AIResponse(text=text), audio)
+
+
+@realtime.op("ai", "summarize", SummarizeRequest)
+async def ai_summarize(connection: Connection, request: SummarizeRequest):
+    return await _spoken(await ai.summary_text(request))
+
+
+@realtime.op("ai", "question", QuestionRequest)
+async def ai_question(connection: Connection, request: QuestionRequest):
+    return await _spoken(await ai.answer_text(request))
+
+
+@realtime.op("ai", "context", PageContextRequest)
+async def ai_context(connection: Connection, request: PageContextRequest):
+    return await ai.register_context(request)
+
+
+@realtime.op("ai", "tts", TTSRequest)
+async def ai_tts(connection: Connection, request: TTSRequest):
+    return await _spoken(request.text, request.voice_id)
+
+
+# ============ Voice ============
+
+async def _transcribe(audio: bytes, audio_format: str) -> str:
+    suffix = "." + (re.sub(r"[^a-z0-9]", "", audio_format.lower()) or "wav")
+    with tempfile.NamedTemporaryFile(delete=False, suffix=suffix) as temp_audio:
+        temp_audio.write(audio)
+        temp_audio_path = temp_audio.name
+    try:
+        return await groq_client.transcribe_audio(temp_audio_path)
+    finally:
+        if os.path.exists(temp_audio_path):
+            os.remove(temp_audio_path)
+
+
+@realtime.op("voice", "transcribe", AudioFormat, audio=True)
+async def voice_transcribe(connection: Connection, request: AudioFormat, audio: bytes):
+    if not audio:
+        raise HTTPException(status_code=400, detail="No audio provided")
+    return {"text": await _transcribe(audio, request.format)}
+
+
+@realtime.op("voice", "command", AudioFormat, audio=True)
+async def voice_command(connection: Connection, request: AudioFormat, audio: bytes):
+    """Transcribe and parse a spoken command"""
+    if not audio:
+        raise HTTPException(status_code=400, detail="No audio provided")
+    transcript = await _transcribe(audio, request.format)
+    parsed = await groq_client.parse_command(transcript)
+    return CommandResponse(**{**parsed, "transcript": transcript})
+
+
+@realtime.op("voice", "parse", CommandText)
+async def voice_parse(connection: Connection, request: CommandText):
+    return await groq_client.parse_command(request.text)
+
+
+# ============ Focus ============
+
+@realtime.op("focus", "start", focus.FocusSessionCreate)
+async def focus_start(connection: Connection, request: focus.FocusSessionCreate):
+    return await focus.start_focus_session(request, user_id=connection.user_id)
+
+
+@realtime.op("focus", "active")
+async def focus_active(connection: Connection, request: dict):
+    return await focus.get_active_focus_session(user_id=connection.user_id)
+
+
+@realtime.op("focus", "check_url", focus.URLCheckRequest)
+async def focus_check_url(connection: Connection, request: focus.URLCheckRequest):
+    return await focus.check_url(request, user_id=connection.user_id)
+
+
+@realtime.op("focus", "check_urls", focus.BatchURLCheckRequest)
+async def focus_check_urls(connection: Connection, request: focus.BatchURLCheckRequest):
+    return await focus.check_multiple_urls(request, user_id=connection.user_id)
+
+
+@realtime.op("focus", "end")
+async def focus_end(connection: Connection, request: dict):
+    return await focus.end_focus_session(user_id=connection.user_id)
+
+
+# ============ Data ============
+
+@realtime.op("data", "settings")
+async def data_settings(connection: Connection, request: dict):
+    return await data.get_settings(user_id=connection.user_id)
+
+
+@realtime.op("data", "update_settings", data.SettingsUpdate)
+async def data_update_settings(connection: Connection, request: data.SettingsUpdate):
+    return await data.update_settings(request, user_id=connection.user_id)
+
+
+@realtime.op("data", "add_history", data.HistoryCreate)
+async def data_add_history(connection: Connection, request: data.HistoryCreate):
+    return await data.add_history(request, user_id=connection.user_id)
+
+
+@realtime.op("data", "add_history_batch", data.HistoryBatch)
+async def data_add_history_batch(connection: Connection, request: data.HistoryBatch):
+    return await data.add_history_batch(request, user_id=connection.user_id)
+
+
+@realtime.op("data", "add_bookmark", data.BookmarkCreate)
+async def data_add_bookmark(connection: Connection, request: data.BookmarkCreate):
+    return await data.add_bookmark(request, user_id=connection.user_id)
+
+
+@realtime.op("data", "suggest", SuggestQuery)
+async def data_suggest(connection: Connection, request: SuggestQuery):
+    return await data.suggest(request.prefix, user_id=connection.user_id, limit=request.limit)
+
+
+# ============ Downloads ============
+
+@realtime.op("downloads", "pause", DownloadRef)
+async def downloads_pause(connection: Connection, request: DownloadRef):
+    return await downloads.pause_download(request.download_id, user_id=connection.user_id)
+
+
+@realtime.op("downloads", "resume", DownloadRef)
+async def downloads_resume(connection: Connection, request: DownloadRef):
+    return await downloads.resume_download(request.download_id, user_id=connection.user_id)
+
+
+@realtime.channel("downloads")
+async def downloads_pushes(connection: Connection):
+    """A snapshot of the user's active downloads, then merged progress updates"""
+    subscriber = download_progress.subscribe(connection.user_id)
+    try:
+        await connection.push("downloads", "snapshot", download_progress.snapshot(connection.user_id))
+        while True:
+            # Updates merge in the subscriber while a slow client holds this up
+            batch = await subscriber.next_batch()
+            await connection.push("downloads", "progress", batch)
+    finally:
+        download_progress.unsubscribe(subscriber)
+
+
+async def _live_pushes(connection: Connection, channel: str, topic: str, load: Callable[[str], Awaitable[Optional[dict]]]):
+    """A snapshot of a topic, then its changes as other requests and devices make them"""
+    subscription = live_updates.subscribe(connection.user_id, topic)
+    try:
+        # Subscribed first: changes made while this loads are held and applied by snapshot()
+        state = await load(connection.user_id)
+        await connection.push(channel, topic, live_updates.snapshot(subscription, state))
+        while True:
+            event = await subscription.next_event()
+            await connection.push(channel, topic, event)
+            if event["op"] == "resync":
+                return
+    finally:
+        live_updates.unsubscribe(subscription)
+
+
+async def _settings(user_id: str) -> dict:
+    return settings_state(await db_service.get_settings(user_id))
+
+
+async def _focus_session(user_id: str) -> Optional[dict]:
+    return focus_state(await db_service.get_active_focus_session(user_id))
+
+
+@realtime.channel("data")
+async def settings_pushes(connection: Connection):
+    await _live_pushes(connection, "data", "settings", _settings)
+
+
+@realtime.channel("focus")
+async def focus_pushes(connection: Connection):
+    await _live_pushes(connection, "focus", "focus", _focus_session)
@@ -1,6 +1,7 @@
 from fastapi import APIRouter, HTTPException, UploadFile, File
 from models import VoiceCommandRequest, CommandResponse
 from services.groq_client import groq_client
+from services.command_cache import command_cache
 import logging
 import base64
 import tempfile
@@ -81,3 +82,8 @@ async def parse_command(text: str):
     except Exception as e:
         logger.error(f"Parse error: {e}")
         raise HTTPException(status_code=500, detail=str(e))
+
+@router.get("/cache-stats")
+async def command_cache_stats():
+    """Parsed-command cache size and hit ratio"""
+    return command_cache.stats()
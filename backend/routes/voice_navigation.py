@@ -1,100 +1,178 @@
-from fastapi import APIRouter, HTTPException
+from fastapi import APIRouter, Depends, HTTPException
 from pydantic import BaseModel
-from typing import List, Dict, Optional
+from typing import List, Dict, Optional, Tuple
 import re
-from groq import Groq
+import asyncio
+from urllib.parse import quote_plus
+from groq import AsyncGroq
 import os
+from services.site_directory import site_directory
+from services.conversation_store import ConversationStore, Conversation
+from services.model_router import model_router
+from services.session_cache import current_user_id
 
 router = APIRouter()
 
 # Initialize Groq client
-groq_client = Groq(api_key=os.getenv("GROQ_API_KEY"))
+async_groq_client = AsyncGroq(api_key=os.getenv("GROQ_API_KEY"))
+
+# Run the LLM alongside local intent resolution for ambiguous utterances
+SPECULATIVE_VOICE = os.getenv("VOICE_SPECULATIVE", "True").lower() == "true"
+
+AI_ANSWER_FALLBACK = "I'm sorry, I couldn't find an answer to that question. Could you please try rephrasing it?"
+
+GOOGLE_SEARCH_URL = "https://www.google.com/search?q="
+
+# Large model voice answers used before routing; the router's shadow mode keeps it
+VOICE_ANSWER_MODEL = os.getenv("GROQ_LARGE_MODEL", "llama-3.1-70b-versatile")
+
+# Small model used to condense older conversation turns
+SUMMARY_MODEL = os.getenv("FOCUS_MODEL", "llama-3.1-8b-instant")
+
+# Navigation verbs take precedence over search verbs: the lazy prefix lets the
+# first branch try every position before the second branch is attempted.
+NAVIGATION_VERBS = r'open|go\s+to|visit|navigate\s+to|take\s+me\s+to|show\s+me'
+SEARCH_VERBS = r'search\s+for|find|look\s+up|google'
+INTENT_PATTERN = re.compile(
+    rf'.*?\b(?:{NAVIGATION_VERBS})\s+(?P<nav>.+)|.*?\b(?:{SEARCH_VERBS})\s+(?P<search>.+)',
+    re.IGNORECASE | re.DOTALL
+)
+# Polite openers that still leave the verb in command position ("can you please search for cats")
+INTENT_LEAD_INS = r"(?:(?:can|could|would|will)\s+you\s+|please\s+|i\s+(?:want|need|would\s+like)\s+to\s+|let'?s\s+)*"
+EXPLICIT_INTENT_PATTERN = re.compile(rf'{INTENT_LEAD_INS}(?:{NAVIGATION_VERBS}|{SEARCH_VERBS})\s+\S', re.IGNORECASE)
 
 class VoiceCommandRequest(BaseModel):
     command: str
+    conversation_id: Optional[str] = None
+    # Deprecated: only used to seed a conversation the server hasn't seen yet
     history: Optional[List[Dict[str, str]]] = []
 
 class VoiceCommandResponse(BaseModel):
     action: str  # 'navigate', 'answer', 'exit'
     response: str
     url: Optional[str] = None
+    conversation_id: Optional[str] = None
 
 @router.post("/voice-command", response_model=VoiceCommandResponse)
-async def process_voice_command(request: VoiceCommandRequest):
+async def process_voice_command(request: VoiceCommandRequest, user_id: str = Depends(current_user_id)):
     """
     Process voice command and determine action
     """
     try:
-        command = request.command.lower().strip()
-        
-        # Check for exit commands
-        exit_keywords = ['exit', 'quit', 'close', 'stop', 'goodbye', 'bye']
-        if any(keyword in command for keyword in exit_keywords):
-            return VoiceCommandResponse(
-                action='exit',
-                response="Goodbye! Have a great day!",
-                url=None
-            )
-        
-        # Check for navigation commands
-        navigation_patterns = [
-            r'open\s+(.+)',
-            r'go\s+to\s+(.+)',
-            r'visit\s+(.+)',
-            r'navigate\s+to\s+(.+)',
-            r'take\s+me\s+to\s+(.+)',
-            r'show\s+me\s+(.+)',
-        ]
-        
-        for pattern in navigation_patterns:
-            match = re.search(pattern, command, re.IGNORECASE)
-            if match:
-                target = match.group(1).strip()
-                url = get_url_from_target(target)
-                
-                response_text = f"Okay, opening {target}. Please wait..."
-                
-                return VoiceCommandResponse(
-                    action='navigate',
-                    response=response_text,
-                    url=url
-                )
+        conversation = await conversation_store.get(user_id, request.conversation_id)
+        if request.history and not conversation.turns and not conversation.summary:
+            await conversation_store.add_turns(conversation, request.history[-conversation.turns.maxlen:])
         
-        # Check for search commands
-        search_patterns = [
-            r'search\s+for\s+(.+)',
-            r'find\s+(.+)',
-            r'look\s+up\s+(.+)',
-            r'google\s+(.+)',
-        ]
+        response = await resolve_voice_command(request.command, conversation)
         
-        for pattern in search_patterns:
-            match = re.search(pattern, command, re.IGNORECASE)
-            if match:
-                query = match.group(1).strip()
-                url = f"https://www.google.com/search?q={query.replace(' ', '+')}"
-                
-                response_text = f"Searching for {query}..."
-                
-                return VoiceCommandResponse(
-                    action='navigate',
-                    response=response_text,
-                    url=url
-                )
-        
-        # If not a navigation command, treat as a question
-        # Use AI to answer
-        answer = await get_ai_answer(command, request.history)
+        await conversation_store.add_turns(conversation, [
+            {"speaker": "You", "message": request.command},
+            {"speaker": "AI", "message": response.response}
+        ])
+        response.conversation_id = conversation.id
+        return response
         
+    except Exception as e:
+        print(f"Error processing voice command: {e}")
+        raise HTTPException(status_code=500, detail=str(e))
+
+async def resolve_voice_command(raw_command: str, conversation: Conversation) -> VoiceCommandResponse:
+    """
+    Determine the action for a single utterance
+    """
+    command = raw_command.lower().strip()
+    
+    # Check for exit commands
+    exit_keywords = ['exit', 'quit', 'close', 'stop', 'goodbye', 'bye']
+    if any(keyword in command for keyword in exit_keywords):
         return VoiceCommandResponse(
-            action='answer',
-            response=answer,
+            action='exit',
+            response="Goodbye! Have a great day!",
             url=None
         )
-        
+    
+    # Explicit commands ("open gmail", "search for cats") never need the LLM
+    if EXPLICIT_INTENT_PATTERN.match(command):
+        response, _ = resolve_intent(command)
+        return response
+    
+    if not SPECULATIVE_VOICE:
+        response, _ = resolve_intent(command)
+        if response is not None:
+            return response
+        answer = await get_ai_answer(command, conversation.history(), conversation.summary)
+        return VoiceCommandResponse(action='answer', response=answer, url=None)
+    
+    # Ambiguous utterance: start the LLM answer while resolving locally, and
+    # cancel it (aborting the provider request) if the local path is confident
+    llm_task = asyncio.create_task(
+        generate_ai_answer(command, conversation.history(), conversation.summary)
+    )
+    try:
+        response, confident = resolve_intent(command)
+    except BaseException:
+        llm_task.cancel()
+        raise
+    
+    if confident:
+        llm_task.cancel()
+        return response
+    
+    try:
+        answer = await llm_task
     except Exception as e:
-        print(f"Error processing voice command: {e}")
-        raise HTTPException(status_code=500, detail=str(e))
+        print(f"Error getting AI answer: {e}")
+        # A tentative local result beats an apology
+        if response is not None:
+            return response
+        answer = AI_ANSWER_FALLBACK
+    
+    return VoiceCommandResponse(
+        action='answer',
+        response=answer,
+        url=None
+    )
+
+def resolve_intent(command: str) -> Tuple[Optional[VoiceCommandResponse], bool]:
+    """
+    Resolve navigation and search intents without the LLM
+    
+    Returns the local response (None when no intent matched) and whether it
+    is confident enough to skip the LLM. Verbs at the start of the utterance,
+    or after a polite opener ("can you", "please", "I want to"), are explicit
+    commands; a verb mid-sentence ("what's the best way to find...") is only
+    trusted when its target names a known site.
+    """
+    # Navigation and search intents share one precompiled matcher
+    match = INTENT_PATTERN.match(command)
+    if not match:
+        return None, False
+    explicit = EXPLICIT_INTENT_PATTERN.match(command) is not None
+    
+    if match.group('nav'):
+        target = match.group('nav').strip()
+        url = get_url_from_target(target)
+        
+        response_text = f"Okay, opening {target}. Please wait..."
+        
+        response = VoiceCommandResponse(
+            action='navigate',
+            response=response_text,
+            url=url
+        )
+        return response, explicit or not url.startswith(GOOGLE_SEARCH_URL)
+    
+    query = match.group('search').strip()
+    url = f"{GOOGLE_SEARCH_URL}{quote_plus(query)}"
+    
+    response_text = f"Searching for {query}..."
+    
+    response = VoiceCommandResponse(
+        action='navigate',
+        response=response_text,
+        url=url
+    )
+    return response, explicit
 
 def get_url_from_target(target: str) -> str:
     """
@@ -102,87 +180,103 @@ def get_url_from_target(target: str) -> str:
     """
     target_lower = target.lower().strip()
     
-    # Common websites mapping
-    website_map = {
-        'youtube': 'https://www.youtube.com',
-        'google': 'https://www.google.com',
-        'facebook': 'https://www.facebook.com',
-        'twitter': 'https://www.twitter.com',
-        'x': 'https://www.x.com',
-        'instagram': 'https://www.instagram.com',
-        'linkedin': 'https://www.linkedin.com',
-        'github': 'https://www.github.com',
-        'reddit': 'https://www.reddit.com',
-        'amazon': 'https://www.amazon.com',
-        'netflix': 'https://www.netflix.com',
-        'wikipedia': 'https://www.wikipedia.org',
-        'gmail': 'https://mail.google.com',
-        'whatsapp': 'https://web.whatsapp.com',
-        'spotify': 'https://www.spotify.com',
-        'twitch': 'https://www.twitch.tv',
-        'tiktok': 'https://www.tiktok.com',
-        'pinterest': 'https://www.pinterest.com',
-        'stackoverflow': 'https://stackoverflow.com',
-        'stack overflow': 'https://stackoverflow.com',
-    }
-    
-    # Check if target matches a known website
-    for key, url in website_map.items():
-        if key in target_lower:
-            return url
-    
     # Check if it's already a URL
     if target_lower.startswith('http://') or target_lower.startswith('https://'):
         return target
     
+    # Known site names and aliases, then prefix and misspelling fallbacks
+    url = site_directory.resolve(target_lower)
+    if url:
+        return url
+    
     # Check if it looks like a domain
     if '.' in target and ' ' not in target:
-        if not target.startswith('http'):
-            return f'https://{target}'
-        return target
+        return f'https://{target}'
     
     # Default: search on Google
-    return f"https://www.google.com/search?q={target.replace(' ', '+')}"
+    return f"{GOOGLE_SEARCH_URL}{quote_plus(target)}"
 
-async def get_ai_answer(question: str, history: List[Dict[str, str]]) -> str:
+async def get_ai_answer(question: str, history: List[Dict[str, str]], summary: str = "") -> str:
     """
     Get AI answer for a question using Groq
     """
     try:
-        # Build conversation context
-        messages = [
+        return await generate_ai_answer(question, history, summary)
+    except Exception as e:
+        print(f"Error getting AI answer: {e}")
+        return AI_ANSWER_FALLBACK
+
+async def generate_ai_answer(question: str, history: List[Dict[str, str]], summary: str = "") -> str:
+    """
+    Ask Groq for an answer; raises on provider errors
+    """
+    # Build conversation context
+    messages = [
+        {
+            "role": "system",
+            "content": "You are a helpful voice assistant in a web browser. Provide concise, clear answers suitable for text-to-speech. Keep responses under 3 sentences when possible. Be friendly and conversational."
+        }
+    ]
+    
+    # Older turns arrive condensed into a rolling summary
+    if summary:
+        messages.append({"role": "system", "content": f"Summary of the earlier conversation:\n{summary}"})
+    
+    # Add recent history for context
+    for msg in history:
+        if msg['speaker'] == 'You':
+            messages.append({"role": "user", "content": msg['message']})
+        elif msg['speaker'] == 'AI':
+            messages.append({"role": "assistant", "content": msg['message']})
+    
+    # Add current question
+    messages.append({"role": "user", "content": question})
+    
+    # Async client, so cancelling this coroutine aborts the HTTP request
+    context = summary + "".join(msg['message'] for msg in history)
+    completion = await async_groq_client.chat.completions.create(
+        model=model_router.choose("voice", question, context, default=VOICE_ANSWER_MODEL),
+        messages=messages,
+        temperature=0.7,
+        max_tokens=200,
+        top_p=1,
+        stream=False
+    )
+    
+    return completion.choices[0].message.content.strip()
+
+async def summarize_conversation(summary: str, turns: List[Dict[str, str]]) -> str:
+    """
+    Fold evicted turns into the rolling conversation summary
+    """
+    transcript = "\n".join(f"{turn['speaker']}: {turn['message']}" for turn in turns)
+    completion = await async_groq_client.chat.completions.create(
+        model=SUMMARY_MODEL,
+        messages=[
             {
                 "role": "system",
-                "content": "You are a helpful voice assistant in a web browser. Provide concise, clear answers suitable for text-to-speech. Keep responses under 3 sentences when possible. Be friendly and conversational."
+                "content": "You maintain a running summary of a voice assistant conversation. Merge the new turns into the existing summary. Keep names, topics and open questions. Reply with the summary only, under 120 words."
+            },
+            {
+                "role": "user",
+                "content": f"Existing summary:\n{summary or '(none)'}\n\nNew turns:\n{transcript}"
             }
-        ]
-        
-        # Add recent history for context
-        for msg in history[-4:]:  # Last 4 messages
-            if msg['speaker'] == 'You':
-                messages.append({"role": "user", "content": msg['message']})
-            elif msg['speaker'] == 'AI':
-                messages.append({"role": "assistant", "content": msg['message']})
-        
-        # Add current question
-        messages.append({"role": "user", "content": question})
-        
-        # Get AI response
-        completion = groq_client.chat.completions.create(
-            model="llama-3.1-70b-versatile",
-            messages=messages,
-            temperature=0.7,
-            max_tokens=200,
-            top_p=1,
-            stream=False
-        )
-        
-        answer = completion.choices[0].message.content.strip()
-        return answer
-        
+        ],
+        temperature=0.3,
+        max_tokens=200
+    )
+    return completion.choices[0].message.content
+
+conversation_store = ConversationStore(summarizer=summarize_conversation)
+
+@router.delete("/voice-command/{conversation_id}")
+async def clear_voice_conversation(conversation_id: str, user_id: str = Depends(current_user_id)):
+    """Forget the server-side state of a voice conversation"""
+    try:
+        removed = await conversation_store.clear(user_id, conversation_id)
+        return {"success": True, "removed": removed}
     except Exception as e:
-        print(f"Error getting AI answer: {e}")
-        return "I'm sorry, I couldn't find an answer to that question. Could you please try rephrasing it?"
+        raise HTTPException(status_code=500, detail=str(e))
 
 @router.get("/test")
 async def test_voice_navigation():
@@ -0,0 +1,92 @@
+"""Cache of parsed voice commands keyed on normalized transcripts"""
+import os
+import re
+import copy
+from typing import Any, Dict, Optional
+from services.lru_cache import TTLCache
+import logging
+
+logger = logging.getLogger(__name__)
+
+COMMAND_CACHE_SIZE = int(os.getenv("COMMAND_CACHE_SIZE", 2048))
+COMMAND_CACHE_TTL = int(os.getenv("COMMAND_CACHE_TTL", 3600))
+
+# Hesitations and politeness that don't change the meaning of a command
+FILLER_WORDS = {
+    "um", "umm", "uh", "uhh", "er", "erm", "ah", "hmm", "mm",
+    "please", "okay", "ok", "hey", "so", "just", "now", "kindly"
+}
+_LEADING_PHRASES = re.compile(r"^(?:(?:can|could|would|will) you|i want to|i'd like to|i would like to|let's)\s+")
+# Punctuation at either end of a word ("cats?", "\"open"). Inside a word it is
+# kept, as are + and # anywhere, so "c++", "c#" and "node.js" stay distinct.
+_EDGE_PUNCTUATION = re.compile(r"(?<!\S)[^\w\s+#]+|[^\w\s+#]+(?!\S)")
+_SPACES = re.compile(r"\s+")
+
+
+def normalize_transcript(text: str) -> str:
+    """Case-fold, strip punctuation around words and drop filler words"""
+    text = _EDGE_PUNCTUATION.sub(" ", text.casefold())
+    text = _SPACES.sub(" ", text).strip()
+    text = _LEADING_PHRASES.sub("", text)
+    return " ".join(word for word in text.split(" ") if word not in FILLER_WORDS)
+
+
+def _command(action: str, data: Optional[dict], message: str) -> Dict[str, Any]:
+    return {"action": action, "data": data, "message": message, "is_aichat_query": False}
+
+
+# Preloaded at startup so the most common commands never reach the LLM
+WARM_UP_COMMANDS = {
+    "go back": _command("back", None, "Going back"),
+    "back": _command("back", None, "Going back"),
+    "go forward": _command("forward", None, "Going forward"),
+    "forward": _command("forward", None, "Going forward"),
+    "refresh": _command("refresh", None, "Refreshing page"),
+    "refresh the page": _command("refresh", None, "Refreshing page"),
+    "reload": _command("refresh", None, "Refreshing page"),
+    "reload page": _command("refresh", None, "Refreshing page"),
+    "new tab": _command("new_tab", None, "Opening new tab"),
+    "open new tab": _command("new_tab", None, "Opening new tab"),
+    "open a new tab": _command("new_tab", None, "Opening new tab"),
+    "close tab": _command("close_tab", None, "Closing tab"),
+    "close this tab": _command("close_tab", None, "Closing tab"),
+    "next tab": _command("switch_tab", {"index": 1}, "Switching to next tab"),
+    "previous tab": _command("switch_tab", {"index": -1}, "Switching to previous tab"),
+    "summarize this page": _command("summarize_page", None, "Summarizing page"),
+    "summarize the page": _command("summarize_page", None, "Summarizing page"),
+    "open google": _command("open_url", {"url": "https://google.com"}, "Opening Google"),
+    "open gmail": _command("open_url", {"url": "https://mail.google.com"}, "Opening Gmail"),
+    "open youtube": _command("open_url", {"url": "https://www.youtube.com"}, "Opening YouTube"),
+    "open github": _command("open_url", {"url": "https://github.com"}, "Opening GitHub"),
+    "open wikipedia": _command("open_url", {"url": "https://www.wikipedia.org"}, "Opening Wikipedia"),
+}
+
+
+class CommandCache:
+    """LRU of parsed command dicts keyed on normalized transcripts"""
+
+    def __init__(self, maxsize: int = COMMAND_CACHE_SIZE, ttl: int = COMMAND_CACHE_TTL):
+        self.cache = TTLCache(maxsize=maxsize, ttl=ttl)
+
+    def get(self, text: str) -> Optional[Dict[str, Any]]:
+        parsed = self.cache.get(normalize_transcript(text))
+        # Callers annotate the result (e.g. with the transcript), so hand out copies
+        return copy.deepcopy(parsed) if parsed is not None else None
+
+    def set(self, text: str, parsed: Dict[str, Any]):
+        key = normalize_transcript(text)
+        if key:
+            self.cache.set(key, copy.deepcopy(parsed))
+
+    def warm_up(self):
+        """Preload the common command list; these entries never expire"""
+        for text, parsed in WARM_UP_COMMANDS.items():
+            self.cache.set(normalize_transcript(text), parsed, ttl=None)
+        logger.info(f"Command cache warmed with {len(WARM_UP_COMMANDS)} commands")
+
+    def stats(self) -> Dict[str, Any]:
+        return self.cache.stats()
+
+
+# Global instance
+command_cache = CommandCache()
@@ -0,0 +1,187 @@
+"""Server-side conversation state for voice navigation"""
+import os
+import time
+import uuid
+import asyncio
+from collections import OrderedDict, deque
+from datetime import datetime
+from typing import Awaitable, Callable, Dict, List, Optional
+from database.storage import get_storage
+import logging
+
+logger = logging.getLogger(__name__)
+
+# Number of recent turns sent verbatim to the model
+CONVERSATION_WINDOW = int(os.getenv("VOICE_CONVERSATION_WINDOW", 6))
+# Evicted turns are folded into the summary once this many have piled up
+SUMMARY_BATCH = int(os.getenv("VOICE_CONVERSATION_SUMMARY_BATCH", 4))
+# Hard cap on summary length so the prompt size stays constant
+SUMMARY_MAX_CHARS = int(os.getenv("VOICE_CONVERSATION_SUMMARY_CHARS", 1200))
+# Conversations idle for longer than this are dropped (seconds)
+CONVERSATION_IDLE_TTL = int(os.getenv("VOICE_CONVERSATION_TTL", 1800))
+# In-memory conversations kept before the least recently used is evicted
+MAX_CONVERSATIONS = int(os.getenv("VOICE_CONVERSATION_MAX", 10000))
+# Mirror conversations to Mongo so they survive restarts and span workers
+PERSIST_CONVERSATIONS = os.getenv("VOICE_CONVERSATION_PERSIST", "False").lower() == "true"
+
+Summarizer = Callable[[str, List[Dict[str, str]]], Awaitable[str]]
+
+
+def conversation_key(user_id: str, conversation_id: str) -> str:
+    """Store key of a conversation; ids come from clients, so they only count within a user"""
+    return f"{user_id}:{conversation_id}"
+
+
+class Conversation:
+    """Bounded ring buffer of turns plus a rolling summary of older ones
+
+    Turns evicted from the window stay in the prompt (see history()) until
+    the summary that folds them in is done.
+    """
+
+    def __init__(self, user_id: str, conversation_id: str, turns: Optional[List[Dict[str, str]]] = None,
+                 summary: str = "", pending: Optional[List[Dict[str, str]]] = None):
+        self.user_id = user_id
+        self.id = conversation_id
+        self.turns = deque(turns or [], maxlen=CONVERSATION_WINDOW)
+        self.summary = summary
+        self.pending: List[Dict[str, str]] = list(pending or [])
+        # Pending turns handed to the running summarizer
+        self.folding: List[Dict[str, str]] = []
+        self.last_active = time.monotonic()
+        self.summarizing = False
+
+    @property
+    def key(self) -> str:
+        return conversation_key(self.user_id, self.id)
+
+    def append(self, speaker: str, message: str):
+        if len(self.turns) == self.turns.maxlen:
+            self.pending.append(self.turns[0])
+        self.turns.append({"speaker": speaker, "message": message})
+        self.last_active = time.monotonic()
+
+    def history(self) -> List[Dict[str, str]]:
+        """Turns not yet covered by the summary, oldest first"""
+        return [*self.folding, *self.pending, *self.turns]
+
+    def to_document(self) -> dict:
+        return {
+            "_id": self.key,
+            "user_id": self.user_id,
+            "turns": list(self.turns),
+            "summary": self.summary,
+            # A summary still running when the process stops is redone from these
+            "pending": self.folding + self.pending,
+            "updated_at": datetime.utcnow()
+        }
+
+
+def condense_turns(summary: str, turns: List[Dict[str, str]]) -> str:
+    """Fallback summary: append the evicted turns and keep the newest text"""
+    lines = [summary] if summary else []
+    lines += [f"{turn['speaker']}: {turn['message']}" for turn in turns]
+    return "\n".join(lines)[-SUMMARY_MAX_CHARS:]
+
+
+class ConversationStore:
+    """In-memory conversation store with optional Mongo persistence
+
+    Conversations are kept in an LRU keyed by user and conversation id. Turns that
+    fall out of the window are summarized in the background so requests
+    never wait on the summarizer.
+    """
+
+    def __init__(self, summarizer: Optional[Summarizer] = None):
+        self.conversations: "OrderedDict[str, Conversation]" = OrderedDict()
+        self.summarizer = summarizer
+        self.persist = PERSIST_CONVERSATIONS
+        self._tasks = set()
+
+    def _expire_idle(self):
+        """Drop conversations that have been idle past the TTL"""
+        cutoff = time.monotonic() - CONVERSATION_IDLE_TTL
+        while self.conversations:
+            oldest = next(iter(self.conversations.values()))
+            if oldest.last_active >= cutoff:
+                break
+            self.conversations.popitem(last=False)
+
+    async def get(self, user_id: str, conversation_id: Optional[str]) -> Conversation:
+        """Fetch one of a user's conversations, loading it from Mongo or starting a new one"""
+        self._expire_idle()
+
+        key = conversation_key(user_id, conversation_id) if conversation_id else None
+        if key in self.conversations:
+            self.conversations.move_to_end(key)
+            return self.conversations[key]
+
+        conversation = None
+        if conversation_id and self.persist:
+            conversation = await self._load(user_id, conversation_id)
+        if conversation is None:
+            conversation = Conversation(user_id, conversation_id or uuid.uuid4().hex)
+
+        self.conversations[conversation.key] = conversation
+        if len(self.conversations) > MAX_CONVERSATIONS:
+            self.conversations.popitem(last=False)
+        return conversation
+
+    async def add_turns(self, conversation: Conversation, turns: List[Dict[str, str]]):
+        """Record turns, schedule summarization and persist"""
+        for turn in turns:
+            conversation.append(turn["speaker"], turn["message"])
+
+        if len(conversation.pending) >= SUMMARY_BATCH and not conversation.summarizing:
+            conversation.summarizing = True
+            task = asyncio.create_task(self._summarize(conversation))
+            self._tasks.add(task)
+            task.add_done_callback(self._tasks.discard)
+
+        if self.persist:
+            await self._save(conversation)
+
+    async def _summarize(self, conversation: Conversation):
+        """Fold pending turns into the rolling summary"""
+        pending = conversation.folding = conversation.pending
+        conversation.pending = []
+        try:
+            if self.summarizer:
+                summary = await self.summarizer(conversation.summary, pending)
+                conversation.summary = summary.strip()[:SUMMARY_MAX_CHARS]
+            else:
+                conversation.summary = condense_turns(conversation.summary, pending)
+        except Exception as e:
+            logger.error(f"Conversation summary error: {e}")
+            conversation.summary = condense_turns(conversation.summary, pending)
+        finally:
+            conversation.folding = []
+            conversation.summarizing = False
+
+        if self.persist:
+            await self._save(conversation)
+
+    async def _load(self, user_id: str, conversation_id: str) -> Optional[Conversation]:
+        try:
+            doc = await get_storage().load_conversation(conversation_key(user_id, conversation_id))
+        except Exception as e:
+            logger.error(f"Failed to load conversation {conversation_id}: {e}")
+            return None
+        if not doc:
+            return None
+        return Conversation(user_id, conversation_id, doc.get("turns"), doc.get("summary", ""), doc.get("pending"))
+
+    async def _save(self, conversation: Conversation):
+        try:
+            await get_storage().save_conversation(conversation.to_document())
+        except Exception as e:
+            logger.error(f"Failed to save conversation {conversation.id}: {e}")
+
+    async def clear(self, user_id: str, conversation_id: str) -> bool:
+        """Forget one of a user's conversations"""
+        key = conversation_key(user_id, conversation_id)
+        removed = self.conversations.pop(key, None) is not None
+        if self.persist:
+            deleted = await get_storage().delete_conversation(key)
+            removed = removed or deleted
+        return removed
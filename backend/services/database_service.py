@@ -1,232 +1,340 @@
 """Database service for CRUD operations"""
+import os
+import copy
+import logging
 from datetime import datetime
-from typing import List, Optional
-from database.mongodb import get_database
-from database.models import BookmarkModel, HistoryModel, SettingsModel, FocusSessionModel
+from typing import AsyncIterator, List, Optional, Tuple
+from database.storage import Storage, get_storage
+from database.models import BookmarkModel, HistoryModel, SettingsModel, FocusSessionModel, DownloadModel
+from services import search_index, pagination
+from services.suggest_index import suggest_index
+from services.insights import insights
+from services.history_archive import history_compactor
+from services.lru_cache import TTLCache
+from services.session_cache import session_cache
+from services.live_updates import live_updates, settings_state, focus_state
+
+logger = logging.getLogger(__name__)
+
+DOCUMENT_CACHE_SIZE = int(os.getenv("DOCUMENT_CACHE_SIZE", 10000))
+# Upper bound on staleness when change streams aren't available
+DOCUMENT_CACHE_TTL = int(os.getenv("DOCUMENT_CACHE_TTL", 30))
+
+_MISSING = object()
 
 
 class DatabaseService:
     """Service for database operations"""
     
-    def __init__(self):
-        self.db = get_database()
-        print(self.db)
-    def ensure_db(self):
-        if self.db is None:
-            self.db = get_database()
+    def __init__(self, store: Optional[Storage] = None):
+        self.store = store or get_storage()
+        # Small, hot per-user documents read on every focus check
+        self.settings_cache = TTLCache(maxsize=DOCUMENT_CACHE_SIZE, ttl=DOCUMENT_CACHE_TTL)
+        self.focus_cache = TTLCache(maxsize=DOCUMENT_CACHE_SIZE, ttl=DOCUMENT_CACHE_TTL)
     # ============ Bookmarks ============
     
     async def add_bookmark(self, bookmark: BookmarkModel) -> str:
         """Add a new bookmark"""
-        self.ensure_db()
-        result = await self.db.bookmarks.insert_one(bookmark.dict(by_alias=True, exclude={"id"}))
-        return str(result.inserted_id)
-    
-    async def get_bookmarks(self, user_id: str = "default_user", folder: Optional[str] = None) -> List[dict]:
-        """Get all bookmarks for a user"""
-        self.ensure_db()
-        query = {"user_id": user_id}
-        if folder:
-            query["folder"] = folder
-        
-        cursor = self.db.bookmarks.find(query).sort("created_at", -1)
-        bookmarks = await cursor.to_list(length=1000)
-        
-        # Convert ObjectId to string
-        for bookmark in bookmarks:
-            bookmark["_id"] = str(bookmark["_id"])
-        
-        return bookmarks
-    
-    async def delete_bookmark(self, bookmark_id: str) -> bool:
-        """Delete a bookmark"""
-        self.ensure_db()
-        from bson import ObjectId
-        result = await self.db.bookmarks.delete_one({"_id": ObjectId(bookmark_id)})
-        return result.deleted_count > 0
-    
-    async def search_bookmarks(self, user_id: str, query: str) -> List[dict]:
-        """Search bookmarks by title or URL"""
-        self.ensure_db()
-        cursor = self.db.bookmarks.find({
-            "user_id": user_id,
-            "$or": [
-                {"title": {"$regex": query, "$options": "i"}},
-                {"url": {"$regex": query, "$options": "i"}},
-                {"tags": {"$regex": query, "$options": "i"}}
-            ]
-        }).sort("created_at", -1)
-        
-        bookmarks = await cursor.to_list(length=100)
-        for bookmark in bookmarks:
-            bookmark["_id"] = str(bookmark["_id"])
-        
-        return bookmarks
+        doc = bookmark.model_dump(by_alias=True, exclude={"id"})
+        doc.update(search_index.search_fields(bookmark.url, bookmark.title, bookmark.tags))
+        bookmark_id = await self.store.insert_bookmark(doc)
+        suggest_index.record_bookmark(bookmark.user_id, bookmark.url, bookmark.title, bookmark.created_at)
+        return bookmark_id
+    
+    async def get_bookmarks(self, user_id: str = "default_user", folder: Optional[str] = None,
+                            limit: int = 1000, cursor: Optional[str] = None) -> Tuple[List[dict], Optional[str]]:
+        """Get a page of bookmarks for a user, newest first"""
+        return await self.store.list_bookmarks(user_id, folder, limit, cursor)
+    
+    def stream_bookmarks(self, user_id: str = "default_user", folder: Optional[str] = None,
+                         cursor: Optional[str] = None) -> AsyncIterator[bytes]:
+        """Stream bookmarks as NDJSON"""
+        return pagination.ndjson_lines(self.store.iter_bookmarks(user_id, folder, cursor=cursor))
+    
+    async def delete_bookmark(self, user_id: str, bookmark_id: str) -> bool:
+        """Delete one of a user's bookmarks"""
+        if not await self.store.delete_bookmark(user_id, bookmark_id):
+            return False
+        # Losing a bookmark lowers a ranking, which the trie can't apply incrementally
+        suggest_index.invalidate(user_id)
+        return True
+    
+    async def search_bookmarks(self, user_id: str, query: str, page: int = 1, page_size: int = 50) -> dict:
+        """Search bookmarks by title, URL or tags, ranked by relevance"""
+        return await self._search("bookmarks", user_id, query, page, page_size)
     
     # ============ History ============
     
     async def add_history(self, history: HistoryModel) -> str:
-        """Add or update browsing history"""
-        self.ensure_db()
-        # Check if URL already exists for user
-        existing = await self.db.history.find_one({
-            "user_id": history.user_id,
-            "url": history.url
-        })
-        
-        if existing:
-            # Update visit count and timestamp
-            await self.db.history.update_one(
-                {"_id": existing["_id"]},
-                {
-                    "$set": {
-                        "visited_at": datetime.utcnow(),
-                        "title": history.title,
-                        "favicon": history.favicon
-                    },
-                    "$inc": {"visit_count": 1}
-                }
-            )
-            return str(existing["_id"])
-        else:
-            # Insert new history entry
-            result = await self.db.history.insert_one(history.dict(by_alias=True, exclude={"id"}))
-            return str(result.inserted_id)
-    
-    async def get_history(self, user_id: str = "default_user", limit: int = 100) -> List[dict]:
-        """Get browsing history for a user"""
-        self.ensure_db()
-        cursor = self.db.history.find({"user_id": user_id}).sort("visited_at", -1).limit(limit)
-        history = await cursor.to_list(length=limit)
-        
-        for item in history:
-            item["_id"] = str(item["_id"])
-        
-        return history
-    
-    async def search_history(self, user_id: str, query: str) -> List[dict]:
-        """Search browsing history"""
-        self.ensure_db()
-        cursor = self.db.history.find({
-            "user_id": user_id,
-            "$or": [
-                {"title": {"$regex": query, "$options": "i"}},
-                {"url": {"$regex": query, "$options": "i"}}
-            ]
-        }).sort("visited_at", -1).limit(50)
+        """Add or update browsing history in a single atomic upsert"""
+        history_id = await self.store.upsert_history(
+            history.user_id, (history.url, history.title, history.favicon, history.visited_at, 1)
+        )
+        suggest_index.record_visit(history.user_id, history.url, history.title, history.visited_at)
+        insights.record_visit(history.user_id, history.url, history.visited_at)
+        return history_id
+    
+    async def add_history_batch(self, user_id: str, visits: List[HistoryModel]) -> dict:
+        """Apply many history visits in one batched write"""
+        # Coalesce repeat visits so each URL is a single upsert
+        merged = {}
+        for visit in visits:
+            entry = merged.get(visit.url)
+            if entry is None:
+                merged[visit.url] = {"visit": visit, "count": 1}
+                continue
+            entry["count"] += 1
+            if visit.visited_at >= entry["visit"].visited_at:
+                entry["visit"] = visit
         
-        history = await cursor.to_list(length=50)
-        for item in history:
-            item["_id"] = str(item["_id"])
+        result = await self.store.upsert_history_batch(user_id, [
+            (url, entry["visit"].title, entry["visit"].favicon, entry["visit"].visited_at, entry["count"])
+            for url, entry in merged.items()
+        ])
+        for url, entry in merged.items():
+            suggest_index.record_visit(user_id, url, entry["visit"].title, entry["visit"].visited_at, entry["count"])
+        # Rollups count each visit on its own day and hour
+        for visit in visits:
+            insights.record_visit(user_id, visit.url, visit.visited_at)
+        return result
+    
+    async def get_history(self, user_id: str = "default_user", limit: int = 100,
+                          cursor: Optional[str] = None) -> Tuple[List[dict], Optional[str]]:
+        """Get a page of browsing history for a user, most recent first"""
+        return await self.store.list_history(user_id, limit, cursor)
+    
+    def stream_history(self, user_id: str = "default_user", limit: Optional[int] = None,
+                       cursor: Optional[str] = None) -> AsyncIterator[bytes]:
+        """Stream browsing history as NDJSON"""
+        return pagination.ndjson_lines(self.store.iter_history(user_id, limit, cursor))
+    
+    async def search_history(self, user_id: str, query: str, page: int = 1, page_size: int = 50,
+                             include_archive: bool = False) -> dict:
+        """Search browsing history, ranked by relevance, popularity and recency"""
+        return await self._search("history", user_id, query, page, page_size, include_archive)
+    
+    async def _search(self, collection: str, user_id: str, query: str, page: int, page_size: int,
+                      include_archive: bool = False) -> dict:
+        """Index-backed token prefix search shared by bookmarks and history"""
+        terms = search_index.query_terms(query)
+        if not terms:
+            return {"results": [], "has_more": False}
         
-        return history
+        candidates = await self.store.search_candidates(collection, user_id, terms, search_index.CANDIDATE_LIMIT)
+        if include_archive:
+            candidates += await history_compactor.search(user_id, terms, search_index.CANDIDATE_LIMIT)
+        return search_index.rank(candidates, terms, page, page_size)
+    
+    async def compact_history(self, user_id: str) -> dict:
+        """Apply retention settings and archive cold history now"""
+        return await history_compactor.compact_user(user_id)
+    
+    async def backfill_search_terms(self, batch_size: int = 500) -> int:
+        """Recompute search_terms that are missing or older than the tokenizer (terms_version)"""
+        return await self.store.backfill_search_terms(batch_size)
+    
+    async def get_insights(self, user_id: str, days: int = 7) -> dict:
+        """Precomputed browsing and focus statistics for the last days"""
+        return await insights.get_insights(user_id, days)
+    
+    async def suggest(self, user_id: str, prefix: str, limit: int = 8) -> List[dict]:
+        """Frecency-ranked completions from history and bookmarks"""
+        return await suggest_index.suggest(self.store, user_id, prefix, limit)
     
     async def clear_history(self, user_id: str = "default_user") -> int:
         """Clear all history for a user"""
-        self.ensure_db()
-        result = await self.db.history.delete_many({"user_id": user_id})
-        return result.deleted_count
+        count = await self.store.clear_history(user_id)
+        await self.store.delete_archive_buckets(user_id)
+        suggest_index.invalidate(user_id)
+        insights.discard(user_id)
+        await self.store.delete_rollups(user_id)
+        return count
     
     # ============ Settings ============
     
     async def get_settings(self, user_id: str = "default_user") -> dict:
-        """Get user settings"""
-        self.ensure_db()
-        settings = await self.db.settings.find_one({"user_id": user_id})
+        """Get user settings (read-through cached)"""
+        cached = self.settings_cache.get(user_id, _MISSING)
+        if cached is not _MISSING:
+            # Deep, so callers changing nested settings can't alter the cached copy
+            return copy.deepcopy(cached)
         
-        if not settings:
-            # Create default settings
-            default_settings = SettingsModel(user_id=user_id)
-            await self.db.settings.insert_one(default_settings.dict(by_alias=True, exclude={"id"}))
-            settings = default_settings.dict()
-        else:
-            settings["_id"] = str(settings["_id"])
+        # One upsert, so concurrent first reads can't both insert defaults
+        defaults = SettingsModel(user_id=user_id).model_dump(by_alias=True, exclude={"id", "user_id"})
+        settings = await self.store.find_or_create_settings(user_id, defaults)
         
-        return settings
+        self.settings_cache.set(user_id, settings)
+        return copy.deepcopy(settings)
     
     async def update_settings(self, user_id: str, settings_update: dict) -> bool:
         """Update user settings"""
-        self.ensure_db()
         settings_update["updated_at"] = datetime.utcnow()
         
-        result = await self.db.settings.update_one(
-            {"user_id": user_id},
-            {"$set": settings_update},
-            upsert=True
-        )
+        updated = await self.store.update_settings(user_id, settings_update)
+        self.settings_cache.pop(user_id)
+        if updated:
+            live_updates.update(user_id, "settings", settings_state(settings_update))
         
-        return result.modified_count > 0 or result.upserted_id is not None
+        return updated
     
     # ============ Focus Mode ============
     
     async def create_focus_session(self, session: FocusSessionModel) -> str:
-        """Create a new focus mode session"""
-        self.ensure_db()
-        # Deactivate any existing active sessions
-        await self.db.focus_sessions.update_many(
-            {"user_id": session.user_id, "active": True},
-            {"$set": {"active": False, "ended_at": datetime.utcnow()}}
-        )
-        
-        # Create new session
-        result = await self.db.focus_sessions.insert_one(session.dict(by_alias=True, exclude={"id"}))
-        return str(result.inserted_id)
+        """Create a new focus mode session, ending any active one"""
+        session_id = await self.store.start_focus_session(session.model_dump(by_alias=True, exclude={"id"}))
+        self.focus_cache.pop(session.user_id)
+        await self._publish_focus(session.user_id)
+        return session_id
     
     async def get_active_focus_session(self, user_id: str = "default_user") -> Optional[dict]:
-        """Get active focus mode session"""
-        self.ensure_db()
-        session = await self.db.focus_sessions.find_one({
-            "user_id": user_id,
-            "active": True
-        })
+        """Get active focus mode session (read-through cached, including "none")"""
+        cached = self.focus_cache.get(user_id, _MISSING)
+        if cached is not _MISSING:
+            return copy.deepcopy(cached)
         
-        if session:
-            session["_id"] = str(session["_id"])
+        session = await self.store.find_active_focus_session(user_id)
         
-        return session
+        self.focus_cache.set(user_id, session)
+        return copy.deepcopy(session)
     
     async def update_focus_session_stats(self, session_id: str, allowed: bool) -> bool:
         """Update focus session statistics"""
-        self.ensure_db()
-        from bson import ObjectId
-        
-        update = {
-            "$inc": {
-                "urls_checked": 1,
-                "urls_allowed": 1 if allowed else 0,
-                "urls_blocked": 0 if allowed else 1
-            }
-        }
-        
-        result = await self.db.focus_sessions.update_one(
-            {"_id": ObjectId(session_id)},
-            update
-        )
+        # The updated document keeps the cached copy current
+        session = await self.store.record_focus_check(session_id, allowed)
+        if session is None:
+            return False
         
-        return result.modified_count > 0
+        self._refresh_focus_cache(session)
+        if session.get("active"):
+            live_updates.publish(session["user_id"], "focus", focus_state(session))
+        insights.record_focus_check(session["user_id"], allowed)
+        return True
     
     async def end_focus_session(self, session_id: str) -> bool:
         """End a focus mode session"""
-        self.ensure_db()
-        from bson import ObjectId
-        
-        result = await self.db.focus_sessions.update_one(
-            {"_id": ObjectId(session_id)},
-            {"$set": {"active": False, "ended_at": datetime.utcnow()}}
-        )
+        user_id = await self.store.end_focus_session(session_id)
+        if user_id is None:
+            return False
         
-        return result.modified_count > 0
+        self.focus_cache.pop(user_id)
+        await self._publish_focus(user_id)
+        return True
     
-    async def get_focus_history(self, user_id: str = "default_user", limit: int = 10) -> List[dict]:
-        """Get focus mode session history"""
-        self.ensure_db()
-        cursor = self.db.focus_sessions.find({"user_id": user_id}).sort("created_at", -1).limit(limit)
-        sessions = await cursor.to_list(length=limit)
-        
-        for session in sessions:
-            session["_id"] = str(session["_id"])
-        
-        return sessions
+    async def _publish_focus(self, user_id: str):
+        """Push the user's active session to their clients, if any are listening"""
+        if live_updates.subscribed(user_id, "focus"):
+            live_updates.publish(user_id, "focus", focus_state(await self.get_active_focus_session(user_id)))
+    
+    def _refresh_focus_cache(self, session: dict):
+        """Store a freshly written session if it is the user's active one"""
+        if session.get("active"):
+            self.focus_cache.set(session["user_id"], session)
+        else:
+            self.focus_cache.pop(session["user_id"])
+    
+    async def get_focus_history(self, user_id: str = "default_user", limit: int = 10,
+                                cursor: Optional[str] = None) -> Tuple[List[dict], Optional[str]]:
+        """Get a page of focus mode session history"""
+        return await self.store.list_focus_sessions(user_id, limit, cursor)
+    
+    def stream_focus_history(self, user_id: str = "default_user", limit: Optional[int] = None,
+                             cursor: Optional[str] = None) -> AsyncIterator[bytes]:
+        """Stream focus mode session history as NDJSON"""
+        return pagination.ndjson_lines(self.store.iter_focus_sessions(user_id, limit, cursor))
+    
+    # ============ Downloads ============
+    
+    async def add_download(self, download: DownloadModel) -> str:
+        """Create a download entry"""
+        return await self.store.insert_download(download.model_dump(by_alias=True, exclude={"id"}))
+    
+    async def get_download(self, download_id: str) -> Optional[dict]:
+        return await self.store.find_download(download_id)
+    
+    async def get_downloads(self, user_id: str = "default_user", limit: int = 100,
+                            cursor: Optional[str] = None) -> Tuple[List[dict], Optional[str]]:
+        """Get a page of downloads for a user, newest first"""
+        return await self.store.list_downloads(user_id, limit, cursor)
+    
+    def stream_downloads(self, user_id: str = "default_user", cursor: Optional[str] = None) -> AsyncIterator[bytes]:
+        """Stream downloads as NDJSON"""
+        return pagination.ndjson_lines(self.store.iter_downloads(user_id, cursor=cursor))
+    
+    async def get_downloads_by_status(self, status: str) -> List[dict]:
+        """Downloads of every user in a status (used to resume server-side downloads)"""
+        return await self.store.list_downloads_by_status(status)
+    
+    async def update_download(self, download_id: str, fields: dict) -> bool:
+        """Set status/progress fields on a download"""
+        return await self.store.update_download(download_id, fields)
+    
+    async def delete_download(self, download_id: str) -> bool:
+        return await self.store.delete_download(download_id)
+    
+    async def clear_downloads(self, user_id: str = "default_user", status: Optional[str] = None) -> int:
+        """Delete a user's downloads, optionally only those with a status"""
+        return await self.store.delete_downloads(user_id, status)
+    
+    # ============ Cache coherence ============
+    
+    def cache_stats(self) -> dict:
+        """Hit and miss counters of the per-user document caches"""
+        return {
+            "settings": self.settings_cache.stats(),
+            "focus_sessions": self.focus_cache.stats(),
+            "auth_sessions": session_cache.stats(),
+            "change_stream": self.store.watching
+        }
+    
+    async def watch_changes(self):
+        """Invalidate cached documents on writes from other workers, and push them to connected clients
+
+        Only MongoDB replica sets report these; elsewhere the cache TTL
+        alone bounds staleness.
+        """
+        caches = {"settings": self.settings_cache, "focus_sessions": self.focus_cache}
+        async for collection, user_id, doc in self.store.watch(list(caches) + ["sessions"]):
+            if collection == "sessions":
+                # Only deletes (logout, expiry) lack a user; sessions are cached by token
+                if user_id is None:
+                    session_cache.clear()
+            elif user_id is None:
+                caches[collection].clear()
+                await self._republish(collection, None)
+            elif collection == "focus_sessions" and doc is not None and doc.get("active"):
+                self._focus_changed(doc)
+            else:
+                caches[collection].pop(user_id)
+                await self._republish(collection, user_id)
+    
+    def _focus_changed(self, session: dict):
+        """Take an active session from the change stream as the cached and pushed copy"""
+        user_id = session["user_id"]
+        cached = self.focus_cache.get(user_id, _MISSING)
+        # This process's own writes (every URL check) come back as events; the cache already has them
+        if cached == session:
+            return
+        # Looked up before this process's latest check landed; that check's own event follows
+        if isinstance(cached, dict) and cached["_id"] == session["_id"] \
+                and cached.get("urls_checked", 0) > session.get("urls_checked", 0):
+            return
+        self.focus_cache.set(user_id, session)
+        live_updates.publish(user_id, "focus", focus_state(session))
+    
+    async def _republish(self, collection: str, user_id: Optional[str]):
+        """Publish fresh state after a change stream event (this process's own writes diff to nothing)"""
+        topic = "settings" if collection == "settings" else "focus"
+        user_ids = live_updates.subscribers_of(topic) if user_id is None else [user_id]
+        for user_id in user_ids:
+            if not live_updates.subscribed(user_id, topic):
+                continue
+            try:
+                if topic == "settings":
+                    live_updates.publish(user_id, topic, settings_state(await self.get_settings(user_id)))
+                else:
+                    await self._publish_focus(user_id)
+            except Exception as e:
+                logger.warning(f"Publishing {topic} change for user {user_id} failed: {e}")
 
 
 # Global service instance
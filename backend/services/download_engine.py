@@ -0,0 +1,356 @@
+"""Server-side segmented downloads with resume"""
+import os
+import re
+import asyncio
+import hashlib
+from datetime import datetime
+from typing import Dict, List, Optional
+import httpx
+from services.database_service import db_service
+from services.download_progress import download_progress
+from services.http_client import get_http_client, host_limiter
+import logging
+
+logger = logging.getLogger(__name__)
+
+DOWNLOADS_DIR = os.getenv("DOWNLOADS_DIR", "downloads")
+# Byte ranges fetched in parallel per file, and the smallest range worth its own request
+DOWNLOAD_SEGMENTS = int(os.getenv("DOWNLOAD_SEGMENTS", 4))
+DOWNLOAD_MIN_SEGMENT_BYTES = int(os.getenv("DOWNLOAD_MIN_SEGMENT_BYTES", 1024 * 1024))
+DOWNLOAD_MAX_ACTIVE = int(os.getenv("DOWNLOAD_MAX_ACTIVE", 3))
+DOWNLOAD_RETRIES = int(os.getenv("DOWNLOAD_RETRIES", 3))
+
+# Bytes buffered per segment before each positional write
+WRITE_BUFFER_BYTES = 64 * 1024
+# Ranges are byte offsets of the file as stored, so ask for it unencoded
+IDENTITY = {"Accept-Encoding": "identity"}
+
+_UNSAFE = re.compile(r'[\x00-\x1f<>:"/\\|?*]')
+_CONTENT_RANGE = re.compile(r"bytes \d+-\d+/(\d+)")
+
+
+class DownloadFailed(Exception):
+    """A download that can't complete (HTTP error, retries exhausted, checksum mismatch)"""
+
+
+class _RemoteChanged(DownloadFailed):
+    """The server ignored If-Range, so the file changed since the partial download started"""
+
+
+def safe_filename(name: str) -> str:
+    name = _UNSAFE.sub("_", os.path.basename(name or "")).strip(" .")
+    return name[:200] or "download"
+
+
+def plan_segments(size: Optional[int], ranges: bool) -> List[dict]:
+    """Byte ranges (inclusive ends) covering a file; one open-ended segment when size or ranges are unknown"""
+    if not size or not ranges:
+        return [{"start": 0, "end": size - 1 if size else None, "received": 0}]
+    count = max(1, min(DOWNLOAD_SEGMENTS, size // DOWNLOAD_MIN_SEGMENT_BYTES))
+    step = -(-size // count)
+    return [
+        {"start": start, "end": min(start + step, size) - 1, "received": 0}
+        for start in range(0, size, step)
+    ]
+
+
+def _unique_path(directory: str, filename: str) -> str:
+    base, ext = os.path.splitext(filename)
+    path, n = os.path.join(directory, filename), 1
+    while os.path.exists(path) or os.path.exists(path + ".part"):
+        path = os.path.join(directory, f"{base} ({n}){ext}")
+        n += 1
+    return path
+
+
+def _preallocate(path: str, size: Optional[int]):
+    os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+    with open(path, "wb") as f:
+        if size:
+            f.truncate(size)
+
+
+def _sha256(path: str) -> str:
+    digest = hashlib.sha256()
+    with open(path, "rb") as f:
+        for block in iter(lambda: f.read(1024 * 1024), b""):
+            digest.update(block)
+    return digest.hexdigest()
+
+
+class DownloadJob:
+    """In-flight state of one download; segments are what's persisted for resume"""
+
+    def __init__(self, doc: dict):
+        self.id = str(doc["_id"])
+        self.url = doc["url"]
+        self.path: str = doc.get("save_path")
+        self.size: Optional[int] = doc.get("file_size")
+        self.segments: List[dict] = doc.get("segments") or []
+        self.validator: Optional[str] = doc.get("validator")
+        self.ranges = bool(doc.get("ranges"))
+        self.expected_sha256: Optional[str] = doc.get("expected_sha256")
+
+    @property
+    def part_path(self) -> str:
+        return self.path + ".part"
+
+    @property
+    def received(self) -> int:
+        return sum(segment["received"] for segment in self.segments)
+
+    def progress_fields(self) -> dict:
+        received = self.received
+        return {
+            "downloaded_bytes": received,
+            "progress": round(100 * received / self.size, 2) if self.size else 0.0,
+            "segments": [dict(segment) for segment in self.segments]
+        }
+
+
+class DownloadEngine:
+    """Runs server-side downloads: parallel ranged GETs into a preallocated file"""
+
+    def __init__(self):
+        self.tasks: Dict[str, asyncio.Task] = {}
+        self.jobs: Dict[str, DownloadJob] = {}
+        self.slots = asyncio.Semaphore(DOWNLOAD_MAX_ACTIVE)
+        # Why a task is being cancelled: "paused", "cancelled", or absent on shutdown
+        self.stop_reasons: Dict[str, str] = {}
+
+    def start(self, download_id: str) -> bool:
+        """Start (or resume) a download in the background; False if it is already running"""
+        if download_id in self.tasks:
+            return False
+        task = asyncio.create_task(self._run(download_id))
+        self.tasks[download_id] = task
+        task.add_done_callback(lambda _: self.tasks.pop(download_id, None))
+        return True
+
+    async def _stop(self, download_id: str, reason: str) -> bool:
+        """Stop a running download, waiting until its state is saved"""
+        task = self.tasks.get(download_id)
+        if task is None:
+            return False
+        self.stop_reasons[download_id] = reason
+        task.cancel()
+        await asyncio.gather(task, return_exceptions=True)
+        return True
+
+    async def pause(self, download_id: str) -> bool:
+        """Stop a download, keeping its partial file and segments for resume"""
+        return await self._stop(download_id, "paused")
+
+    async def cancel(self, download_id: str):
+        """Stop a download (running or not) and delete its partial file"""
+        if await self._stop(download_id, "cancelled"):
+            return
+        doc = await db_service.get_download(download_id)
+        if doc and doc.get("server_side") and doc.get("save_path") and doc.get("status") != "completed":
+            await asyncio.to_thread(self._remove, doc["save_path"] + ".part")
+
+    async def resume_pending(self):
+        """Restart server-side downloads interrupted by a shutdown"""
+        try:
+            for doc in await db_service.get_downloads_by_status("in_progress"):
+                if doc.get("server_side"):
+                    self.start(str(doc["_id"]))
+        except Exception as e:
+            logger.error(f"Resuming downloads failed: {e}")
+
+    async def shutdown(self):
+        tasks = list(self.tasks.values())
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+
+    async def _run(self, download_id: str):
+        job = None
+        try:
+            async with self.slots:
+                doc = await db_service.get_download(download_id)
+                if not doc:
+                    return
+                job = self.jobs[download_id] = DownloadJob(doc)
+                await self._download(job, doc)
+        except asyncio.CancelledError:
+            # Also reached while still queued for a slot
+            reason = self.stop_reasons.pop(download_id, None)
+            fields = job.progress_fields() if job else {}
+            if reason:
+                fields["status"] = reason
+            if reason == "cancelled" and job and job.path:
+                await asyncio.to_thread(self._remove, job.part_path)
+                fields["segments"] = []
+            if fields:
+                await download_progress.update(download_id, fields, persist=True)
+            raise
+        except (DownloadFailed, httpx.HTTPError, OSError) as e:
+            logger.warning(f"Download {download_id} failed: {e}")
+            await download_progress.update(download_id, {
+                **(job.progress_fields() if job else {}), "status": "failed", "error_message": str(e) or type(e).__name__
+            })
+        finally:
+            self.jobs.pop(download_id, None)
+
+    async def _download(self, job: DownloadJob, doc: dict):
+        resumable = job.segments and job.path and os.path.exists(job.part_path)
+        if not resumable:
+            await self._prepare(job, doc)
+        else:
+            await download_progress.update(job.id, {"status": "in_progress", "error_message": None})
+
+        try:
+            await self._fetch_all(job)
+        except _RemoteChanged:
+            logger.info(f"Download {job.id} changed upstream, restarting")
+            await self._prepare(job, doc)
+            await self._fetch_all(job)
+
+        if job.size is not None and job.received != job.size:
+            raise DownloadFailed(f"Received {job.received} of {job.size} bytes")
+        digest = await asyncio.to_thread(_sha256, job.part_path)
+        if job.expected_sha256 and digest != job.expected_sha256.lower():
+            raise DownloadFailed(f"Checksum mismatch: expected {job.expected_sha256}, got {digest}")
+        await asyncio.to_thread(os.replace, job.part_path, job.path)
+        await download_progress.update(job.id, {
+            **job.progress_fields(),
+            "status": "completed",
+            "progress": 100.0,
+            "file_size": job.received,
+            "sha256": digest,
+            "segments": [],
+            "completed_at": datetime.utcnow()
+        })
+
+    async def _prepare(self, job: DownloadJob, doc: dict):
+        """Probe the server, plan segments and preallocate the partial file"""
+        size, ranges, validator, mime_type = await self._probe(job.url)
+        if job.path is None:
+            directory = os.path.join(DOWNLOADS_DIR, safe_filename(doc.get("user_id")))
+            await asyncio.to_thread(os.makedirs, directory, exist_ok=True)
+            job.path = _unique_path(directory, safe_filename(doc.get("filename")))
+        job.size, job.ranges, job.validator = size, ranges, validator
+        job.segments = plan_segments(size, ranges)
+        await asyncio.to_thread(_preallocate, job.part_path, size)
+        await download_progress.update(job.id, {
+            **job.progress_fields(),
+            "status": "in_progress",
+            "save_path": job.path,
+            "file_size": size,
+            "mime_type": doc.get("mime_type") or mime_type,
+            "ranges": ranges,
+            "validator": validator,
+            "error_message": None
+        }, persist=True)
+
+    async def _probe(self, url: str):
+        """(size, supports ranges, validator for If-Range, content type) from a one-byte ranged GET"""
+        client = get_http_client()
+        async with host_limiter.slot(url):
+            async with client.stream("GET", url, headers={**IDENTITY, "Range": "bytes=0-0"}) as response:
+                if response.status_code >= 400:
+                    raise DownloadFailed(f"Server returned HTTP {response.status_code}")
+                headers = response.headers
+                ranges = response.status_code == 206
+                match = _CONTENT_RANGE.match(headers.get("content-range", ""))
+                if ranges and match:
+                    size = int(match.group(1))
+                else:
+                    length = headers.get("content-length")
+                    size = int(length) if length and length.isdigit() else None
+                    ranges = False
+                # Weak ETags can't be used with If-Range
+                etag = headers.get("etag")
+                validator = etag if etag and not etag.startswith("W/") else headers.get("last-modified")
+                mime_type = headers.get("content-type", "").split(";")[0] or None
+        return size, ranges and size is not None, validator, mime_type
+
+    async def _fetch_all(self, job: DownloadJob):
+        pending = [segment for segment in job.segments
+                   if segment["end"] is None or segment["start"] + segment["received"] <= segment["end"]]
+        tasks = [asyncio.create_task(self._fetch_segment(job, segment)) for segment in pending]
+        try:
+            await asyncio.gather(*tasks)
+        finally:
+            for task in tasks:
+                task.cancel()
+            await asyncio.gather(*tasks, return_exceptions=True)
+
+    async def _fetch_segment(self, job: DownloadJob, segment: dict):
+        client = get_http_client()
+        for attempt in range(DOWNLOAD_RETRIES + 1):
+            if not job.ranges:
+                # Without ranges a retry has to start over
+                segment["received"] = 0
+            position = segment["start"] + segment["received"]
+            headers = dict(IDENTITY)
+            if job.ranges:
+                headers["Range"] = f"bytes={position}-{segment['end']}"
+                if job.validator:
+                    headers["If-Range"] = job.validator
+            try:
+                async with host_limiter.slot(job.url):
+                    async with client.stream("GET", job.url, headers=headers) as response:
+                        if job.ranges and response.status_code == 200:
+                            raise _RemoteChanged()
+                        if response.status_code not in (200, 206):
+                            raise DownloadFailed(f"Server returned HTTP {response.status_code}")
+                        await self._write(job, segment, response, position)
+                return
+            except httpx.TransportError as e:
+                if attempt == DOWNLOAD_RETRIES:
+                    raise DownloadFailed(f"Segment at byte {position} failed: {e}")
+                logger.info(f"Download {job.id} segment at byte {position} retrying: {e}")
+                await asyncio.sleep(0.5 * 2 ** attempt)
+
+    async def _write(self, job: DownloadJob, segment: dict, response: httpx.Response, position: int):
+        """Stream a response into the segment's byte range of the partial file"""
+        remaining = None if segment["end"] is None else segment["end"] + 1 - position
+        handle = await asyncio.to_thread(open, job.part_path, "r+b")
+        try:
+            await asyncio.to_thread(handle.seek, position)
+            buffer = bytearray()
+            async for chunk in response.aiter_bytes():
+                if remaining is not None:
+                    chunk = chunk[:remaining - len(buffer)]
+                buffer += chunk
+                if len(buffer) >= WRITE_BUFFER_BYTES or (remaining is not None and len(buffer) >= remaining):
+                    await asyncio.to_thread(handle.write, bytes(buffer))
+                    segment["received"] += len(buffer)
+                    if remaining is not None:
+                        remaining -= len(buffer)
+                    buffer.clear()
+                    await download_progress.update(job.id, job.progress_fields())
+                    if remaining == 0:
+                        break
+            if buffer:
+                await asyncio.to_thread(handle.write, bytes(buffer))
+                segment["received"] += len(buffer)
+                if remaining is not None:
+                    remaining -= len(buffer)
+        finally:
+            await asyncio.to_thread(handle.close)
+        if remaining:
+            # Retried from where it stopped
+            raise httpx.RemoteProtocolError(f"Connection closed {remaining} bytes short of the segment end")
+        if job.size is None and segment["end"] is None:
+            job.size = segment["received"]
+
+    @staticmethod
+    def _remove(path: str):
+        try:
+            os.remove(path)
+        except FileNotFoundError:
+            pass
+
+    def stats(self) -> dict:
+        return {
+            "active": len(self.jobs),
+            "queued": len(self.tasks) - len(self.jobs),
+            "downloads": {job_id: job.progress_fields()["downloaded_bytes"] for job_id, job in self.jobs.items()}
+        }
+
+
+# Global instance
+download_engine = DownloadEngine()
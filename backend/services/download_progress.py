@@ -0,0 +1,186 @@
+"""In-memory download progress with coarse persistence and push to subscribers"""
+import os
+import time
+import asyncio
+from collections import defaultdict
+from typing import Dict, Optional, Set
+from services.database_service import db_service
+import logging
+
+logger = logging.getLogger(__name__)
+
+# Progress is written to the database at most this often per download;
+# status changes are written immediately
+DOWNLOAD_PROGRESS_FLUSH_INTERVAL = float(os.getenv("DOWNLOAD_PROGRESS_FLUSH_INTERVAL", 5))
+# Minimum gap between pushes to one subscriber; updates in between are merged
+DOWNLOAD_PUSH_INTERVAL = float(os.getenv("DOWNLOAD_PUSH_INTERVAL", 0.25))
+# Entries without updates for this long are dropped once persisted
+DOWNLOAD_PROGRESS_IDLE = float(os.getenv("DOWNLOAD_PROGRESS_IDLE", 300))
+
+# Statuses after which a download gets no more progress
+FINAL_STATUSES = {"completed", "failed", "cancelled", "paused"}
+# Fields pushed to clients (segment offsets stay server-side)
+PUBLIC_FIELDS = {"status", "progress", "downloaded_bytes", "file_size", "error_message", "completed_at", "save_path"}
+
+
+class Subscriber:
+    """One client's pending updates, merged per download until it is ready for more"""
+
+    def __init__(self, user_id: str):
+        self.user_id = user_id
+        self.pending: Dict[str, dict] = {}
+        self.ready = asyncio.Event()
+        self.last_sent = 0.0
+
+    def offer(self, download_id: str, fields: dict):
+        self.pending.setdefault(download_id, {}).update(fields)
+        self.ready.set()
+
+    async def next_batch(self) -> Dict[str, dict]:
+        """Changes since the last batch, at most one batch per DOWNLOAD_PUSH_INTERVAL"""
+        await self.ready.wait()
+        delay = self.last_sent + DOWNLOAD_PUSH_INTERVAL - time.monotonic()
+        if delay > 0:
+            await asyncio.sleep(delay)
+        self.ready.clear()
+        batch, self.pending = self.pending, {}
+        self.last_sent = time.monotonic()
+        return batch
+
+
+class _Entry:
+    __slots__ = ("user_id", "fields", "unsaved", "touched")
+
+    def __init__(self, user_id: str, fields: dict):
+        self.user_id = user_id
+        self.fields = fields
+        self.unsaved: dict = {}
+        self.touched = time.monotonic()
+
+
+class DownloadProgress:
+    """Latest progress per download, kept in memory
+
+    Updates are cheap dict merges. The database sees a download's status
+    changes right away and its progress once per flush interval, and
+    subscribers get merged updates at most every DOWNLOAD_PUSH_INTERVAL.
+    State is per process; other workers see progress at flush granularity.
+    """
+
+    def __init__(self):
+        self.entries: Dict[str, _Entry] = {}
+        self.subscribers: Dict[str, Set[Subscriber]] = defaultdict(set)
+        self.updates = 0
+        self.writes = 0
+
+    async def update(self, download_id: str, fields: dict, persist: bool = False) -> bool:
+        """Record new fields for a download; False if it doesn't exist"""
+        entry = self.entries.get(download_id)
+        if entry is None:
+            doc = await db_service.get_download(download_id)
+            if not doc:
+                return False
+            entry = self.entries.get(download_id)
+            if entry is None:
+                entry = self.entries[download_id] = _Entry(
+                    doc["user_id"], {name: doc.get(name) for name in PUBLIC_FIELDS}
+                )
+        self.updates += 1
+        status = fields.get("status")
+        changed = status is not None and status != entry.fields.get("status")
+        entry.fields.update(fields)
+        entry.unsaved.update(fields)
+        entry.touched = time.monotonic()
+        self._publish(entry.user_id, download_id, fields)
+        if changed or persist:
+            await self._persist(download_id, entry)
+        if status in FINAL_STATUSES and not entry.unsaved:
+            self.entries.pop(download_id, None)
+        return True
+
+    def overlay(self, doc: dict) -> dict:
+        """A stored download with any progress not yet written applied"""
+        entry = self.entries.get(str(doc["_id"]))
+        return {**doc, **entry.fields} if entry else doc
+
+    def discard(self, download_id: str):
+        self.entries.pop(download_id, None)
+
+    def discard_user(self, user_id: str, status: Optional[str] = None):
+        for download_id, entry in list(self.entries.items()):
+            if entry.user_id == user_id and (status is None or entry.fields.get("status") == status):
+                del self.entries[download_id]
+
+    def snapshot(self, user_id: str) -> Dict[str, dict]:
+        """Public fields of a user's downloads currently tracked in memory"""
+        return {
+            download_id: self._public(entry.fields)
+            for download_id, entry in self.entries.items() if entry.user_id == user_id
+        }
+
+    def subscribe(self, user_id: str) -> Subscriber:
+        subscriber = Subscriber(user_id)
+        self.subscribers[user_id].add(subscriber)
+        return subscriber
+
+    def unsubscribe(self, subscriber: Subscriber):
+        subscribers = self.subscribers.get(subscriber.user_id)
+        if subscribers is not None:
+            subscribers.discard(subscriber)
+            if not subscribers:
+                del self.subscribers[subscriber.user_id]
+
+    @staticmethod
+    def _public(fields: dict) -> dict:
+        return {name: value for name, value in fields.items() if name in PUBLIC_FIELDS}
+
+    def _publish(self, user_id: str, download_id: str, fields: dict):
+        public = self._public(fields)
+        if public:
+            for subscriber in self.subscribers.get(user_id, ()):
+                subscriber.offer(download_id, public)
+
+    async def _persist(self, download_id: str, entry: _Entry):
+        if not entry.unsaved:
+            return
+        unsaved, entry.unsaved = entry.unsaved, {}
+        try:
+            await db_service.update_download(download_id, unsaved)
+            self.writes += 1
+        except Exception:
+            # Keep them for the next flush, under anything newer
+            entry.unsaved = {**unsaved, **entry.unsaved}
+            raise
+
+    async def flush(self):
+        now = time.monotonic()
+        for download_id, entry in list(self.entries.items()):
+            try:
+                await self._persist(download_id, entry)
+            except Exception as e:
+                logger.warning(f"Saving progress of download {download_id} failed: {e}")
+                continue
+            if now - entry.touched > DOWNLOAD_PROGRESS_IDLE and not entry.unsaved:
+                self.entries.pop(download_id, None)
+
+    async def run(self):
+        """Flush progress periodically; flushes once more when cancelled"""
+        try:
+            while True:
+                await asyncio.sleep(DOWNLOAD_PROGRESS_FLUSH_INTERVAL)
+                await self.flush()
+        except asyncio.CancelledError:
+            await self.flush()
+            raise
+
+    def stats(self) -> dict:
+        return {
+            "tracked": len(self.entries),
+            "subscribers": sum(len(subscribers) for subscribers in self.subscribers.values()),
+            "updates": self.updates,
+            "writes": self.writes
+        }
+
+
+# Global instance
+download_progress = DownloadProgress()
@@ -2,6 +2,7 @@ import os
 from groq import Groq
 from typing import Optional, Dict, Any
 import logging
+from services.command_cache import command_cache
 
 logger = logging.getLogger(__name__)
 
@@ -54,6 +55,10 @@ class GroqClient:
     
     async def parse_command(self, text: str) -> Dict[str, Any]:
         """Parse natural language command into structured action"""
+        cached = command_cache.get(text)
+        if cached is not None:
+            return cached
+        
         system_prompt = """You are a command parser for a browser application. 
 Parse user commands into structured JSON actions.
 
@@ -101,9 +106,11 @@ Examples:
             end = response.rfind('}') + 1
             if start != -1 and end > start:
                 json_str = response[start:end]
-                return json.loads(json_str)
+                parsed = json.loads(json_str)
             else:
-                return json.loads(response)
+                parsed = json.loads(response)
+            command_cache.set(text, parsed)
+            return parsed
         except json.JSONDecodeError:
             logger.error(f"Failed to parse command response: {response}")
             return {
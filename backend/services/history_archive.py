@@ -0,0 +1,214 @@
+"""History retention, compaction and the compressed monthly archive"""
+import os
+import zlib
+import asyncio
+from collections import defaultdict
+from datetime import datetime, timedelta
+from typing import Dict, List, Optional
+import orjson
+from database.storage import get_storage
+from services import search_index
+from services.suggest_index import suggest_index
+import logging
+
+logger = logging.getLogger(__name__)
+
+# Entries stay in the hot collection while newer than this...
+HISTORY_HOT_DAYS = int(os.getenv("HISTORY_HOT_DAYS", 90))
+# ...and while among a user's newest HISTORY_HOT_MAX_ENTRIES
+HISTORY_HOT_MAX_ENTRIES = int(os.getenv("HISTORY_HOT_MAX_ENTRIES", 10000))
+# Seconds between compaction passes over every user
+HISTORY_COMPACT_INTERVAL = int(os.getenv("HISTORY_COMPACT_INTERVAL", 6 * 3600))
+ARCHIVE_BATCH_SIZE = 1000
+# Buckets unpacked per archive search
+ARCHIVE_SEARCH_BUCKETS = 24
+
+# Packed entry layout: [url, title, favicon, visited_at (ISO), visit_count, source history id]
+_URL, _TITLE, _FAVICON, _VISITED_AT, _VISIT_COUNT, _SOURCE_ID = range(6)
+
+
+def month_key(moment: datetime) -> str:
+    return moment.strftime("%Y-%m")
+
+
+def pack(entries: List[list]) -> bytes:
+    return zlib.compress(orjson.dumps(entries), 6)
+
+
+def unpack(packed: bytes) -> List[list]:
+    return orjson.loads(zlib.decompress(packed))
+
+
+def bucket_terms(entries: List[list]) -> List[str]:
+    """Union of the entries' terms: a bucket-level prefilter for search"""
+    terms = set()
+    for entry in entries:
+        terms.update(search_index.search_terms_for(entry[_URL], entry[_TITLE]))
+    return sorted(terms)
+
+
+def make_bucket(user_id: str, month: str, entries: List[list]) -> dict:
+    """Archive document for one user and month"""
+    return {
+        "user_id": user_id,
+        "month": month,
+        "count": len(entries),
+        "visits": sum(entry[_VISIT_COUNT] for entry in entries),
+        "search_terms": bucket_terms(entries),
+        "terms_version": search_index.TERMS_VERSION,
+        "packed": pack(entries),
+        "updated_at": datetime.utcnow()
+    }
+
+
+def entry_document(user_id: str, entry: list) -> dict:
+    """An archived entry shaped like a history document"""
+    return {
+        "user_id": user_id,
+        "url": entry[_URL],
+        "title": entry[_TITLE],
+        "favicon": entry[_FAVICON],
+        "visited_at": datetime.fromisoformat(entry[_VISITED_AT]),
+        "visit_count": entry[_VISIT_COUNT],
+        "archived": True
+    }
+
+
+class HistoryCompactor:
+    """Applies per-user retention and moves cold history into the archive
+
+    Retention comes from each user's settings: history_retention_days
+    deletes older visits everywhere, history_max_entries caps hot plus
+    archived entries (oldest go first). 0 keeps everything.
+    """
+
+    def __init__(self):
+        self.last_run: Optional[dict] = None
+
+    async def run(self):
+        """Compact every user's history periodically until cancelled"""
+        while True:
+            try:
+                await self.compact_all()
+            except Exception as e:
+                logger.error(f"History compaction failed: {e}")
+            await asyncio.sleep(HISTORY_COMPACT_INTERVAL)
+
+    async def compact_all(self) -> dict:
+        totals = defaultdict(int)
+        for user_id in await get_storage().history_users():
+            for key, value in (await self.compact_user(user_id)).items():
+                totals[key] += value
+        self.last_run = {"finished_at": datetime.utcnow(), **totals}
+        if any(totals.values()):
+            logger.info(f"History compaction: {dict(totals)}")
+        return self.last_run
+
+    async def compact_user(self, user_id: str) -> Dict[str, int]:
+        store = get_storage()
+        settings = await store.find_settings(user_id) or {}
+        retention_days = settings.get("history_retention_days") or 0
+        max_entries = settings.get("history_max_entries") or 0
+        now = datetime.utcnow()
+        result = {"deleted": 0, "archived": 0}
+
+        if retention_days:
+            cutoff = now - timedelta(days=retention_days)
+            result["deleted"] += await store.delete_history(user_id, before=cutoff)
+            result["deleted"] += await self._trim_archive(user_id, before=cutoff)
+
+        hot_cutoff = now - timedelta(days=HISTORY_HOT_DAYS)
+        while True:
+            total = await store.count_history(user_id)
+            cold = max(total - HISTORY_HOT_MAX_ENTRIES, await store.count_history(user_id, before=hot_cutoff))
+            if cold <= 0:
+                break
+            batch = await store.oldest_history(user_id, min(cold, ARCHIVE_BATCH_SIZE))
+            await self._archive(user_id, batch)
+            result["archived"] += len(batch)
+
+        if max_entries:
+            result["deleted"] += await self._enforce_max_entries(user_id, max_entries)
+
+        if any(result.values()):
+            # The suggestion trie was built from entries that just moved or went away
+            suggest_index.invalidate(user_id)
+        return result
+
+    async def _archive(self, user_id: str, docs: List[dict]):
+        """Merge hot entries into their month buckets, then delete them"""
+        store = get_storage()
+        by_month = defaultdict(list)
+        for doc in docs:
+            by_month[month_key(doc["visited_at"])].append(doc)
+
+        for month, month_docs in by_month.items():
+            bucket = await store.find_archive_bucket(user_id, month)
+            entries = {entry[_URL]: entry for entry in unpack(bucket["packed"])} if bucket else {}
+            for doc in month_docs:
+                entry = [doc["url"], doc.get("title", ""), doc.get("favicon"),
+                         doc["visited_at"].isoformat(), doc.get("visit_count", 1), str(doc["_id"])]
+                existing = entries.get(doc["url"])
+                # An entry re-archived after an interrupted pass replaces itself instead of adding up
+                if existing and existing[_SOURCE_ID] != entry[_SOURCE_ID]:
+                    entry[_VISIT_COUNT] += existing[_VISIT_COUNT]
+                    entry[_VISITED_AT] = max(entry[_VISITED_AT], existing[_VISITED_AT])
+                entries[doc["url"]] = entry
+            await store.save_archive_bucket(make_bucket(user_id, month, list(entries.values())))
+
+        await store.delete_history(user_id, ids=[doc["_id"] for doc in docs])
+
+    async def _trim_archive(self, user_id: str, before: Optional[datetime] = None, drop: int = 0) -> int:
+        """Remove archived entries older than before, and then the oldest drop more"""
+        store = get_storage()
+        removed = 0
+        cutoff = before.isoformat() if before else None
+        for bucket in await store.list_archive_buckets(user_id):
+            if not cutoff and drop <= 0:
+                break
+            if cutoff and bucket["month"] > month_key(before) and drop <= 0:
+                break
+            entries = sorted(unpack(bucket["packed"]), key=lambda entry: entry[_VISITED_AT])
+            kept = [entry for entry in entries if not cutoff or entry[_VISITED_AT] >= cutoff]
+            if drop > 0:
+                dropped = kept[:drop]
+                kept = kept[drop:]
+                drop -= len(dropped)
+            removed += len(entries) - len(kept)
+            if not kept:
+                await store.delete_archive_buckets(user_id, [bucket["month"]])
+            elif len(kept) < len(entries):
+                await store.save_archive_bucket(make_bucket(user_id, bucket["month"], kept))
+        return removed
+
+    async def _enforce_max_entries(self, user_id: str, max_entries: int) -> int:
+        store = get_storage()
+        hot = await store.count_history(user_id)
+        archived = sum(bucket["count"] for bucket in await store.list_archive_buckets(user_id))
+        excess = hot + archived - max_entries
+        if excess <= 0:
+            return 0
+        removed = await self._trim_archive(user_id, drop=min(excess, archived))
+        if excess > removed:
+            oldest = await store.oldest_history(user_id, excess - removed)
+            removed += await store.delete_history(user_id, ids=[doc["_id"] for doc in oldest])
+        return removed
+
+    async def search(self, user_id: str, terms: List[str], limit: int) -> List[dict]:
+        """Archived entries matching every term, as history-shaped documents"""
+        buckets = await get_storage().search_candidates("history_archive", user_id, terms, ARCHIVE_SEARCH_BUCKETS)
+        matches = []
+        for bucket in buckets:
+            for entry in unpack(bucket["packed"]):
+                entry_terms = search_index.search_terms_for(entry[_URL], entry[_TITLE])
+                if all(any(token.startswith(term) for token in entry_terms) for term in terms):
+                    doc = entry_document(user_id, entry)
+                    doc["search_terms"] = entry_terms
+                    matches.append(doc)
+                    if len(matches) >= limit:
+                        return matches
+        return matches
+
+
+# Global instance
+history_compactor = HistoryCompactor()
@@ -0,0 +1,322 @@
+"""Shared HTTP cache (RFC 9111) for proxied responses: memory LRU spilling to disk"""
+import os
+import time
+import asyncio
+import hashlib
+from collections import OrderedDict
+from email.utils import parsedate_to_datetime
+from typing import Dict, Optional
+import orjson
+import logging
+
+logger = logging.getLogger(__name__)
+
+PROXY_CACHE_MEMORY_BYTES = int(os.getenv("PROXY_CACHE_MEMORY_BYTES", 64 * 1024 * 1024))
+PROXY_CACHE_DISK_BYTES = int(os.getenv("PROXY_CACHE_DISK_BYTES", 512 * 1024 * 1024))
+PROXY_CACHE_DIR = os.getenv("PROXY_CACHE_DIR", ".proxy_cache")
+# Bodies larger than this are relayed but never stored
+PROXY_CACHE_MAX_ENTRY_BYTES = int(os.getenv("PROXY_CACHE_MAX_ENTRY_BYTES", 4 * 1024 * 1024))
+# Cap on heuristic freshness for responses with Last-Modified but no explicit lifetime
+HEURISTIC_MAX_SECONDS = 86400
+
+# Statuses that may be cached without explicit freshness (RFC 9110 15.1); 206 is left out
+HEURISTIC_STATUSES = {200, 203, 204, 300, 301, 308, 404, 405, 410, 414, 501}
+# Never stored or replayed
+HOP_BY_HOP = {
+    "connection", "keep-alive", "proxy-authenticate", "proxy-authorization", "te", "trailer",
+    "transfer-encoding", "upgrade", "set-cookie"
+}
+
+
+def parse_cache_control(value: Optional[str]) -> Dict[str, Optional[str]]:
+    """Cache-Control directives, lowercase, with their (unquoted) arguments"""
+    directives = {}
+    for part in (value or "").split(","):
+        name, _, argument = part.strip().partition("=")
+        if name:
+            directives[name.lower()] = argument.strip('"') if argument else None
+    return directives
+
+
+def _seconds(value: Optional[str]) -> Optional[int]:
+    try:
+        return max(int(value), 0)
+    except (TypeError, ValueError):
+        return None
+
+
+def _http_date(value: Optional[str]) -> Optional[float]:
+    if not value:
+        return None
+    try:
+        return parsedate_to_datetime(value).timestamp()
+    except (TypeError, ValueError, IndexError):
+        return None
+
+
+def cache_key(url: str, accept_encoding: str) -> str:
+    """Primary key: bodies are stored still encoded, so the encoding a client accepts matters"""
+    encodings = ",".join(sorted(part.strip().lower() for part in accept_encoding.split(",") if part.strip()))
+    return f"{url}\n{encodings}"
+
+
+def is_storable(status: int, request_headers, response_headers) -> bool:
+    # Only complete responses; a 304 or 206 answers one client's conditional or range request
+    if status < 200 or status in (206, 304):
+        return False
+    request_cc = parse_cache_control(request_headers.get("cache-control"))
+    response_cc = parse_cache_control(response_headers.get("cache-control"))
+    if "no-store" in request_cc or "no-store" in response_cc or "private" in response_cc:
+        return False
+    if response_headers.get("vary", "").strip() == "*":
+        return False
+    if status in HEURISTIC_STATUSES:
+        return True
+    return status < 500 and (
+        "public" in response_cc or "max-age" in response_cc or "s-maxage" in response_cc
+        or "expires" in response_headers
+    )
+
+
+class CacheEntry:
+    """A stored response and the timing needed to compute its age"""
+
+    def __init__(self, key: str, status: int, headers: Dict[str, str], body: bytes,
+                 vary: Dict[str, str], request_time: float, response_time: float):
+        self.key = key
+        self.status = status
+        self.headers = {name: value for name, value in headers.items() if name not in HOP_BY_HOP}
+        self.body = body
+        # Request header values this response was selected by (its Vary)
+        self.vary = vary
+        self.request_time = request_time
+        self.response_time = response_time
+        self.cache_control = parse_cache_control(self.headers.get("cache-control"))
+
+    @property
+    def size(self) -> int:
+        return len(self.body) + 512
+
+    def matches(self, request_headers) -> bool:
+        return all(request_headers.get(name, "") == value for name, value in self.vary.items())
+
+    def freshness_lifetime(self) -> float:
+        cc = self.cache_control
+        for directive in ("s-maxage", "max-age"):
+            seconds = _seconds(cc.get(directive))
+            if seconds is not None:
+                return seconds
+        date = _http_date(self.headers.get("date")) or self.response_time
+        if "expires" in self.headers:
+            expires = _http_date(self.headers["expires"])
+            return max(expires - date, 0) if expires else 0
+        last_modified = _http_date(self.headers.get("last-modified"))
+        if last_modified and self.status in HEURISTIC_STATUSES:
+            return min(max(date - last_modified, 0) * 0.1, HEURISTIC_MAX_SECONDS)
+        return 0
+
+    def age(self, now: Optional[float] = None) -> float:
+        now = now or time.time()
+        date = _http_date(self.headers.get("date")) or self.response_time
+        apparent_age = max(0, self.response_time - date)
+        corrected_age = (_seconds(self.headers.get("age")) or 0) + (self.response_time - self.request_time)
+        return max(apparent_age, corrected_age) + (now - self.response_time)
+
+    def staleness(self, now: Optional[float] = None) -> float:
+        """Seconds past freshness (negative while fresh)"""
+        return self.age(now) - self.freshness_lifetime()
+
+    def needs_revalidation(self) -> bool:
+        """no-cache responses may be stored but never reused unvalidated"""
+        return "no-cache" in self.cache_control
+
+    def may_serve_stale(self) -> bool:
+        return not ({"must-revalidate", "proxy-revalidate", "no-cache"} & self.cache_control.keys())
+
+    def stale_while_revalidate(self) -> int:
+        return _seconds(self.cache_control.get("stale-while-revalidate")) or 0
+
+    def stale_if_error(self) -> int:
+        return _seconds(self.cache_control.get("stale-if-error")) or 0
+
+    def validators(self) -> Dict[str, str]:
+        """Conditional request headers for revalidating this entry"""
+        conditions = {}
+        if "etag" in self.headers:
+            conditions["if-none-match"] = self.headers["etag"]
+        if "last-modified" in self.headers:
+            conditions["if-modified-since"] = self.headers["last-modified"]
+        return conditions
+
+    def refresh(self, not_modified_headers, request_time: float, response_time: float):
+        """Apply a 304's headers (RFC 9111 4.3.4)"""
+        for name, value in not_modified_headers.items():
+            name = name.lower()
+            if name not in HOP_BY_HOP and name not in ("content-length", "content-encoding"):
+                self.headers[name] = value
+        self.request_time = request_time
+        self.response_time = response_time
+        self.cache_control = parse_cache_control(self.headers.get("cache-control"))
+
+    def to_bytes(self) -> bytes:
+        meta = {
+            "key": self.key, "status": self.status, "headers": self.headers, "vary": self.vary,
+            "request_time": self.request_time, "response_time": self.response_time
+        }
+        return orjson.dumps(meta) + b"\n" + self.body
+
+    @classmethod
+    def from_bytes(cls, data: bytes) -> "CacheEntry":
+        meta, _, body = data.partition(b"\n")
+        meta = orjson.loads(meta)
+        return cls(meta["key"], meta["status"], meta["headers"], body, meta["vary"],
+                   meta["request_time"], meta["response_time"])
+
+
+def vary_values(response_headers, request_headers) -> Dict[str, str]:
+    names = [name.strip().lower() for name in response_headers.get("vary", "").split(",") if name.strip()]
+    # Accept-Encoding is already part of the primary key
+    return {name: request_headers.get(name, "") for name in names if name != "accept-encoding"}
+
+
+class HTTPCache:
+    """Byte-bounded memory LRU whose evictions spill to a byte-bounded disk LRU"""
+
+    def __init__(self, directory: str = PROXY_CACHE_DIR, memory_bytes: int = PROXY_CACHE_MEMORY_BYTES,
+                 disk_bytes: int = PROXY_CACHE_DISK_BYTES):
+        self.directory = directory
+        self.memory_bytes = memory_bytes
+        self.disk_bytes = disk_bytes
+        self.memory: "OrderedDict[str, CacheEntry]" = OrderedDict()
+        self.memory_used = 0
+        self.disk: "OrderedDict[str, int]" = OrderedDict()
+        self.disk_used = 0
+        self.disk_loaded = False
+        # Keys with a background revalidation in flight
+        self.revalidating = set()
+        self.counts = {"hit": 0, "stale": 0, "revalidated": 0, "miss": 0, "bypass": 0, "disk_hit": 0}
+
+    def _path(self, key: str) -> str:
+        return os.path.join(self.directory, hashlib.sha256(key.encode()).hexdigest())
+
+    def _load_disk_index(self):
+        """Rebuild the disk LRU from files left by a previous run, oldest first"""
+        os.makedirs(self.directory, exist_ok=True)
+        files = []
+        for name in os.listdir(self.directory):
+            stat = os.stat(os.path.join(self.directory, name))
+            files.append((stat.st_mtime, name, stat.st_size))
+        for _, name, size in sorted(files):
+            self.disk[name] = size
+            self.disk_used += size
+
+    async def _ensure_disk(self):
+        if not self.disk_loaded:
+            self.disk_loaded = True
+            await asyncio.to_thread(self._load_disk_index)
+
+    async def get(self, key: str) -> Optional[CacheEntry]:
+        entry = self.memory.get(key)
+        if entry is not None:
+            self.memory.move_to_end(key)
+            return entry
+        await self._ensure_disk()
+        name = os.path.basename(self._path(key))
+        if name not in self.disk:
+            return None
+        try:
+            data = await asyncio.to_thread(self._read, self._path(key))
+        except OSError:
+            self._forget_disk(name)
+            return None
+        entry = CacheEntry.from_bytes(data)
+        self.counts["disk_hit"] += 1
+        # Promote; the disk copy goes away so each entry lives in one tier
+        self._forget_disk(name)
+        await asyncio.to_thread(self._remove, self._path(key))
+        await self.put(entry)
+        return entry
+
+    async def put(self, entry: CacheEntry):
+        if entry.size > self.memory_bytes:
+            return
+        old = self.memory.pop(entry.key, None)
+        if old is not None:
+            self.memory_used -= old.size
+        self.memory[entry.key] = entry
+        self.memory_used += entry.size
+        while self.memory_used > self.memory_bytes:
+            _, evicted = self.memory.popitem(last=False)
+            self.memory_used -= evicted.size
+            await self._spill(evicted)
+
+    async def delete(self, key: str):
+        entry = self.memory.pop(key, None)
+        if entry is not None:
+            self.memory_used -= entry.size
+        name = os.path.basename(self._path(key))
+        if name in self.disk:
+            self._forget_disk(name)
+            await asyncio.to_thread(self._remove, self._path(key))
+
+    async def _spill(self, entry: CacheEntry):
+        if self.disk_bytes <= 0:
+            return
+        await self._ensure_disk()
+        data = entry.to_bytes()
+        name = os.path.basename(self._path(entry.key))
+        try:
+            await asyncio.to_thread(self._write, self._path(entry.key), data)
+        except OSError as e:
+            logger.warning(f"Proxy cache spill failed: {e}")
+            return
+        self._forget_disk(name)
+        self.disk[name] = len(data)
+        self.disk_used += len(data)
+        while self.disk_used > self.disk_bytes and self.disk:
+            oldest, size = self.disk.popitem(last=False)
+            self.disk_used -= size
+            await asyncio.to_thread(self._remove, os.path.join(self.directory, oldest))
+
+    def _forget_disk(self, name: str):
+        size = self.disk.pop(name, None)
+        if size is not None:
+            self.disk_used -= size
+
+    @staticmethod
+    def _read(path: str) -> bytes:
+        with open(path, "rb") as f:
+            return f.read()
+
+    @staticmethod
+    def _write(path: str, data: bytes):
+        tmp = f"{path}.tmp"
+        with open(tmp, "wb") as f:
+            f.write(data)
+        os.replace(tmp, path)
+
+    @staticmethod
+    def _remove(path: str):
+        try:
+            os.remove(path)
+        except FileNotFoundError:
+            pass
+
+    def record(self, status: str):
+        self.counts[status] = self.counts.get(status, 0) + 1
+
+    def stats(self) -> dict:
+        lookups = sum(self.counts[name] for name in ("hit", "stale", "revalidated", "miss"))
+        served = self.counts["hit"] + self.counts["stale"] + self.counts["revalidated"]
+        return {
+            **self.counts,
+            "hit_ratio": round(served / lookups, 4) if lookups else 0.0,
+            "memory_entries": len(self.memory),
+            "memory_bytes": self.memory_used,
+            "disk_entries": len(self.disk),
+            "disk_bytes": self.disk_used
+        }
+
+
+# Global instance
+http_cache = HTTPCache()
@@ -0,0 +1,83 @@
+"""Shared outbound HTTP client with pooled keep-alive connections"""
+import os
+import asyncio
+from collections import OrderedDict
+from contextlib import asynccontextmanager
+from typing import Optional
+from urllib.parse import urlparse
+import httpx
+import logging
+
+logger = logging.getLogger(__name__)
+
+HTTP_MAX_CONNECTIONS = int(os.getenv("HTTP_MAX_CONNECTIONS", 100))
+HTTP_MAX_KEEPALIVE = int(os.getenv("HTTP_MAX_KEEPALIVE", 20))
+# Concurrent requests to any one host, so a slow site can't take the whole pool
+HTTP_MAX_PER_HOST = int(os.getenv("HTTP_MAX_PER_HOST", 8))
+HTTP_CONNECT_TIMEOUT = float(os.getenv("HTTP_CONNECT_TIMEOUT", 5))
+HTTP_READ_TIMEOUT = float(os.getenv("HTTP_READ_TIMEOUT", 10))
+
+USER_AGENT = "Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36"
+
+_client: Optional[httpx.AsyncClient] = None
+
+
+def get_http_client() -> httpx.AsyncClient:
+    """The process-wide client (created on first use)"""
+    global _client
+    if _client is None or _client.is_closed:
+        _client = httpx.AsyncClient(
+            limits=httpx.Limits(
+                max_connections=HTTP_MAX_CONNECTIONS,
+                max_keepalive_connections=HTTP_MAX_KEEPALIVE,
+                keepalive_expiry=30
+            ),
+            timeout=httpx.Timeout(HTTP_READ_TIMEOUT, connect=HTTP_CONNECT_TIMEOUT),
+            headers={"User-Agent": USER_AGENT},
+            follow_redirects=True
+        )
+    return _client
+
+
+async def close_http_client():
+    global _client
+    if _client is not None:
+        await _client.aclose()
+        _client = None
+
+
+class HostLimiter:
+    """Per-host semaphores, dropped once idle so the table stays small"""
+
+    def __init__(self, per_host: int = HTTP_MAX_PER_HOST, max_hosts: int = 1024):
+        self.per_host = per_host
+        self.max_hosts = max_hosts
+        self.semaphores: "OrderedDict[str, asyncio.Semaphore]" = OrderedDict()
+
+    def _semaphore(self, host: str) -> asyncio.Semaphore:
+        semaphore = self.semaphores.get(host)
+        if semaphore is None:
+            semaphore = self.semaphores[host] = asyncio.Semaphore(self.per_host)
+            # Forget idle hosts first; a semaphore still in use is never dropped
+            for idle in [name for name, sem in self.semaphores.items()
+                         if sem._value == self.per_host and name != host][:max(len(self.semaphores) - self.max_hosts, 0)]:
+                del self.semaphores[idle]
+        self.semaphores.move_to_end(host)
+        return semaphore
+
+    async def acquire(self, url: str) -> asyncio.Semaphore:
+        semaphore = self._semaphore((urlparse(url).hostname or "").lower())
+        await semaphore.acquire()
+        return semaphore
+
+    @asynccontextmanager
+    async def slot(self, url: str):
+        semaphore = await self.acquire(url)
+        try:
+            yield
+        finally:
+            semaphore.release()
+
+
+# Global instance
+host_limiter = HostLimiter()
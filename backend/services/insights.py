@@ -0,0 +1,130 @@
+"""Per-user daily browsing rollups, maintained incrementally"""
+import os
+import asyncio
+from collections import Counter, defaultdict
+from datetime import datetime, timedelta
+from typing import Dict, List, Tuple
+from urllib.parse import unquote, urlparse
+from database.storage import get_storage
+import logging
+
+logger = logging.getLogger(__name__)
+
+# Seconds between flushes of buffered counters
+INSIGHTS_FLUSH_INTERVAL = float(os.getenv("INSIGHTS_FLUSH_INTERVAL", 5))
+TOP_N = 10
+
+
+def day_key(moment: datetime) -> str:
+    """UTC calendar day a rollup document covers"""
+    return moment.strftime("%Y-%m-%d")
+
+
+def encode_key(key: str) -> str:
+    """Field-name-safe form of a domain or URL ('.' and '$' are paths/operators in Mongo)"""
+    return key.replace("%", "%25").replace(".", "%2E").replace("$", "%24")
+
+
+def decode_key(key: str) -> str:
+    return unquote(key)
+
+
+def visit_increments(url: str, visited_at: datetime, visits: int = 1) -> Dict[str, int]:
+    """Counter paths one history write adds to its day's rollup"""
+    host = (urlparse(url if "//" in url else f"//{url}").hostname or "").lower()
+    if host.startswith("www."):
+        host = host[4:]
+    increments = {"visits": visits, f"hours.{visited_at.hour}": visits}
+    page = url.split('#', 1)[0]
+    # An empty key would be an empty field name, which Mongo rejects
+    if page:
+        increments[f"pages.{encode_key(page)}"] = visits
+    if host:
+        increments[f"domains.{encode_key(host)}"] = visits
+    return increments
+
+
+def _top(counts: Dict[str, int], key_name: str) -> List[dict]:
+    ranked = sorted(counts.items(), key=lambda item: item[1], reverse=True)[:TOP_N]
+    return [{key_name: decode_key(key), "visits": count} for key, count in ranked]
+
+
+def summarize(rollups: List[dict], start: datetime, days: int) -> dict:
+    """Merge daily rollup documents into one insights report"""
+    domains, pages, focus = Counter(), Counter(), Counter()
+    hours = [0] * 24
+    per_day = {day_key(start + timedelta(days=offset)): 0 for offset in range(days)}
+    for rollup in rollups:
+        per_day[rollup["day"]] = rollup.get("visits", 0)
+        domains.update(rollup.get("domains", {}))
+        pages.update(rollup.get("pages", {}))
+        focus.update(rollup.get("focus", {}))
+        for hour, count in rollup.get("hours", {}).items():
+            hours[int(hour)] += count
+    return {
+        "total_visits": sum(per_day.values()),
+        "visits_per_day": [{"day": day, "visits": count} for day, count in sorted(per_day.items())],
+        "hours_utc": hours,
+        "top_domains": _top(domains, "domain"),
+        "top_pages": _top(pages, "url"),
+        "focus": {key: focus.get(key, 0) for key in ("checked", "allowed", "blocked")}
+    }
+
+
+class InsightsAggregator:
+    """Buffers rollup increments in memory and flushes them in batches
+
+    Each flush is one bulk upsert of $inc updates, so recording a visit
+    adds no database round trip to the request that made it. Counters
+    buffered when the process dies are lost; the raw history is not.
+    """
+
+    def __init__(self):
+        self.pending: Dict[Tuple[str, str], Counter] = defaultdict(Counter)
+        self.lock = asyncio.Lock()
+
+    def record_visit(self, user_id: str, url: str, visited_at: datetime, visits: int = 1):
+        self.pending[(user_id, day_key(visited_at))].update(visit_increments(url, visited_at, visits))
+
+    def record_focus_check(self, user_id: str, allowed: bool, checked_at: datetime = None):
+        counter = self.pending[(user_id, day_key(checked_at or datetime.utcnow()))]
+        counter["focus.checked"] += 1
+        counter["focus.allowed" if allowed else "focus.blocked"] += 1
+
+    def discard(self, user_id: str):
+        """Drop a user's buffered counters (their history was cleared)"""
+        for key in [key for key in self.pending if key[0] == user_id]:
+            del self.pending[key]
+
+    async def flush(self):
+        async with self.lock:
+            if not self.pending:
+                return
+            batch, self.pending = self.pending, defaultdict(Counter)
+            try:
+                retry = await get_storage().increment_rollups({key: dict(counter) for key, counter in batch.items()})
+            except Exception as e:
+                logger.error(f"Insights flush failed, retrying next interval: {e}")
+                retry = batch
+            for key, counter in retry.items():
+                self.pending[key].update(counter)
+
+    async def run(self):
+        """Flush periodically until cancelled, then flush what's left"""
+        try:
+            while True:
+                await asyncio.sleep(INSIGHTS_FLUSH_INTERVAL)
+                await self.flush()
+        finally:
+            await self.flush()
+
+    async def get_insights(self, user_id: str, days: int = 7) -> dict:
+        """Insights over the last days UTC days, including today"""
+        await self.flush()
+        start = datetime.utcnow() - timedelta(days=days - 1)
+        rollups = await get_storage().list_rollups(user_id, day_key(start))
+        return summarize(rollups, start, days)
+
+
+# Global instance
+insights = InsightsAggregator()
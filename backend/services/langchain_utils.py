@@ -4,6 +4,9 @@ from langchain_core.prompts import ChatPromptTemplate
 from langchain_core.output_parsers import StrOutputParser
 from langchain_text_splitters import RecursiveCharacterTextSplitter
 import logging
+from typing import AsyncIterator, List, Optional
+from services.model_router import model_router
+from services.page_context import CHUNK_SIZE, CHUNK_OVERLAP
 
 logger = logging.getLogger(__name__)
 
@@ -15,59 +18,77 @@ class LangChainService:
         if not api_key:
             raise ValueError("GROQ_API_KEY not found")
         
-        self.llm = ChatGroq(
-            api_key=api_key,
-            model=os.getenv("GROQ_MODEL", "mixtral-8x7b-32768"),
-            temperature=0.7
-        )
+        self.api_key = api_key
+        self.default_model = os.getenv("GROQ_MODEL", "mixtral-8x7b-32768")
+        self.llms = {}
+        self.llm = self.get_llm(self.default_model)
         
         self.output_parser = StrOutputParser()
         
         self.text_splitter = RecursiveCharacterTextSplitter(
-            chunk_size=4000,
-            chunk_overlap=200
+            chunk_size=CHUNK_SIZE,
+            chunk_overlap=CHUNK_OVERLAP
         )
     
-    async def summarize_content(self, content: str, url: str = None) -> str:
-        """Summarize webpage or document content"""
+    def get_llm(self, model: str) -> ChatGroq:
+        """Get (or lazily create) the chat model client for a model name"""
+        if model not in self.llms:
+            self.llms[model] = ChatGroq(
+                api_key=self.api_key,
+                model=model,
+                temperature=0.7
+            )
+        return self.llms[model]
+    
+    def route_llm(self, endpoint: str, query: str, context: str = "") -> ChatGroq:
+        """Chat model picked by the model router for this request"""
+        model = model_router.choose(endpoint, query, context, default=self.default_model)
+        return self.get_llm(model)
+    
+    async def summarize_content(self, content: str, url: str = None, chunks: Optional[List[str]] = None) -> str:
+        """Summarize webpage or document content (chunks: content already split)"""
         try:
             # Split content if too long
-            chunks = self.text_splitter.split_text(content)
+            if chunks is None:
+                chunks = self.text_splitter.split_text(content)
+            llm = self.route_llm("summarize", "", content)
             
             if len(chunks) > 1:
                 # Summarize each chunk then combine
                 summaries = []
                 for chunk in chunks[:3]:  # Limit to first 3 chunks
-                    summary = await self._summarize_chunk(chunk)
+                    summary = await self._summarize_chunk(chunk, llm)
                     summaries.append(summary)
                 
                 # Combine summaries
                 combined = "\n\n".join(summaries)
-                final_summary = await self._summarize_chunk(combined)
+                final_summary = await self._summarize_chunk(combined, llm)
                 return final_summary
             else:
-                return await self._summarize_chunk(content)
+                return await self._summarize_chunk(content, llm)
                 
         except Exception as e:
             logger.error(f"Summarization error: {e}")
             return "I encountered an error while summarizing the content."
     
-    async def _summarize_chunk(self, text: str) -> str:
+    async def _summarize_chunk(self, text: str, llm: ChatGroq = None) -> str:
         """Summarize a single chunk of text"""
         prompt = ChatPromptTemplate.from_messages([
             ("system", "You are a helpful assistant that provides clear and concise summaries."),
             ("user", "Provide a clear and concise summary of the following content:\n\n{text}\n\nSummary:")
         ])
         
-        chain = prompt | self.llm | self.output_parser
+        chain = prompt | (llm or self.llm) | self.output_parser
         result = await chain.ainvoke({"text": text})
         return result.strip()
     
-    async def answer_question(self, question: str, context: str, url: str = None) -> str:
-        """Answer question based on context"""
+    async def answer_question(self, question: str, context: str, url: str = None,
+                              chunks: Optional[List[str]] = None) -> str:
+        """Answer question based on context (chunks: the passages to use, already split)"""
         try:
             # Split context if too long
-            chunks = self.text_splitter.split_text(context)
+            if chunks is None:
+                chunks = self.text_splitter.split_text(context)
             
             # Use first few chunks as context
             relevant_context = "\n\n".join(chunks[:3])
@@ -77,7 +98,8 @@ class LangChainService:
                 ("user", "Based on the following context, answer the question accurately and concisely.\n\nContext:\n{context}\n\nQuestion: {question}\n\nAnswer:")
             ])
             
-            chain = prompt | self.llm | self.output_parser
+            llm = self.route_llm("question", question, relevant_context)
+            chain = prompt | llm | self.output_parser
             result = await chain.ainvoke({"context": relevant_context, "question": question})
             return result.strip()
             
@@ -85,29 +107,38 @@ class LangChainService:
             logger.error(f"Question answering error: {e}")
             return "I encountered an error while processing your question."
     
+    def _chat_chain(self, query: str, context: str = None):
+        """Prompt, model and parser for a chat turn, with its inputs"""
+        llm = self.route_llm("chat", query, context or "")
+        if context:
+            prompt = ChatPromptTemplate.from_messages([
+                ("system", "You are AiChat, a helpful AI assistant integrated into a browser."),
+                ("user", "Context from current page:\n{context}\n\nUser: {query}\n\nAssistant:")
+            ])
+            return prompt | llm | self.output_parser, {"context": context, "query": query}
+        prompt = ChatPromptTemplate.from_messages([
+            ("system", "You are AiChat, a helpful AI assistant integrated into a browser."),
+            ("user", "{query}")
+        ])
+        return prompt | llm | self.output_parser, {"query": query}
+    
     async def general_chat(self, query: str, context: str = None) -> str:
         """General chat with optional context"""
         try:
-            if context:
-                prompt = ChatPromptTemplate.from_messages([
-                    ("system", "You are AiChat, a helpful AI assistant integrated into a browser."),
-                    ("user", "Context from current page:\n{context}\n\nUser: {query}\n\nAssistant:")
-                ])
-                chain = prompt | self.llm | self.output_parser
-                result = await chain.ainvoke({"context": context, "query": query})
-            else:
-                prompt = ChatPromptTemplate.from_messages([
-                    ("system", "You are AiChat, a helpful AI assistant integrated into a browser."),
-                    ("user", "{query}")
-                ])
-                chain = prompt | self.llm | self.output_parser
-                result = await chain.ainvoke({"query": query})
-            
+            chain, inputs = self._chat_chain(query, context)
+            result = await chain.ainvoke(inputs)
             return result.strip()
             
         except Exception as e:
             logger.error(f"General chat error: {e}")
             return "I encountered an error while chatting."
+    
+    async def stream_chat(self, query: str, context: str = None) -> AsyncIterator[str]:
+        """General chat, yielding the reply as the model produces it"""
+        chain, inputs = self._chat_chain(query, context)
+        async for piece in chain.astream(inputs):
+            if piece:
+                yield piece
 
 # Global instance
 langchain_service = LangChainService()
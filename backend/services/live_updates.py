@@ -0,0 +1,216 @@
+"""Per-user pub/sub of settings and focus-session changes for connected clients"""
+import os
+import time
+import asyncio
+from typing import Dict, List, Optional, Set
+import logging
+
+logger = logging.getLogger(__name__)
+
+# A client whose pending change has waited this long is dropped and told to resync
+LIVE_UPDATES_STALL = float(os.getenv("LIVE_UPDATES_STALL", 60))
+
+# Settings fields that aren't user preferences
+_SETTINGS_INTERNAL = {"_id", "id", "user_id", "updated_at"}
+_FOCUS_FIELDS = ("topic", "description", "keywords", "allowed_domains", "created_at",
+                 "urls_checked", "urls_allowed", "urls_blocked")
+
+_MISSING = object()
+
+
+def settings_state(settings: dict) -> dict:
+    """The fields of a settings document (or update) clients mirror"""
+    return {name: value for name, value in settings.items() if name not in _SETTINGS_INTERNAL}
+
+
+def focus_state(session: Optional[dict]) -> Optional[dict]:
+    """The fields of an active focus session clients mirror, or None without one"""
+    if session is None:
+        return None
+    return {"id": str(session["_id"]), **{name: session.get(name) for name in _FOCUS_FIELDS}}
+
+
+class Subscription:
+    """One client's view of a topic: at most one pending event, later ones merged into it"""
+
+    def __init__(self, user_id: str, topic: str):
+        self.user_id = user_id
+        self.topic = topic
+        self.pending: Optional[dict] = None
+        self.waiting_since = 0.0
+        self.ready = asyncio.Event()
+
+    def offer(self, event: dict):
+        pending = self.pending
+        if pending is None:
+            self.pending = dict(event)
+            self.waiting_since = time.monotonic()
+        elif event["op"] == "update" and pending["op"] == "update":
+            pending["fields"] = {**pending["fields"], **event["fields"]}
+            pending["version"] = event["version"]
+        elif event["op"] == "update" and pending["op"] == "replace":
+            pending["state"] = {**pending["state"], **event["fields"]}
+            pending["version"] = event["version"]
+        else:
+            self.pending = dict(event)
+        self.ready.set()
+
+    def stalled(self, now: float) -> bool:
+        return self.pending is not None and now - self.waiting_since > LIVE_UPDATES_STALL
+
+    async def next_event(self) -> dict:
+        await self.ready.wait()
+        self.ready.clear()
+        event, self.pending = self.pending, None
+        return event
+
+
+class _Feed:
+    """A user's topic: its subscribers and the state they were last sent"""
+    __slots__ = ("subscribers", "state", "version", "held")
+
+    def __init__(self):
+        self.subscribers: Set[Subscription] = set()
+        self.state = _MISSING
+        self.version = 0
+        # Changes published while the first subscriber loads the state, merged into one event
+        self.held: Optional[dict] = None
+
+    def hold(self, event: dict):
+        held = self.held
+        if held is None or event["op"] == "replace":
+            self.held = dict(event)
+        elif held["op"] == "update":
+            held["fields"] = {**held["fields"], **event["fields"]}
+        elif held["state"] is not None:
+            held["state"] = {**held["state"], **event["fields"]}
+
+
+class LiveUpdates:
+    """Fans change events out to the subscribed clients of a user
+
+    Write paths publish the new state of a topic; the hub diffs it against
+    what subscribers were last sent and offers only the changed fields, so
+    repeats (such as a change stream echoing this process's own write) cost
+    nothing. Topics are tracked only while a user has subscribers.
+
+    Publishing never waits on a client: each subscription holds one merged
+    pending event, and one that stays unread for LIVE_UPDATES_STALL is
+    dropped with a "resync" event so it stops costing merges. State is per
+    process; other workers' writes arrive through the change stream, which
+    needs a MongoDB replica set.
+    """
+
+    def __init__(self):
+        # user_id -> topic -> feed
+        self.users: Dict[str, Dict[str, _Feed]] = {}
+        self.published = 0
+        self.suppressed = 0
+        self.evicted = 0
+
+    def subscribed(self, user_id: str, topic: str) -> bool:
+        return topic in self.users.get(user_id, ())
+
+    def subscribers_of(self, topic: str) -> List[str]:
+        """Users with clients subscribed to topic"""
+        return [user_id for user_id, feeds in self.users.items() if topic in feeds]
+
+    def subscribe(self, user_id: str, topic: str) -> Subscription:
+        subscription = Subscription(user_id, topic)
+        self.users.setdefault(user_id, {}).setdefault(topic, _Feed()).subscribers.add(subscription)
+        return subscription
+
+    def unsubscribe(self, subscription: Subscription):
+        feeds = self.users.get(subscription.user_id)
+        feed = feeds.get(subscription.topic) if feeds else None
+        if feed is None:
+            return
+        feed.subscribers.discard(subscription)
+        if not feed.subscribers:
+            del feeds[subscription.topic]
+            if not feeds:
+                del self.users[subscription.user_id]
+
+    def snapshot(self, subscription: Subscription, loaded: Optional[dict]) -> dict:
+        """The event that starts a subscription; loaded seeds the topic unless another client already did
+
+        loaded may predate changes published while it was read, so those are
+        applied on top of it.
+        """
+        feed = self.users[subscription.user_id][subscription.topic]
+        if feed.state is _MISSING:
+            held, feed.held = feed.held, None
+            if held is None:
+                feed.state = loaded
+            elif held["op"] == "replace":
+                feed.state = held["state"]
+            else:
+                feed.state = None if loaded is None else {**loaded, **held["fields"]}
+        # Anything offered so far is part of the state sent now
+        subscription.pending = None
+        subscription.ready.clear()
+        return {"op": "snapshot", "version": feed.version, "state": feed.state}
+
+    def publish(self, user_id: str, topic: str, state: Optional[dict]):
+        """A topic's whole new state (None: it no longer exists, e.g. the focus session ended)"""
+        feed = self._feed(user_id, topic)
+        if feed is None:
+            return
+        if feed.state is _MISSING:
+            feed.hold({"op": "replace", "state": state})
+            return
+        old = feed.state
+        if old is None or state is None or old.get("id") != state.get("id"):
+            if old is None and state is None:
+                self.suppressed += 1
+                return
+            feed.state = state
+            self._deliver(feed, {"op": "replace", "state": state})
+        else:
+            self.update(user_id, topic, state)
+
+    def update(self, user_id: str, topic: str, fields: dict):
+        """Changed fields of a topic's current state"""
+        feed = self._feed(user_id, topic)
+        if feed is None or feed.state is None:
+            return
+        if feed.state is _MISSING:
+            feed.hold({"op": "update", "fields": fields})
+            return
+        changed = {name: value for name, value in fields.items() if feed.state.get(name, _MISSING) != value}
+        if not changed:
+            self.suppressed += 1
+            return
+        feed.state = {**feed.state, **changed}
+        self._deliver(feed, {"op": "update", "fields": changed})
+
+    def _feed(self, user_id: str, topic: str) -> Optional[_Feed]:
+        return self.users.get(user_id, {}).get(topic)
+
+    def _deliver(self, feed: _Feed, event: dict):
+        self.published += 1
+        feed.version += 1
+        event["version"] = feed.version
+        now = time.monotonic()
+        for subscription in list(feed.subscribers):
+            if subscription.stalled(now):
+                self.evicted += 1
+                logger.info(f"Dropping stalled {subscription.topic} subscriber of user {subscription.user_id}")
+                self.unsubscribe(subscription)
+                subscription.pending = {"op": "resync"}
+                subscription.ready.set()
+            else:
+                subscription.offer(event)
+
+    def stats(self) -> dict:
+        return {
+            "users": len(self.users),
+            "subscriptions": sum(len(feed.subscribers) for feeds in self.users.values() for feed in feeds.values()),
+            "published": self.published,
+            "suppressed": self.suppressed,
+            "evicted": self.evicted
+        }
+
+
+# Global instance
+live_updates = LiveUpdates()
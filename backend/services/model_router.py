@@ -0,0 +1,105 @@
+"""Route LLM requests to the small or large Groq model by complexity"""
+import os
+import re
+from collections import Counter
+from typing import Dict, Optional
+import logging
+
+logger = logging.getLogger(__name__)
+
+SMALL_MODEL = os.getenv("FOCUS_MODEL", "llama-3.1-8b-instant")
+LARGE_MODEL = os.getenv("GROQ_LARGE_MODEL", "llama-3.1-70b-versatile")
+
+# "on" routes requests, "shadow" keeps each endpoint's legacy model but logs
+# the router's choice, "off" disables routing entirely
+ROUTER_MODE = os.getenv("MODEL_ROUTER_MODE", "on").lower()
+
+# Scores at or above this go to the large model
+COMPLEXITY_THRESHOLD = float(os.getenv("MODEL_ROUTER_THRESHOLD", 0.5))
+
+_ANALYTICAL = re.compile(
+    r"\b(?:why|how does|how do|compare|contrast|analy[sz]e|evaluate|prove|derive|"
+    r"step by step|trade-?offs?|pros and cons|implications?|critique|design|debug|optimi[sz]e)\b",
+    re.IGNORECASE
+)
+_CODE = re.compile(r"```|\bdef |\bclass |\bfunction\b|[{};]\s*$|=>", re.MULTILINE)
+
+
+def parse_overrides(spec: str) -> Dict[str, str]:
+    """Parse "endpoint=small,other=large" (or a full model name) into a dict"""
+    overrides = {}
+    for item in spec.split(","):
+        if "=" not in item:
+            continue
+        endpoint, model = (part.strip() for part in item.split("=", 1))
+        overrides[endpoint] = {"small": SMALL_MODEL, "large": LARGE_MODEL}.get(model, model)
+    return overrides
+
+
+def complexity_score(query: str, context: str = "") -> float:
+    """Cheap local estimate of how hard a request is, from 0 to 1"""
+    score = 0.0
+    words = len(query.split())
+    if words > 40:
+        score += 0.3
+    elif words > 15:
+        score += 0.15
+    score += min(len(_ANALYTICAL.findall(query)), 2) * 0.2
+    if _CODE.search(query):
+        score += 0.3
+    if query.count("?") > 1:
+        score += 0.1
+    if len(context) > 12000:
+        score += 0.3
+    elif len(context) > 4000:
+        score += 0.15
+    return min(score, 1.0)
+
+
+class ModelRouter:
+    """Pick a model per request from query length, context size and endpoint"""
+
+    def __init__(self):
+        self.mode = ROUTER_MODE
+        self.threshold = COMPLEXITY_THRESHOLD
+        self.overrides = parse_overrides(os.getenv("MODEL_ROUTES", ""))
+        self.decisions = Counter()
+
+    def route(self, endpoint: str, query: str, context: str = "") -> str:
+        """Model the router would pick, ignoring the mode"""
+        if endpoint in self.overrides:
+            return self.overrides[endpoint]
+        score = complexity_score(query, context or "")
+        return LARGE_MODEL if score >= self.threshold else SMALL_MODEL
+
+    def choose(self, endpoint: str, query: str, context: str = "", default: Optional[str] = None) -> str:
+        """Model to use for this request; default is the endpoint's legacy model"""
+        default = default or LARGE_MODEL
+        if self.mode == "off":
+            return default
+
+        routed = self.route(endpoint, query, context)
+        self.decisions[(endpoint, routed)] += 1
+
+        if self.mode == "shadow":
+            if routed != default:
+                logger.info(f"Model router (shadow) {endpoint}: would use {routed} instead of {default}")
+            return default
+        return routed
+
+    def stats(self) -> dict:
+        return {
+            "mode": self.mode,
+            "threshold": self.threshold,
+            "small_model": SMALL_MODEL,
+            "large_model": LARGE_MODEL,
+            "overrides": self.overrides,
+            "decisions": [
+                {"endpoint": endpoint, "model": model, "count": count}
+                for (endpoint, model), count in self.decisions.items()
+            ]
+        }
+
+
+# Global instance
+model_router = ModelRouter()
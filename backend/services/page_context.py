@@ -0,0 +1,140 @@
+"""Content-addressed page text, chunked and indexed once for every AI request that refers to it"""
+import os
+import re
+import math
+import asyncio
+import hashlib
+from collections import Counter
+from datetime import datetime, timedelta
+from typing import Dict, List, Optional, Tuple
+from langchain_text_splitters import RecursiveCharacterTextSplitter
+from database.storage import get_storage
+from services.lru_cache import TTLCache
+from services.search_index import tokenize
+import logging
+
+logger = logging.getLogger(__name__)
+
+PAGE_CONTEXT_CACHE_SIZE = int(os.getenv("PAGE_CONTEXT_CACHE_SIZE", 128))
+PAGE_CONTEXT_CACHE_TTL = int(os.getenv("PAGE_CONTEXT_CACHE_TTL", 1800))
+# Stored contexts expire this long after they were last registered or loaded
+PAGE_CONTEXT_TTL = int(os.getenv("PAGE_CONTEXT_TTL", 86400))
+PAGE_CONTEXT_MAX_CHARS = int(os.getenv("PAGE_CONTEXT_MAX_CHARS", 500_000))
+
+# Chunking shared with the LangChain service, so inline and registered text split alike
+CHUNK_SIZE = 4000
+CHUNK_OVERLAP = 200
+
+_HANDLE = re.compile(r"^[0-9a-f]{64}$")
+
+
+def content_handle(text: str) -> str:
+    """SHA-256 of the UTF-8 text; clients can compute it to check before uploading"""
+    return hashlib.sha256(text.encode("utf-8")).hexdigest()
+
+
+class PageContext:
+    """Page text with its chunks and a term -> chunk numbers index"""
+
+    def __init__(self, handle: str, text: str, chunks: List[str], index: Dict[str, List[int]]):
+        self.handle = handle
+        self.text = text
+        self.chunks = chunks
+        self.index = index
+
+    @classmethod
+    def build(cls, text: str, handle: Optional[str] = None) -> "PageContext":
+        splitter = RecursiveCharacterTextSplitter(chunk_size=CHUNK_SIZE, chunk_overlap=CHUNK_OVERLAP)
+        chunks = splitter.split_text(text)
+        index: Dict[str, List[int]] = {}
+        for number, chunk in enumerate(chunks):
+            for term in set(tokenize(chunk)):
+                index.setdefault(term, []).append(number)
+        return cls(handle or content_handle(text), text, chunks, index)
+
+    def relevant_chunks(self, query: str, limit: int = 3) -> List[str]:
+        """The limit chunks sharing the rarest query terms, in page order (the first ones if none match)"""
+        hits = Counter()
+        for term in set(tokenize(query)):
+            postings = self.index.get(term, ())
+            # Terms found in every chunk say nothing about which one to pick
+            weight = math.log(1 + len(self.chunks) / len(postings)) if postings else 0
+            for number in postings:
+                hits[number] += weight
+        if not hits:
+            return self.chunks[:limit]
+        best = sorted(hits, key=lambda number: (-hits[number], number))[:limit]
+        return [self.chunks[number] for number in sorted(best)]
+
+    def summary(self) -> dict:
+        return {"handle": self.handle, "chars": len(self.text), "chunks": len(self.chunks)}
+
+    def to_document(self, expires_at: datetime) -> dict:
+        return {
+            "_id": self.handle,
+            "text": self.text,
+            "chunks": self.chunks,
+            "index": self.index,
+            "created_at": datetime.utcnow(),
+            "expires_at": expires_at
+        }
+
+    @classmethod
+    def from_document(cls, doc: dict) -> "PageContext":
+        return cls(doc["_id"], doc["text"], doc["chunks"], doc["index"])
+
+
+class PageContextStore:
+    """Registered page contexts: a memory LRU in front of storage with a TTL
+
+    Contexts are keyed by content hash, so the same page registered by
+    several users (or tabs) is chunked and stored once.
+    """
+
+    def __init__(self):
+        self.memory = TTLCache(maxsize=PAGE_CONTEXT_CACHE_SIZE, ttl=PAGE_CONTEXT_CACHE_TTL)
+        self.registered = 0
+        self.deduplicated = 0
+
+    async def build(self, text: str) -> PageContext:
+        """Chunk and index text without storing it (inline request content)"""
+        return await asyncio.to_thread(PageContext.build, text)
+
+    async def register(self, text: str) -> Tuple[PageContext, bool]:
+        """The context for text and whether it was newly stored"""
+        handle = content_handle(text)
+        context = await self.get(handle)
+        if context is not None:
+            self.deduplicated += 1
+            return context, False
+        context = await asyncio.to_thread(PageContext.build, text, handle)
+        expires_at = datetime.utcnow() + timedelta(seconds=PAGE_CONTEXT_TTL)
+        await get_storage().save_page_context(context.to_document(expires_at))
+        self.memory.set(handle, context)
+        self.registered += 1
+        return context, True
+
+    async def get(self, handle: str) -> Optional[PageContext]:
+        if not _HANDLE.match(handle):
+            return None
+        context = self.memory.get(handle)
+        if context is not None:
+            return context
+        store = get_storage()
+        doc = await store.find_page_context(handle)
+        now = datetime.utcnow()
+        if doc is None or doc["expires_at"] <= now:
+            return None
+        # Extend contexts still in use, at most about twice per TTL
+        if doc["expires_at"] - now < timedelta(seconds=PAGE_CONTEXT_TTL / 2):
+            await store.touch_page_context(handle, now + timedelta(seconds=PAGE_CONTEXT_TTL))
+        context = PageContext.from_document(doc)
+        self.memory.set(handle, context)
+        return context
+
+    def stats(self) -> dict:
+        return {"memory": self.memory.stats(), "registered": self.registered, "deduplicated": self.deduplicated}
+
+
+# Global instance
+page_contexts = PageContextStore()
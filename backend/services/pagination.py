@@ -0,0 +1,88 @@
+"""Keyset pagination and NDJSON streaming"""
+import json
+import base64
+import binascii
+from datetime import datetime
+from typing import AsyncIterator, List, Optional, Tuple
+from bson import ObjectId
+from services import serialization
+
+# Hard cap on a single page, whatever the client asks for
+MAX_PAGE_SIZE = 1000
+# Documents fetched per round trip while streaming
+STREAM_BATCH_SIZE = 200
+
+
+class InvalidCursor(ValueError):
+    """Raised for continuation tokens that can't be decoded"""
+
+
+def encode_cursor(sort_value, doc_id) -> str:
+    """Opaque continuation token for the position after a document"""
+    if isinstance(sort_value, datetime):
+        payload = {"t": sort_value.isoformat(), "id": str(doc_id)}
+    else:
+        payload = {"v": sort_value, "id": str(doc_id)}
+    raw = json.dumps(payload, separators=(",", ":")).encode()
+    return base64.urlsafe_b64encode(raw).decode().rstrip("=")
+
+
+def decode_cursor(token: str) -> Tuple[object, ObjectId]:
+    try:
+        raw = base64.urlsafe_b64decode(token + "=" * (-len(token) % 4))
+        payload = json.loads(raw)
+        value = datetime.fromisoformat(payload["t"]) if "t" in payload else payload["v"]
+        return value, ObjectId(payload["id"])
+    except (binascii.Error, ValueError, KeyError, TypeError) as e:
+        raise InvalidCursor(f"Invalid cursor: {e}")
+
+
+def keyset_query(query: dict, sort_key: str, cursor: Optional[str]) -> dict:
+    """Restrict query to documents after the cursor in (sort_key, _id) descending order"""
+    if not cursor:
+        return query
+    value, doc_id = decode_cursor(cursor)
+    return {
+        **query,
+        "$or": [
+            {sort_key: {"$lt": value}},
+            {sort_key: value, "_id": {"$lt": doc_id}}
+        ]
+    }
+
+
+def clamp_limit(limit: int) -> int:
+    return min(max(limit, 1), MAX_PAGE_SIZE)
+
+
+async def fetch_page(collection, query: dict, sort_key: str, limit: int,
+                     cursor: Optional[str] = None, projection: Optional[dict] = None) -> Tuple[List[dict], Optional[str]]:
+    """One page of documents plus the token for the next page (None at the end)"""
+    limit = clamp_limit(limit)
+    find = collection.find(keyset_query(query, sort_key, cursor), projection)
+    # Fetch one extra document to learn whether another page exists
+    docs = await find.sort([(sort_key, -1), ("_id", -1)]).limit(limit + 1).to_list(length=limit + 1)
+
+    next_cursor = None
+    if len(docs) > limit:
+        docs = docs[:limit]
+        last = docs[-1]
+        next_cursor = encode_cursor(last.get(sort_key), last["_id"])
+    return docs, next_cursor
+
+
+async def iter_documents(collection, query: dict, sort_key: str, limit: Optional[int] = None,
+                         cursor: Optional[str] = None, projection: Optional[dict] = None) -> AsyncIterator[dict]:
+    """Documents in (sort_key, _id) descending order straight from the Motor cursor"""
+    find = collection.find(keyset_query(query, sort_key, cursor), projection)
+    find = find.sort([(sort_key, -1), ("_id", -1)]).batch_size(STREAM_BATCH_SIZE)
+    if limit:
+        find = find.limit(limit)
+    async for doc in find:
+        yield doc
+
+
+async def ndjson_lines(docs: AsyncIterator[dict]) -> AsyncIterator[bytes]:
+    """Serialize documents as NDJSON lines as they arrive"""
+    async for doc in docs:
+        yield serialization.dumps(doc) + b"\n"
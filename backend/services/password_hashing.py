@@ -0,0 +1,144 @@
+"""scrypt password hashing on a bounded worker pool"""
+import os
+import hmac
+import time
+import base64
+import asyncio
+import hashlib
+import secrets
+from concurrent.futures import ThreadPoolExecutor
+from typing import Optional, Tuple
+import logging
+
+logger = logging.getLogger(__name__)
+
+# scrypt cost: N=2^14, r=8 takes ~16 MB and tens of milliseconds per hash
+SCRYPT_N = int(os.getenv("SCRYPT_N", 2 ** 14))
+SCRYPT_R = int(os.getenv("SCRYPT_R", 8))
+SCRYPT_P = int(os.getenv("SCRYPT_P", 1))
+# hashlib.scrypt releases the GIL, so threads hash in parallel
+PASSWORD_HASH_WORKERS = int(os.getenv("PASSWORD_HASH_WORKERS", min(4, os.cpu_count() or 1)))
+# Requests waiting beyond this are turned away instead of queueing without bound
+PASSWORD_HASH_MAX_QUEUE = int(os.getenv("PASSWORD_HASH_MAX_QUEUE", 64))
+
+_SALT_BYTES = 16
+_KEY_BYTES = 32
+
+
+class HashingOverloaded(Exception):
+    """Raised when too many hashes are already waiting for a worker"""
+
+
+def _b64(data: bytes) -> str:
+    return base64.b64encode(data).decode()
+
+
+def _scrypt(password: str, salt: bytes, n: int, r: int, p: int) -> bytes:
+    return hashlib.scrypt(password.encode(), salt=salt, n=n, r=r, p=p,
+                          maxmem=n * r * 128 * 2, dklen=_KEY_BYTES)
+
+
+def _parse(stored: str) -> Optional[Tuple[int, int, int, bytes, bytes]]:
+    """(n, r, p, salt, key) of a "scrypt$n$r$p$salt$key" hash, None for other formats"""
+    parts = stored.split("$")
+    if len(parts) != 6 or parts[0] != "scrypt":
+        return None
+    return int(parts[1]), int(parts[2]), int(parts[3]), base64.b64decode(parts[4]), base64.b64decode(parts[5])
+
+
+def hash_password_sync(password: str) -> str:
+    salt = secrets.token_bytes(_SALT_BYTES)
+    key = _scrypt(password, salt, SCRYPT_N, SCRYPT_R, SCRYPT_P)
+    return f"scrypt${SCRYPT_N}${SCRYPT_R}${SCRYPT_P}${_b64(salt)}${_b64(key)}"
+
+
+def verify_password_sync(password: str, stored: str) -> bool:
+    parsed = _parse(stored)
+    if parsed is None:
+        # Legacy unsalted SHA-256 hex digest
+        legacy = hashlib.sha256(password.encode()).hexdigest()
+        return hmac.compare_digest(legacy, stored)
+    n, r, p, salt, key = parsed
+    return hmac.compare_digest(_scrypt(password, salt, n, r, p), key)
+
+
+def needs_rehash(stored: str) -> bool:
+    """Whether a stored hash is legacy or uses other cost parameters than the current ones"""
+    parsed = _parse(stored)
+    return parsed is None or parsed[:3] != (SCRYPT_N, SCRYPT_R, SCRYPT_P)
+
+
+class PasswordHasher:
+    """Runs hashing off the event loop with bounded concurrency and queueing
+
+    At most PASSWORD_HASH_WORKERS hashes run at once; up to
+    PASSWORD_HASH_MAX_QUEUE more wait for a slot. Beyond that callers get
+    HashingOverloaded right away, so a login storm gets quick 503s while
+    every other endpoint keeps its latency.
+    """
+
+    def __init__(self, workers: int = PASSWORD_HASH_WORKERS, max_queue: int = PASSWORD_HASH_MAX_QUEUE):
+        self.executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix="password-hash")
+        self.slots = asyncio.Semaphore(workers)
+        self.workers = workers
+        self.max_queue = max_queue
+        self.queued = 0
+        self.running = 0
+        self.peak_queue = 0
+        self.completed = 0
+        self.rejected = 0
+        self.total_seconds = 0.0
+        self.total_wait_seconds = 0.0
+        # Verified against when an account doesn't exist, so timing doesn't reveal it
+        self._dummy_hash: Optional[str] = None
+
+    async def _run(self, fn, *args):
+        if self.queued >= self.max_queue:
+            self.rejected += 1
+            raise HashingOverloaded("Too many password operations in progress")
+        self.queued += 1
+        self.peak_queue = max(self.peak_queue, self.queued)
+        queued_at = time.perf_counter()
+        try:
+            await self.slots.acquire()
+        finally:
+            self.queued -= 1
+        started_at = time.perf_counter()
+        self.total_wait_seconds += started_at - queued_at
+        self.running += 1
+        try:
+            return await asyncio.get_running_loop().run_in_executor(self.executor, fn, *args)
+        finally:
+            self.running -= 1
+            self.completed += 1
+            self.total_seconds += time.perf_counter() - started_at
+            self.slots.release()
+
+    async def hash(self, password: str) -> str:
+        return await self._run(hash_password_sync, password)
+
+    async def verify(self, password: str, stored: Optional[str]) -> bool:
+        """Check a password; pass stored=None for unknown accounts to spend the same time"""
+        if stored is None:
+            if self._dummy_hash is None:
+                self._dummy_hash = await self.hash(secrets.token_urlsafe(16))
+            await self._run(verify_password_sync, password, self._dummy_hash)
+            return False
+        return await self._run(verify_password_sync, password, stored)
+
+    def stats(self) -> dict:
+        return {
+            "workers": self.workers,
+            "running": self.running,
+            "queued": self.queued,
+            "peak_queue": self.peak_queue,
+            "max_queue": self.max_queue,
+            "completed": self.completed,
+            "rejected": self.rejected,
+            "avg_hash_ms": round(1000 * self.total_seconds / self.completed, 2) if self.completed else 0.0,
+            "avg_wait_ms": round(1000 * self.total_wait_seconds / self.completed, 2) if self.completed else 0.0
+        }
+
+
+# Global instance
+password_hasher = PasswordHasher()
@@ -0,0 +1,303 @@
+"""Main-content extraction for web pages, cached per URL and ETag"""
+import os
+import re
+import time
+import asyncio
+from typing import Dict, List, Optional
+import httpx
+from lxml import etree, html as lxml_html
+from fastapi import HTTPException
+from services.http_client import get_http_client, host_limiter
+from services.lru_cache import TTLCache
+import logging
+
+logger = logging.getLogger(__name__)
+
+READABLE_CACHE_SIZE = int(os.getenv("READABLE_CACHE_SIZE", 512))
+# Extractions are kept this long; within READABLE_REVALIDATE_AFTER they're used without asking the origin
+READABLE_CACHE_TTL = int(os.getenv("READABLE_CACHE_TTL", 3600))
+READABLE_REVALIDATE_AFTER = int(os.getenv("READABLE_REVALIDATE_AFTER", 60))
+READABLE_MAX_BYTES = int(os.getenv("READABLE_MAX_BYTES", 5 * 1024 * 1024))
+
+# Removed outright before scoring
+STRIP_TAGS = (
+    "script", "style", "noscript", "template", "svg", "canvas", "iframe", "object", "embed",
+    "nav", "aside", "footer", "dialog"
+)
+# Removed once the forms around them have been judged
+FORM_CONTROLS = ("button", "input", "select", "textarea")
+# A form with fewer words of text than this per visible control is a search
+# box, login or sign-up; one wrapping the whole page (ASP.NET WebForms, many
+# CMS templates) has far more text than controls and is kept
+FORM_WORDS_PER_CONTROL = 25
+# Class/id hints (after Arc90's readability)
+NEGATIVE = re.compile(
+    r"comment|sidebar|footer|footnote|masthead|menu|nav|share|social|sponsor|advert|\bads?\b|promo|related"
+    r"|cookie|consent|banner|popup|modal|newsletter|subscribe|breadcrumb|widget|pagination|skip|hidden",
+    re.I
+)
+POSITIVE = re.compile(r"article|body|content|entry|main|page|post|story|text|blog", re.I)
+# Elements emitted as one paragraph each
+BLOCK_TAGS = {
+    "p", "h1", "h2", "h3", "h4", "h5", "h6", "li", "pre", "blockquote", "dd", "dt", "figcaption", "td", "th"
+}
+INLINE_TAGS = {
+    "a", "abbr", "b", "bdi", "bdo", "br", "cite", "code", "data", "del", "dfn", "em", "i", "img", "ins",
+    "kbd", "label", "mark", "q", "s", "samp", "small", "span", "strong", "sub", "sup", "time", "u", "var", "wbr"
+}
+_WHITESPACE = re.compile(r"\s+")
+
+
+def _normalize(text: str) -> str:
+    return _WHITESPACE.sub(" ", text).strip()
+
+
+def _hints(element) -> str:
+    return f"{element.get('class', '')} {element.get('id', '')}"
+
+
+def _is_boilerplate(element) -> bool:
+    if element.tag in ("html", "body", "article", "main"):
+        return False
+    if element.get("hidden") is not None or element.get("aria-hidden") == "true":
+        return True
+    if element.get("role") in ("navigation", "banner", "contentinfo", "complementary", "dialog"):
+        return True
+    if "display:none" in element.get("style", "").replace(" ", ""):
+        return True
+    hints = _hints(element)
+    return bool(NEGATIVE.search(hints)) and not POSITIVE.search(hints)
+
+
+def _is_boilerplate_form(form) -> bool:
+    controls = len(form.xpath(".//input[not(@type='hidden')] | .//select | .//textarea | .//button"))
+    return _link_density(form) > 0.5 or controls * FORM_WORDS_PER_CONTROL > len(form.text_content().split())
+
+
+def _clean(doc):
+    etree.strip_elements(doc, etree.Comment, etree.ProcessingInstruction, with_tail=False)
+    etree.strip_elements(doc, *STRIP_TAGS, with_tail=False)
+    for form in doc.xpath("//form"):
+        if _is_boilerplate_form(form):
+            form.drop_tree()
+    etree.strip_elements(doc, *FORM_CONTROLS, with_tail=False)
+    # Site headers, but not an article's own header with its title
+    for header in doc.xpath("//header[not(ancestor::article) and not(ancestor::main)]"):
+        header.drop_tree()
+    for element in list(doc.iter()):
+        if isinstance(element.tag, str) and element.getparent() is not None and _is_boilerplate(element):
+            element.drop_tree()
+
+
+def _link_density(element) -> float:
+    length = len(element.text_content()) or 1
+    return sum(len(link.text_content()) for link in element.iter("a")) / length
+
+
+def _main_content(doc) -> List[etree._Element]:
+    """The container with the most paragraph text (Readability-style scoring) and its strong siblings"""
+    scores: Dict[etree._Element, float] = {}
+
+    def initial(element) -> float:
+        score = {"article": 10, "main": 10, "section": 3, "div": 5, "pre": 3, "td": 3, "blockquote": 3}.get(element.tag, 0)
+        hints = _hints(element)
+        if POSITIVE.search(hints):
+            score += 25
+        if NEGATIVE.search(hints):
+            score -= 25
+        return score
+
+    for paragraph in doc.iter("p", "pre", "td", "blockquote"):
+        text = _normalize(paragraph.text_content())
+        if len(text) < 25:
+            continue
+        points = 1 + text.count(",") + min(len(text) / 100, 3)
+        parent = paragraph.getparent()
+        for ancestor, share in ((parent, 1.0), (parent.getparent() if parent is not None else None, 0.5)):
+            if ancestor is None or not isinstance(ancestor.tag, str):
+                continue
+            if ancestor not in scores:
+                scores[ancestor] = initial(ancestor)
+            scores[ancestor] += points * share
+
+    if not scores:
+        return []
+    ranked = {element: score * (1 - _link_density(element)) for element, score in scores.items()}
+    best = max(ranked, key=ranked.get)
+    parent = best.getparent()
+    if parent is None:
+        return [best]
+    # Articles split over sibling containers (e.g. around an ad slot) keep all their parts
+    threshold = max(10, ranked[best] * 0.2)
+    return [sibling for sibling in parent if sibling is best or ranked.get(sibling, 0) >= threshold]
+
+
+def _paragraphs(element, out: List[str]):
+    """Append the element's text as paragraphs, one per block element"""
+    tag = element.tag
+    if tag in BLOCK_TAGS:
+        if tag == "pre":
+            text = "\n".join(line.rstrip() for line in element.text_content().strip("\n").splitlines())
+        else:
+            text = _normalize(element.text_content())
+        if text:
+            if tag[0] == "h" and tag[1:].isdigit():
+                text = f"{'#' * int(tag[1])} {text}"
+            elif tag == "li":
+                text = f"- {text}"
+            out.append(text)
+        return
+
+    inline = [element.text or ""]
+
+    def flush():
+        text = _normalize("".join(inline))
+        if text:
+            out.append(text)
+        inline.clear()
+
+    for child in element:
+        if not isinstance(child.tag, str):
+            pass
+        elif child.tag in INLINE_TAGS:
+            inline.append(child.text_content())
+        else:
+            flush()
+            _paragraphs(child, out)
+        inline.append(child.tail or "")
+    flush()
+
+
+def _meta(doc, *names) -> Optional[str]:
+    for name in names:
+        values = doc.xpath(f"//meta[@property='{name}' or @name='{name}']/@content")
+        if values and values[0].strip():
+            return _normalize(values[0])
+    return None
+
+
+def extract(content: bytes, url: str, encoding: Optional[str] = None) -> dict:
+    """Title, excerpt and main text of an HTML document"""
+    if not content.strip():
+        return {"url": url, "title": "", "excerpt": "", "language": None, "text": "", "word_count": 0}
+    parser = lxml_html.HTMLParser(encoding=encoding, remove_comments=True)
+    doc = lxml_html.document_fromstring(content, parser=parser, base_url=url)
+
+    title = _meta(doc, "og:title") or _normalize(doc.findtext(".//title") or "")
+    description = _meta(doc, "og:description", "description")
+    language = doc.get("lang")
+
+    _clean(doc)
+    roots = _main_content(doc) or [doc.find("body") if doc.find("body") is not None else doc]
+
+    paragraphs: List[str] = []
+    for root in roots:
+        _paragraphs(root, paragraphs)
+    # Drop consecutive repeats (e.g. a heading echoed as a caption)
+    paragraphs = [text for i, text in enumerate(paragraphs) if i == 0 or text != paragraphs[i - 1]]
+    text = "\n\n".join(paragraphs)
+    return {
+        "url": url,
+        "title": title,
+        "excerpt": description or (paragraphs[0][:300] if paragraphs else ""),
+        "language": language,
+        "text": text,
+        "word_count": len(text.split())
+    }
+
+
+class ReadablePages:
+    """Fetches pages and caches their extracted text per (URL, ETag)
+
+    The validator of the latest fetch is kept per URL; once it is older than
+    READABLE_REVALIDATE_AFTER the page is re-requested conditionally and a
+    304, or a 200 with an ETag already extracted, reuses the stored result.
+    """
+
+    def __init__(self):
+        self.validators = TTLCache(maxsize=READABLE_CACHE_SIZE, ttl=READABLE_CACHE_TTL)
+        self.results = TTLCache(maxsize=READABLE_CACHE_SIZE, ttl=READABLE_CACHE_TTL)
+        # One fetch per URL at a time; concurrent callers share it
+        self.inflight: Dict[str, asyncio.Task] = {}
+        self.extractions = 0
+
+    async def get(self, url: str) -> dict:
+        """Extraction for url, with "cache" set to HIT, REVALIDATED or MISS"""
+        validator = self.validators.get(url)
+        if validator and time.monotonic() - validator["checked_at"] < READABLE_REVALIDATE_AFTER:
+            result = self.results.get((url, validator["tag"]))
+            if result is not None:
+                return {**result, "cache": "HIT"}
+
+        task = self.inflight.get(url)
+        if task is None:
+            task = self.inflight[url] = asyncio.create_task(self._fetch(url, validator))
+            task.add_done_callback(lambda _: self.inflight.pop(url, None))
+        return await asyncio.shield(task)
+
+    async def _fetch(self, url: str, validator: Optional[dict]) -> dict:
+        headers = {"accept": "text/html,application/xhtml+xml;q=0.9,text/plain;q=0.8"}
+        if validator and (url, validator["tag"]) in self.results:
+            if validator.get("etag"):
+                headers["if-none-match"] = validator["etag"]
+            if validator.get("last_modified"):
+                headers["if-modified-since"] = validator["last_modified"]
+
+        client = get_http_client()
+        async with host_limiter.slot(url):
+            try:
+                async with client.stream("GET", url, headers=headers) as response:
+                    if response.status_code == 304:
+                        result = self.results.get((url, validator["tag"])) if validator else None
+                        if result is None:
+                            raise HTTPException(status_code=502, detail=f"Unexpected 304 from upstream: {url}")
+                        self._remember(url, validator["etag"], validator["last_modified"])
+                        return {**result, "cache": "REVALIDATED"}
+                    if response.status_code >= 400:
+                        raise HTTPException(status_code=502, detail=f"Upstream returned {response.status_code}: {url}")
+                    etag = response.headers.get("etag")
+                    last_modified = response.headers.get("last-modified")
+                    tag = etag or last_modified or ""
+                    if tag and (url, tag) in self.results:
+                        self._remember(url, etag, last_modified)
+                        return {**self.results.get((url, tag)), "cache": "REVALIDATED"}
+                    content_type = response.headers.get("content-type", "text/html").split(";")[0].strip().lower()
+                    if content_type not in ("text/html", "application/xhtml+xml", "text/plain"):
+                        raise HTTPException(status_code=415, detail=f"Not an HTML page: {content_type}")
+                    body = bytearray()
+                    async for chunk in response.aiter_bytes():
+                        body += chunk
+                        if len(body) > READABLE_MAX_BYTES:
+                            raise HTTPException(status_code=413, detail=f"Page exceeds {READABLE_MAX_BYTES} bytes")
+                    encoding = response.charset_encoding
+                    final_url = str(response.url)
+            except httpx.TimeoutException as e:
+                logger.error(f"Readable fetch timeout: {e}")
+                raise HTTPException(status_code=504, detail=f"Upstream timed out: {url}")
+            except httpx.HTTPError as e:
+                logger.error(f"Readable fetch error: {e}")
+                raise HTTPException(status_code=502, detail=f"Failed to fetch URL: {str(e)}")
+
+        if content_type == "text/plain":
+            text = bytes(body).decode(encoding or "utf-8", errors="replace").strip()
+            result = {"url": final_url, "title": "", "excerpt": text[:300], "language": None,
+                      "text": text, "word_count": len(text.split())}
+        else:
+            result = await asyncio.to_thread(extract, bytes(body), final_url, encoding)
+        self.extractions += 1
+        self.results.set((url, tag), result)
+        self._remember(url, etag, last_modified)
+        return {**result, "cache": "MISS"}
+
+    def _remember(self, url: str, etag: Optional[str], last_modified: Optional[str]):
+        self.validators.set(url, {
+            "etag": etag, "last_modified": last_modified,
+            "tag": etag or last_modified or "", "checked_at": time.monotonic()
+        })
+
+    def stats(self) -> dict:
+        return {"results": self.results.stats(), "extractions": self.extractions, "inflight": len(self.inflight)}
+
+
+# Global instance
+readable_pages = ReadablePages()
@@ -0,0 +1,365 @@
+"""Typed, multiplexed messages over one WebSocket per client
+
+Frames are JSON text, except audio, which is sent in binary frames both ways.
+
+Client -> server
+    {"id": 7, "ch": "focus", "op": "check_url", "data": {...}}     a request
+    {"ch": "ctl", "op": "cancel", "id": 7}                         abandon request 7
+    {"ch": "ctl", "op": "subscribe", "data": {"channels": [...]}}  start pushes (also "unsubscribe")
+    {"ch": "ctl", "op": "ping"}, {"ch": "ctl", "op": "pong"}
+    binary: 4-byte big-endian request id + audio; an empty payload ends the audio
+
+Server -> client
+    {"type": "hello", ...}                                         once, with the limits below
+    {"id": 7, "type": "result", "data": ...}
+    binary: 4-byte request id + audio, as above, ahead of the result of an op that speaks
+    {"id": 7, "type": "chunk", "data": ...} ... {"id": 7, "type": "end"}
+    {"id": 7, "type": "error", "status": 404, "detail": ...}
+    {"id": 7, "type": "cancelled"}
+    {"ch": "downloads", "type": "progress", "data": ...}           pushes on subscribed channels
+    {"type": "ping"}, {"type": "pong"}, {"type": "subscribed", "channels": [...]}
+"""
+import os
+import time
+import struct
+import asyncio
+import inspect
+from typing import Any, Awaitable, Callable, Dict, Optional, Set, Tuple, Type
+import orjson
+from fastapi import HTTPException, WebSocket
+from fastapi.responses import Response
+from pydantic import BaseModel, ValidationError
+from services.serialization import dumps
+import logging
+
+logger = logging.getLogger(__name__)
+
+# Server pings this often; connections silent for REALTIME_MISSED_HEARTBEATS pings are closed
+REALTIME_HEARTBEAT = float(os.getenv("REALTIME_HEARTBEAT", 20))
+REALTIME_MISSED_HEARTBEATS = int(os.getenv("REALTIME_MISSED_HEARTBEATS", 3))
+# Requests one connection may have running; more are refused with 429
+REALTIME_MAX_INFLIGHT = int(os.getenv("REALTIME_MAX_INFLIGHT", 16))
+# Frames queued for a client before senders wait for it to catch up
+REALTIME_SEND_QUEUE = int(os.getenv("REALTIME_SEND_QUEUE", 64))
+REALTIME_MAX_MESSAGE_BYTES = int(os.getenv("REALTIME_MAX_MESSAGE_BYTES", 1024 * 1024))
+REALTIME_MAX_AUDIO_BYTES = int(os.getenv("REALTIME_MAX_AUDIO_BYTES", 10 * 1024 * 1024))
+
+CLOSE_UNAUTHORIZED = 4401
+CLOSE_TIMEOUT = 4408
+
+_AUDIO_HEADER = struct.Struct(">I")
+# Audio is sent to clients in frames of at most this many bytes
+_AUDIO_CHUNK = 64 * 1024
+
+
+class _Binary(bytes):
+    """An outgoing payload sent as a binary frame"""
+
+
+class AudioReply:
+    """An op result whose audio goes to the client in binary frames ahead of the JSON result"""
+    __slots__ = ("data", "audio")
+
+    def __init__(self, data: Any, audio: Optional[bytes]):
+        self.data = data
+        self.audio = audio
+
+
+class _Audio:
+    __slots__ = ("data", "complete", "too_big")
+
+    def __init__(self):
+        self.data = bytearray()
+        self.complete = asyncio.Event()
+        self.too_big = False
+
+
+class Connection:
+    """One client socket: its running requests, subscriptions and outgoing frames"""
+
+    def __init__(self, websocket: WebSocket, user_id: str):
+        self.websocket = websocket
+        self.user_id = user_id
+        # Bounded, so a client that reads slowly makes streams and pushes wait instead of piling up
+        self.outbox: asyncio.Queue = asyncio.Queue(maxsize=REALTIME_SEND_QUEUE)
+        self.requests: Dict[int, asyncio.Task] = {}
+        self.subscriptions: Dict[str, asyncio.Task] = {}
+        self.audio: Dict[int, _Audio] = {}
+        self.last_received = time.monotonic()
+
+    async def send(self, frame: dict):
+        """Queue a frame, waiting while the client is behind"""
+        await self.outbox.put(dumps(frame))
+
+    async def send_audio(self, request_id: int, audio: bytes):
+        """Audio framed like the client's: chunks behind the request id, then an empty one"""
+        header = _AUDIO_HEADER.pack(request_id)
+        for start in range(0, len(audio), _AUDIO_CHUNK):
+            await self.outbox.put(_Binary(header + audio[start:start + _AUDIO_CHUNK]))
+        await self.outbox.put(_Binary(header))
+
+    async def send_result(self, request_id: int, result: Any):
+        if isinstance(result, AudioReply):
+            if result.audio:
+                await self.send_audio(request_id, result.audio)
+            result = result.data
+        if isinstance(result, Response):
+            # Already rendered by a route; spliced in without decoding it again
+            await self.outbox.put(b'{"id":%d,"type":"result","data":%s}' % (request_id, result.body))
+            return
+        if isinstance(result, BaseModel):
+            result = result.model_dump()
+        await self.send({"id": request_id, "type": "result", "data": result})
+
+    async def send_error(self, request_id: Optional[int], status: int, detail: Any):
+        await self.send({"id": request_id, "type": "error", "status": status, "detail": detail})
+
+    async def push(self, channel: str, kind: str, data: Any):
+        await self.send({"ch": channel, "type": kind, "data": data})
+
+
+# handler(connection, data[, audio]) returns a result or is an async generator of chunks
+Handler = Callable[..., Any]
+# pump(connection) pushes a channel's events until cancelled
+Pump = Callable[[Connection], Awaitable[None]]
+
+
+class Realtime:
+    """Dispatches requests to registered channel ops and runs channel pushes"""
+
+    def __init__(self):
+        self.handlers: Dict[Tuple[str, str], Tuple[Handler, Optional[Type[BaseModel]], bool]] = {}
+        self.pumps: Dict[str, Pump] = {}
+        self.connections: Set[Connection] = set()
+        self.received = 0
+        self.sent = 0
+        self.refused = 0
+
+    def op(self, channel: str, name: str, model: Optional[Type[BaseModel]] = None, audio: bool = False):
+        """Register a handler; data is validated into model, and audio ops also get the audio bytes"""
+        def register(handler: Handler) -> Handler:
+            self.handlers[(channel, name)] = (handler, model, audio)
+            return handler
+        return register
+
+    def channel(self, name: str):
+        """Register the pump that pushes a channel's events to a subscribed connection"""
+        def register(pump: Pump) -> Pump:
+            self.pumps[name] = pump
+            return pump
+        return register
+
+    async def serve(self, websocket: WebSocket, user_id: str):
+        """Run an accepted socket until the client leaves or stops answering pings"""
+        connection = Connection(websocket, user_id)
+        self.connections.add(connection)
+        await connection.send({
+            "type": "hello",
+            "channels": sorted({channel for channel, _ in self.handlers}),
+            "push": sorted(self.pumps),
+            "heartbeat": REALTIME_HEARTBEAT,
+            "max_inflight": REALTIME_MAX_INFLIGHT,
+            "max_message_bytes": REALTIME_MAX_MESSAGE_BYTES,
+            "max_audio_bytes": REALTIME_MAX_AUDIO_BYTES
+        })
+        tasks = [
+            asyncio.create_task(self._read(connection)),
+            asyncio.create_task(self._write(connection)),
+            asyncio.create_task(self._heartbeat(connection))
+        ]
+        try:
+            done, _ = await asyncio.wait(tasks, return_when=asyncio.FIRST_COMPLETED)
+            for task in done:
+                if not task.cancelled() and task.exception() is not None:
+                    logger.info(f"Realtime connection ended: {task.exception()!r}")
+        finally:
+            running = [*tasks, *connection.requests.values(), *connection.subscriptions.values()]
+            self.connections.discard(connection)
+            for task in running:
+                task.cancel()
+            await asyncio.gather(*running, return_exceptions=True)
+
+    async def _read(self, connection: Connection):
+        while True:
+            message = await connection.websocket.receive()
+            if message["type"] == "websocket.disconnect":
+                return
+            connection.last_received = time.monotonic()
+            self.received += 1
+            if message.get("bytes") is not None:
+                await self._audio_frame(connection, message["bytes"])
+            else:
+                await self._dispatch(connection, message.get("text") or "")
+
+    async def _write(self, connection: Connection):
+        while True:
+            payload = await connection.outbox.get()
+            if isinstance(payload, _Binary):
+                await connection.websocket.send_bytes(payload)
+            else:
+                await connection.websocket.send_text(payload.decode())
+            self.sent += 1
+
+    async def _heartbeat(self, connection: Connection):
+        while True:
+            await asyncio.sleep(REALTIME_HEARTBEAT)
+            if time.monotonic() - connection.last_received > REALTIME_HEARTBEAT * REALTIME_MISSED_HEARTBEATS:
+                await connection.websocket.close(code=CLOSE_TIMEOUT)
+                return
+            # A full queue already has frames on the way; the ping can wait a round
+            try:
+                connection.outbox.put_nowait(dumps({"type": "ping"}))
+            except asyncio.QueueFull:
+                pass
+
+    async def _dispatch(self, connection: Connection, text: str):
+        if len(text) > REALTIME_MAX_MESSAGE_BYTES:
+            await connection.send_error(None, 413, f"Frames are limited to {REALTIME_MAX_MESSAGE_BYTES} bytes")
+            return
+        try:
+            frame = orjson.loads(text)
+        except orjson.JSONDecodeError:
+            frame = None
+        if not isinstance(frame, dict):
+            await connection.send_error(None, 400, "Frames are JSON objects")
+            return
+
+        channel, name, request_id = frame.get("ch"), frame.get("op"), frame.get("id")
+        if channel == "ctl":
+            await self._control(connection, name, request_id, frame.get("data") or {})
+            return
+        if type(request_id) is not int or not 0 <= request_id <= 0xFFFFFFFF:
+            await connection.send_error(None, 400, "Requests need an integer id between 0 and 2**32-1")
+            return
+        entry = self.handlers.get((channel, name))
+        if entry is None:
+            await connection.send_error(request_id, 404, f"Unknown op {channel}.{name}")
+            return
+        if request_id in connection.requests:
+            await connection.send_error(request_id, 409, "A request with this id is still running")
+            return
+        if len(connection.requests) >= REALTIME_MAX_INFLIGHT:
+            self.refused += 1
+            await connection.send_error(request_id, 429, f"At most {REALTIME_MAX_INFLIGHT} requests may run at once")
+            return
+
+        handler, model, audio = entry
+        if audio:
+            # Created now, so audio frames sent right behind the request are kept
+            connection.audio[request_id] = _Audio()
+        task = asyncio.create_task(self._run(connection, request_id, f"{channel}.{name}", handler, model, audio,
+                                             frame.get("data") or {}))
+        connection.requests[request_id] = task
+
+        def finished(_):
+            if connection.requests.get(request_id) is task:
+                del connection.requests[request_id]
+                connection.audio.pop(request_id, None)
+
+        task.add_done_callback(finished)
+
+    async def _run(self, connection: Connection, request_id: int, label: str, handler: Handler,
+                   model: Optional[Type[BaseModel]], audio: bool, data: Any):
+        try:
+            if model is not None:
+                data = model.model_validate(data)
+            args = [connection, data]
+            if audio:
+                args.append(await self._receive_audio(connection, request_id))
+            if inspect.isasyncgenfunction(handler):
+                async for chunk in handler(*args):
+                    await connection.send({"id": request_id, "type": "chunk", "data": chunk})
+                await connection.send({"id": request_id, "type": "end"})
+            else:
+                await connection.send_result(request_id, await handler(*args))
+        except ValidationError as e:
+            await connection.send_error(request_id, 422, e.errors(include_url=False, include_context=False,
+                                                                  include_input=False))
+        except HTTPException as e:
+            await connection.send_error(request_id, e.status_code, e.detail)
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:
+            logger.error(f"Realtime {label} error: {e}")
+            await connection.send_error(request_id, 500, str(e))
+
+    async def _receive_audio(self, connection: Connection, request_id: int) -> bytes:
+        audio = connection.audio[request_id]
+        await audio.complete.wait()
+        if audio.too_big:
+            raise HTTPException(status_code=413, detail=f"Audio exceeds {REALTIME_MAX_AUDIO_BYTES} bytes")
+        return bytes(audio.data)
+
+    async def _audio_frame(self, connection: Connection, payload: bytes):
+        if len(payload) < _AUDIO_HEADER.size:
+            await connection.send_error(None, 400, "Binary frames start with a 4-byte request id")
+            return
+        request_id, = _AUDIO_HEADER.unpack_from(payload)
+        audio = connection.audio.get(request_id)
+        if audio is None:
+            await connection.send_error(request_id, 404, "No request is waiting for audio with this id")
+            return
+        chunk = payload[_AUDIO_HEADER.size:]
+        if not chunk:
+            audio.complete.set()
+        elif not audio.too_big:
+            if len(audio.data) + len(chunk) > REALTIME_MAX_AUDIO_BYTES:
+                audio.too_big = True
+                audio.data = bytearray()
+            else:
+                audio.data += chunk
+
+    async def _pump(self, connection: Connection, channel: str):
+        try:
+            await self.pumps[channel](connection)
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:
+            logger.error(f"Realtime {channel} pushes stopped: {e}")
+            await connection.send({"ch": channel, "type": "error", "status": 500, "detail": str(e)})
+        finally:
+            # A pump that ended (or was told to resync) can be subscribed again
+            if connection.subscriptions.get(channel) is asyncio.current_task():
+                del connection.subscriptions[channel]
+
+    async def _control(self, connection: Connection, name: Optional[str], request_id: Any, data: dict):
+        if name == "pong":
+            return
+        if name == "ping":
+            await connection.send({"type": "pong"})
+        elif name == "cancel":
+            task = connection.requests.get(request_id)
+            if task is not None:
+                task.cancel()
+                await connection.send({"id": request_id, "type": "cancelled"})
+        elif name in ("subscribe", "unsubscribe"):
+            channels = data.get("channels") if isinstance(data, dict) else None
+            if not isinstance(channels, list):
+                await connection.send_error(request_id, 400, "Expected data.channels, a list of channel names")
+                return
+            unknown = [channel for channel in channels if channel not in self.pumps]
+            if unknown:
+                await connection.send_error(request_id, 404, f"No pushes on channels: {unknown}")
+                return
+            for channel in channels:
+                if name == "subscribe" and channel not in connection.subscriptions:
+                    connection.subscriptions[channel] = asyncio.create_task(self._pump(connection, channel))
+                elif name == "unsubscribe" and channel in connection.subscriptions:
+                    connection.subscriptions.pop(channel).cancel()
+            await connection.send({"id": request_id, "type": "subscribed", "channels": sorted(connection.subscriptions)})
+        else:
+            await connection.send_error(request_id, 404, f"Unknown control op {name}")
+
+    def stats(self) -> dict:
+        return {
+            "connections": len(self.connections),
+            "requests": sum(len(connection.requests) for connection in self.connections),
+            "subscriptions": sum(len(connection.subscriptions) for connection in self.connections),
+            "received": self.received,
+            "sent": self.sent,
+            "refused": self.refused
+        }
+
+
+# Global instance
+realtime = Realtime()
@@ -0,0 +1,102 @@
+"""Token-based search over bookmarks and history"""
+import re
+import math
+from datetime import datetime
+from typing import Dict, List, Optional
+
+# Tokens that appear in nearly every URL and would match everything
+URL_NOISE = {"http", "https", "www", "com", "org", "net", "html", "htm", "php", "index", "amp"}
+
+MAX_TERMS = 64
+MAX_TERM_LENGTH = 32
+# Upper bound on index matches scored per query; keeps latency flat for
+# very common prefixes at the cost of exhaustive ranking
+CANDIDATE_LIMIT = 500
+# Candidates are taken newest first by these fields, so the limit drops the stalest matches
+RECENCY_FIELDS = {"bookmarks": "created_at", "history": "visited_at", "history_archive": "month"}
+
+# Documents store a search_terms array of casefolded tokens. With a
+# (user_id, search_terms) index, anchored prefix regexes on those tokens are
+# index scans, so search cost doesn't grow with the size of a user's history.
+# Letters and digits of any script; underscores still split words as before
+_TOKEN = re.compile(r"[^\W_]+")
+# Stored as terms_version next to search_terms; bump it whenever tokenize()
+# changes so the startup backfill reindexes only documents made before
+TERMS_VERSION = 2
+# Document fields that exist only for the search index
+INDEX_FIELDS = ("search_terms", "terms_version")
+
+
+def tokenize(text: Optional[str]) -> List[str]:
+    """Casefolded alphanumeric tokens of text"""
+    if not text:
+        return []
+    return [token[:MAX_TERM_LENGTH] for token in _TOKEN.findall(text.casefold())]
+
+
+def search_terms_for(url: str, title: str = "", tags: Optional[List[str]] = None) -> List[str]:
+    """Deduplicated tokens to store on a document for searching"""
+    terms = tokenize(title)
+    terms += [t for t in tokenize(url) if t not in URL_NOISE]
+    for tag in tags or []:
+        terms += tokenize(tag)
+    return list(dict.fromkeys(terms))[:MAX_TERMS]
+
+
+def search_fields(url: str, title: str = "", tags: Optional[List[str]] = None) -> dict:
+    """search_terms and the tokenizer version that made them, to store on a document"""
+    return {"search_terms": search_terms_for(url, title, tags), "terms_version": TERMS_VERSION}
+
+
+def strip_index_fields(doc: dict) -> dict:
+    for field in INDEX_FIELDS:
+        doc.pop(field, None)
+    return doc
+
+
+def query_terms(query: str) -> List[str]:
+    """Query tokens, longest first so the most selective drives the index scan"""
+    return sorted(set(tokenize(query)), key=len, reverse=True)
+
+
+def build_filter(user_id: str, terms: List[str]) -> dict:
+    """Mongo filter requiring every term to prefix-match a stored token"""
+    return {
+        "user_id": user_id,
+        "search_terms": {"$all": [re.compile("^" + re.escape(term)) for term in terms]}
+    }
+
+
+def score(doc: dict, terms: List[str], now: Optional[datetime] = None) -> float:
+    """Relevance of a candidate: title hits beat URL/tag hits, exact beats prefix"""
+    title_tokens = set(tokenize(doc.get("title")))
+    other_tokens = set(doc.get("search_terms", [])) - title_tokens
+    total = 0.0
+    for term in terms:
+        if term in title_tokens:
+            total += 3
+        elif any(token.startswith(term) for token in title_tokens):
+            total += 2
+        elif term in other_tokens:
+            total += 1.5
+        else:
+            total += 1
+
+    # History popularity and recency nudge otherwise equal results
+    total += math.log1p(doc.get("visit_count", 0)) * 0.5
+    stamp = doc.get("visited_at") or doc.get("created_at")
+    if isinstance(stamp, datetime):
+        age_days = ((now or datetime.utcnow()) - stamp).total_seconds() / 86400
+        total += 1 / (1 + max(age_days, 0) / 30)
+    return total
+
+
+def rank(docs: List[dict], terms: List[str], page: int, page_size: int) -> Dict[str, object]:
+    """Sort candidates by relevance and cut out one page"""
+    now = datetime.utcnow()
+    ranked = sorted(docs, key=lambda doc: score(doc, terms, now), reverse=True)
+    start = (page - 1) * page_size
+    results = ranked[start:start + page_size]
+    for doc in results:
+        strip_index_fields(doc)
+    return {"results": results, "has_more": len(ranked) > start + page_size}
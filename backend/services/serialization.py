@@ -0,0 +1,27 @@
+"""Fast JSON serialization for Mongo documents"""
+import orjson
+from bson import ObjectId
+from fastapi.responses import ORJSONResponse
+
+
+def bson_default(value):
+    """orjson fallback for BSON types it doesn't know natively"""
+    if isinstance(value, ObjectId):
+        return str(value)
+    raise TypeError(f"Object of type {type(value).__name__} is not JSON serializable")
+
+
+def dumps(content) -> bytes:
+    """Serialize content (datetimes natively, ObjectIds as strings) to JSON bytes"""
+    return orjson.dumps(content, default=bson_default, option=orjson.OPT_NON_STR_KEYS)
+
+
+class BSONResponse(ORJSONResponse):
+    """JSON response that renders raw Mongo documents with orjson
+
+    Returning one directly from a route skips FastAPI's jsonable_encoder,
+    which otherwise walks every value and can't handle ObjectId.
+    """
+
+    def render(self, content) -> bytes:
+        return dumps(content)
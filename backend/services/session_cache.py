@@ -0,0 +1,130 @@
+"""Cached session-token verification and the auth dependencies routes share"""
+import os
+from datetime import datetime
+from typing import Optional
+from fastapi import Header, HTTPException, WebSocket
+from database.storage import get_storage
+from services.lru_cache import TTLCache
+import logging
+
+logger = logging.getLogger(__name__)
+
+SESSION_CACHE_SIZE = int(os.getenv("SESSION_CACHE_SIZE", 10000))
+# Longest a token stays valid in other workers after /logout (this worker forgets it immediately)
+SESSION_CACHE_TTL = int(os.getenv("SESSION_CACHE_TTL", 60))
+# Bad tokens are remembered briefly so retries and scans don't reach the database
+SESSION_NEGATIVE_TTL = int(os.getenv("SESSION_NEGATIVE_TTL", 10))
+# Reject requests without a session token instead of trusting the user_id parameter
+AUTH_REQUIRED = os.getenv("AUTH_REQUIRED", "False").lower() == "true"
+
+
+class SessionCache:
+    """LRU of verified session tokens and the user they belong to"""
+
+    def __init__(self):
+        self.valid = TTLCache(maxsize=SESSION_CACHE_SIZE, ttl=SESSION_CACHE_TTL)
+        self.invalid = TTLCache(maxsize=SESSION_CACHE_SIZE, ttl=SESSION_NEGATIVE_TTL)
+
+    async def resolve(self, token: str) -> Optional[dict]:
+        """User info for a live session token, or None"""
+        user = self.valid.get(token)
+        if user is not None:
+            if user["expires_at"] > datetime.utcnow():
+                return user
+            self.valid.pop(token)
+        if token in self.invalid:
+            return None
+
+        user = await self._load(token)
+        if user is None or token in self.invalid:
+            # Also covers a logout that landed while the session was loading
+            self.invalid.set(token, True)
+            return None
+        self.remember(token, user)
+        return user
+
+    async def _load(self, token: str) -> Optional[dict]:
+        store = get_storage()
+        session = await store.find_session(token)
+        if not session:
+            return None
+        if session["expires_at"] < datetime.utcnow():
+            await store.delete_session(token)
+            return None
+        user = await store.find_user(session["user_id"])
+        if not user:
+            return None
+        return {
+            "user_id": str(user["_id"]),
+            "email": user["email"],
+            "name": user["name"],
+            "expires_at": session["expires_at"]
+        }
+
+    def remember(self, token: str, user: dict):
+        """Cache a session, never past its expiry"""
+        remaining = (user["expires_at"] - datetime.utcnow()).total_seconds()
+        if remaining > 0:
+            self.valid.set(token, user, ttl=min(SESSION_CACHE_TTL, remaining))
+            self.invalid.pop(token)
+
+    def invalidate(self, token: str):
+        """Forget a token on logout"""
+        self.valid.pop(token)
+        self.invalid.set(token, True)
+
+    def clear(self):
+        self.valid.clear()
+
+    def stats(self) -> dict:
+        return {"valid": self.valid.stats(), "invalid": self.invalid.stats()}
+
+
+# Global instance
+session_cache = SessionCache()
+
+
+def _token(authorization: Optional[str], session_token: Optional[str]) -> Optional[str]:
+    if authorization and authorization.lower().startswith("bearer "):
+        return authorization[7:].strip()
+    return session_token
+
+
+async def current_user(authorization: Optional[str] = Header(None),
+                       session_token: Optional[str] = None) -> dict:
+    """Dependency: the signed-in user (401 without a valid session token)"""
+    token = _token(authorization, session_token)
+    if not token:
+        raise HTTPException(status_code=401, detail="Not authenticated")
+    user = await session_cache.resolve(token)
+    if user is None:
+        raise HTTPException(status_code=401, detail="Invalid session")
+    return user
+
+
+async def current_user_id(user_id: str = "default_user",
+                          authorization: Optional[str] = Header(None),
+                          session_token: Optional[str] = None) -> str:
+    """Dependency: the session's user id, or the user_id parameter for clients without one
+
+    A token always wins over user_id, so a signed-in client can't read
+    another user's data by passing their id.
+    """
+    token = _token(authorization, session_token)
+    if token is None and not AUTH_REQUIRED:
+        return user_id
+    user = await current_user(authorization, session_token)
+    return user["user_id"]
+
+
+async def websocket_user_id(websocket: WebSocket) -> Optional[str]:
+    """The user of a WebSocket handshake, or None to reject it
+
+    Browsers can't set headers on WebSockets, so the token may also come as
+    ?session_token=; without one ?user_id= is used like current_user_id does.
+    """
+    token = _token(websocket.headers.get("authorization"), websocket.query_params.get("session_token"))
+    if token is None:
+        return None if AUTH_REQUIRED else websocket.query_params.get("user_id", "default_user")
+    user = await session_cache.resolve(token)
+    return user["user_id"] if user else None
@@ -0,0 +1,196 @@
+"""Site directory for resolving spoken site names to URLs"""
+import os
+import json
+import re
+from bisect import bisect_left
+from typing import Dict, List, Optional, Tuple
+import logging
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_DIRECTORY_PATH = os.path.join(
+    os.path.dirname(os.path.dirname(os.path.abspath(__file__))),
+    "data",
+    "site_directory.json"
+)
+
+# Words that commonly wrap a site name in speech ("open the youtube website")
+FILLER_WORDS = {"the", "a", "an", "my", "website", "site", "web", "page", "app", "please", "dot", "com"}
+
+# Words that may follow a one-word site name without changing the destination
+# ("youtube videos", "gmail inbox"); other trailing words make it a query
+SITE_QUALIFIERS = {
+    "account", "app", "channel", "feed", "home", "homepage", "inbox", "login", "main", "mail",
+    "music", "news", "now", "official", "profile", "search", "sign", "in", "store", "video", "videos"
+}
+
+# Upper bound for the fuzzy fallback; short names only tolerate one edit
+MAX_FUZZY_DISTANCE = 2
+
+# Shortest partial name the prefix lookup accepts; it also has to name one site
+MIN_PREFIX_LENGTH = 4
+
+_NON_WORD = re.compile(r"[^a-z0-9+.\s]")
+_SPACES = re.compile(r"\s+")
+
+
+def normalize_name(text: str) -> str:
+    """Lowercase, strip punctuation and collapse whitespace"""
+    text = _NON_WORD.sub(" ", text.lower())
+    return " ".join(word.strip(".") for word in _SPACES.split(text) if word.strip("."))
+
+
+def _deletes(word: str, depth: int) -> set:
+    """All strings reachable from word by removing up to depth characters"""
+    results = {word}
+    frontier = {word}
+    for _ in range(depth):
+        frontier = {w[:i] + w[i + 1:] for w in frontier for i in range(len(w))}
+        results |= frontier
+    return results
+
+
+def edit_distance(a: str, b: str, max_distance: int) -> int:
+    """Optimal string alignment distance (Levenshtein plus adjacent
+    transpositions, so "gmial" is one edit from "gmail"), giving up once
+    it exceeds max_distance"""
+    if abs(len(a) - len(b)) > max_distance:
+        return max_distance + 1
+    before = None
+    previous = list(range(len(b) + 1))
+    for i, char_a in enumerate(a, 1):
+        current = [i]
+        row_min = i
+        for j, char_b in enumerate(b, 1):
+            cost = 0 if char_a == char_b else 1
+            value = min(previous[j] + 1, current[j - 1] + 1, previous[j - 1] + cost)
+            if i > 1 and j > 1 and char_a == b[j - 2] and a[i - 2] == char_b:
+                value = min(value, before[j - 2] + 1)
+            current.append(value)
+            row_min = min(row_min, value)
+        # A transposition reaches back two rows, so the row minimum alone can't end the search
+        if row_min > max_distance and min(previous) > max_distance:
+            return max_distance + 1
+        before, previous = previous, current
+    return min(previous[-1], max_distance + 1)
+
+
+class SiteDirectory:
+    """In-memory index of site names and aliases
+
+    Entries are indexed three ways: exact name, sorted keys for prefix
+    lookups, and a symmetric-delete index for the edit-distance fallback,
+    so misspellings are matched without scanning every name. Entries
+    loaded earlier rank higher, so directory files should be ordered by
+    popularity.
+    """
+
+    def __init__(self):
+        self.exact: Dict[str, Tuple[int, str]] = {}
+        self.sorted_keys: List[str] = []
+        self.deletes: Dict[str, List[str]] = {}
+
+    def __len__(self) -> int:
+        return len(self.exact)
+
+    def load(self, path: str) -> int:
+        """Load a JSON list of {"name", "url", "aliases"} entries"""
+        with open(path, "r", encoding="utf-8") as f:
+            entries = json.load(f)
+        for entry in entries:
+            self.add(entry["name"], entry["url"], entry.get("aliases", []))
+        self._rebuild()
+        return len(entries)
+
+    def add(self, name: str, url: str, aliases: Optional[List[str]] = None):
+        """Register a site under its name and aliases (first registration wins)"""
+        rank = len(self.exact)
+        for key in [name] + list(aliases or []):
+            key = normalize_name(key)
+            if key and key not in self.exact:
+                self.exact[key] = (rank, url)
+
+    def _rebuild(self):
+        """Rebuild the prefix and fuzzy indexes after loading"""
+        self.sorted_keys = sorted(self.exact)
+        self.deletes = {}
+        for key in self.sorted_keys:
+            for variant in _deletes(key, MAX_FUZZY_DISTANCE):
+                self.deletes.setdefault(variant, []).append(key)
+
+    def lookup_exact(self, name: str) -> Optional[str]:
+        entry = self.exact.get(normalize_name(name))
+        return entry[1] if entry else None
+
+    def lookup_prefix(self, prefix: str) -> Optional[str]:
+        """The site whose names start with prefix, if there is exactly one"""
+        prefix = normalize_name(prefix)
+        if len(prefix) < MIN_PREFIX_LENGTH:
+            return None
+        urls = set()
+        i = bisect_left(self.sorted_keys, prefix)
+        while i < len(self.sorted_keys) and self.sorted_keys[i].startswith(prefix):
+            urls.add(self.exact[self.sorted_keys[i]][1])
+            if len(urls) > 1:
+                return None
+            i += 1
+        return urls.pop() if urls else None
+
+    def lookup_fuzzy(self, name: str) -> Optional[str]:
+        """Closest site name within a length-dependent edit distance"""
+        name = normalize_name(name)
+        if len(name) < 4:
+            return None
+        max_distance = 1 if len(name) < 8 else MAX_FUZZY_DISTANCE
+        candidates = set()
+        for variant in _deletes(name, max_distance):
+            candidates.update(self.deletes.get(variant, ()))
+
+        best = None
+        for key in candidates:
+            distance = edit_distance(name, key, max_distance)
+            if distance > max_distance:
+                continue
+            candidate = (distance, self.exact[key][0], self.exact[key][1])
+            if best is None or candidate < best:
+                best = candidate
+        return best[2] if best else None
+
+    def resolve(self, target: str) -> Optional[str]:
+        """Resolve a spoken target to a URL, or None if nothing matches"""
+        words = [w for w in normalize_name(target).split() if w not in FILLER_WORDS]
+        if not words:
+            return None
+        phrase = " ".join(words)
+
+        url = self.lookup_exact(phrase) or self.lookup_exact(phrase.replace(" ", ""))
+        if url:
+            return url
+
+        # Longest leading run of words that names a site ("youtube videos" -> youtube).
+        # Only the start counts, and a single word only before qualifiers, so common
+        # words that are also sites don't capture queries ("who won the world cup").
+        for size in range(len(words) - 1, 0, -1):
+            if size == 1 and not all(word in SITE_QUALIFIERS for word in words[1:]):
+                break
+            url = self.lookup_exact(" ".join(words[:size]))
+            if url:
+                return url
+
+        return self.lookup_prefix(phrase) or self.lookup_fuzzy(phrase)
+
+
+def load_site_directory() -> SiteDirectory:
+    """Build the directory from SITE_DIRECTORY_PATH or the bundled list"""
+    directory = SiteDirectory()
+    path = os.getenv("SITE_DIRECTORY_PATH", DEFAULT_DIRECTORY_PATH)
+    try:
+        count = directory.load(path)
+        logger.info(f"Loaded {count} sites into site directory from {path}")
+    except (OSError, ValueError, KeyError) as e:
+        logger.error(f"Failed to load site directory from {path}: {e}")
+    return directory
+
+
+# Global instance
+site_directory = load_site_directory()
@@ -0,0 +1,217 @@
+"""Per-user prefix trie for frecency-ranked address bar suggestions"""
+import os
+import math
+import asyncio
+from bisect import insort
+from collections import OrderedDict
+from datetime import datetime
+from typing import Dict, List, Optional
+from urllib.parse import urlparse
+from services.search_index import tokenize
+import logging
+
+logger = logging.getLogger(__name__)
+
+# Entries loaded per user on cold start (most recently visited first)
+SUGGEST_MAX_ENTRIES = int(os.getenv("SUGGEST_MAX_ENTRIES", 20000))
+# Users whose tries stay in memory
+SUGGEST_MAX_USERS = int(os.getenv("SUGGEST_MAX_USERS", 200))
+# Frecency halves every SUGGEST_HALF_LIFE_DAYS without a visit
+SUGGEST_HALF_LIFE_DAYS = float(os.getenv("SUGGEST_HALF_LIFE_DAYS", 14))
+BOOKMARK_BOOST = 4.0
+# Ranked ids kept at each trie node; bounds both memory and query time
+NODE_TOP_K = 16
+
+_DECAY_PER_SECOND = math.log(2) / (SUGGEST_HALF_LIFE_DAYS * 86400)
+
+
+class SuggestEntry:
+    __slots__ = ("url", "title", "visit_count", "last_visit", "bookmarked", "key", "terms")
+
+    def __init__(self, url: str, title: str):
+        self.url = url
+        self.title = title
+        self.visit_count = 0
+        self.last_visit = datetime.utcfromtimestamp(0)
+        self.bookmarked = False
+        self.key = float("-inf")
+        self.terms: List[str] = []
+
+    def rank_key(self) -> float:
+        """Frecency in log space
+
+        log(weight) + decay * timestamp orders entries exactly like
+        weight * exp(-decay * age), but doesn't change as time passes, so
+        rankings stored in the trie never go stale.
+        """
+        weight = (self.visit_count + 1) * (BOOKMARK_BOOST if self.bookmarked else 1.0)
+        return math.log(weight) + _DECAY_PER_SECOND * self.last_visit.timestamp()
+
+    def to_dict(self) -> dict:
+        return {
+            "url": self.url,
+            "title": self.title,
+            "visit_count": self.visit_count,
+            "bookmarked": self.bookmarked
+        }
+
+
+def entry_terms(url: str, title: str) -> List[str]:
+    """Host, host labels, path segments and title words of an entry"""
+    parsed = urlparse(url if "//" in url else f"//{url}")
+    host = (parsed.hostname or "").lower()
+    if host.startswith("www."):
+        host = host[4:]
+    terms = [host] if host else []
+    terms += host.split(".")[:-1]
+    terms += tokenize(parsed.path)
+    terms += tokenize(title)
+    return [term for term in dict.fromkeys(terms) if term]
+
+
+class _Node:
+    __slots__ = ("children", "top")
+
+    def __init__(self):
+        self.children: Dict[str, "_Node"] = {}
+        # (negated rank key, url) pairs, best first
+        self.top: List[tuple] = []
+
+
+class UserTrie:
+    """Prefix trie whose nodes keep the top-ranked entries beneath them
+
+    Rank keys only grow (a visit or a new bookmark), so each node's top
+    list stays exact under incremental updates. Anything that lowers a key
+    (deletes, clearing history) invalidates the whole trie instead.
+    """
+
+    def __init__(self):
+        self.root = _Node()
+        self.entries: Dict[str, SuggestEntry] = {}
+
+    def upsert(self, url: str, title: Optional[str] = None, visits: int = 0,
+               visited_at: Optional[datetime] = None, bookmarked: bool = False):
+        entry = self.entries.get(url)
+        if entry is None:
+            entry = self.entries[url] = SuggestEntry(url, title or url)
+        elif title:
+            entry.title = title
+        entry.visit_count += visits
+        if visited_at and visited_at > entry.last_visit:
+            entry.last_visit = visited_at
+        entry.bookmarked = entry.bookmarked or bookmarked
+
+        entry.key = entry.rank_key()
+        terms = entry_terms(url, entry.title)
+        for term in set(terms) | set(entry.terms):
+            self._index(term, entry)
+        entry.terms = terms
+
+    def _index(self, term: str, entry: SuggestEntry):
+        node = self.root
+        for char in term:
+            node = node.children.setdefault(char, _Node())
+            top = node.top
+            for i, item in enumerate(top):
+                if item[1] == entry.url:
+                    del top[i]
+                    break
+            if len(top) < NODE_TOP_K or -entry.key < top[-1][0]:
+                insort(top, (-entry.key, entry.url))
+                del top[NODE_TOP_K:]
+
+    def suggest(self, prefix: str, limit: int) -> List[dict]:
+        words = prefix.lower().split()
+        if not words:
+            return []
+        lead = words[0]
+        for scheme in ("https://", "http://"):
+            if lead.startswith(scheme):
+                lead = lead[len(scheme):]
+        if lead.startswith("www."):
+            lead = lead[4:]
+        lead = lead.rstrip("/")
+
+        node = self.root
+        for char in lead:
+            node = node.children.get(char)
+            if node is None:
+                return []
+
+        results = []
+        for _, url in node.top:
+            entry = self.entries[url]
+            haystack = f"{entry.url} {entry.title}".lower()
+            if all(word in haystack for word in words[1:]):
+                results.append(entry.to_dict())
+            if len(results) >= limit:
+                break
+        return results
+
+
+class SuggestIndex:
+    """LRU of per-user tries, built lazily from storage on first use"""
+
+    def __init__(self):
+        self.tries: "OrderedDict[str, UserTrie]" = OrderedDict()
+        self.loading: Dict[str, asyncio.Future] = {}
+
+    async def suggest(self, store, user_id: str, prefix: str, limit: int = 8) -> List[dict]:
+        trie = await self._get(store, user_id)
+        return trie.suggest(prefix, limit)
+
+    async def _get(self, store, user_id: str) -> UserTrie:
+        trie = self.tries.get(user_id)
+        if trie is not None:
+            self.tries.move_to_end(user_id)
+            return trie
+
+        # Concurrent cold-start requests share a single build
+        if user_id in self.loading:
+            return await asyncio.shield(self.loading[user_id])
+        future = asyncio.get_running_loop().create_future()
+        self.loading[user_id] = future
+        try:
+            trie = await self._build(store, user_id)
+            self.tries[user_id] = trie
+            if len(self.tries) > SUGGEST_MAX_USERS:
+                self.tries.popitem(last=False)
+            future.set_result(trie)
+            return trie
+        except Exception as e:
+            future.set_exception(e)
+            raise
+        finally:
+            del self.loading[user_id]
+
+    async def _build(self, store, user_id: str) -> UserTrie:
+        trie = UserTrie()
+        async for doc in store.iter_history(user_id, SUGGEST_MAX_ENTRIES):
+            trie.upsert(doc["url"], doc.get("title"), doc.get("visit_count", 1), doc.get("visited_at"))
+            # Building is CPU-bound; let other requests run between batches
+            if len(trie.entries) % 500 == 0:
+                await asyncio.sleep(0)
+        async for doc in store.iter_bookmarks(user_id):
+            trie.upsert(doc["url"], doc.get("title"), 0, doc.get("created_at"), bookmarked=True)
+        logger.info(f"Built suggestion trie for {user_id} with {len(trie.entries)} entries")
+        return trie
+
+    def record_visit(self, user_id: str, url: str, title: str, visited_at: datetime, visits: int = 1):
+        """Apply a history write to a loaded trie (unloaded users build lazily)"""
+        trie = self.tries.get(user_id)
+        if trie is not None:
+            trie.upsert(url, title, visits, visited_at)
+
+    def record_bookmark(self, user_id: str, url: str, title: str, created_at: datetime):
+        trie = self.tries.get(user_id)
+        if trie is not None:
+            trie.upsert(url, title, 0, created_at, bookmarked=True)
+
+    def invalidate(self, user_id: str):
+        """Drop a user's trie after writes that lower rankings"""
+        self.tries.pop(user_id, None)
+
+
+# Global instance
+suggest_index = SuggestIndex()
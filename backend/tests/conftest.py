@@ -0,0 +1,11 @@
+import os
+import sys
+import tempfile
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+# Keep spilled cache entries and downloads out of the tree
+os.environ.setdefault("PROXY_CACHE_DIR", tempfile.mkdtemp(prefix="proxy-cache-"))
+os.environ.setdefault("DOWNLOADS_DIR", tempfile.mkdtemp(prefix="downloads-"))
+# Clients that refuse to start without a key; tests never reach the provider
+os.environ.setdefault("GROQ_API_KEY", "test")
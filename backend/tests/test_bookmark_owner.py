@@ -0,0 +1,17 @@
+import asyncio
+import os
+import tempfile
+from datetime import datetime
+from database.sqlite_storage import SQLiteStorage
+
+
+def test_only_the_owner_can_delete_a_bookmark():
+    async def run():
+        store = SQLiteStorage(os.path.join(tempfile.mkdtemp(prefix="bookmarks-"), "test.db"))
+        bookmark_id = await store.insert_bookmark({"user_id": "alice", "url": "https://a.test/", "title": "A",
+                                                   "created_at": datetime(2026, 1, 1), "search_terms": ["a"]})
+        results = (await store.delete_bookmark("mallory", bookmark_id), await store.delete_bookmark("alice", bookmark_id))
+        await store.close()
+        return results
+
+    assert asyncio.run(run()) == (False, True)
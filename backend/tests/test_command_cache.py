@@ -0,0 +1,12 @@
+from services.command_cache import normalize_transcript
+
+
+def test_symbols_inside_words_keep_commands_apart():
+    keys = {normalize_transcript(text) for text in ("search c++", "search c#", "search c", "search c.")}
+    assert keys == {"search c++", "search c#", "search c"}
+    assert normalize_transcript("Open node.js") != normalize_transcript("open node js")
+
+
+def test_punctuation_around_words_is_ignored():
+    assert normalize_transcript("Um, go back, please!") == "go back"
+    assert normalize_transcript('search for "cats"?') == "search for cats"
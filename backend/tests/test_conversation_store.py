@@ -0,0 +1,32 @@
+import asyncio
+from services import conversation_store as store_module
+from services.conversation_store import ConversationStore
+
+
+def test_evicted_turns_stay_in_the_prompt_until_summarized():
+    async def run():
+        store = ConversationStore()
+        conversation = await store.get("u", "c")
+        for index in range(store_module.CONVERSATION_WINDOW + 2):
+            await store.add_turns(conversation, [{"speaker": "You", "message": str(index)}])
+        return conversation
+
+    conversation = asyncio.run(run())
+    assert conversation.pending and not conversation.summary
+    assert [turn["message"] for turn in conversation.history()] == \
+        [str(index) for index in range(store_module.CONVERSATION_WINDOW + 2)]
+
+
+def test_conversation_ids_are_scoped_by_user():
+    async def run():
+        store = ConversationStore()
+        mine = await store.get("alice", "shared")
+        await store.add_turns(mine, [{"speaker": "You", "message": "secret"}])
+        theirs = await store.get("mallory", "shared")
+        cleared = await store.clear("mallory", "shared")
+        return theirs.history(), (await store.get("alice", "shared")).history(), cleared
+
+    theirs, mine, cleared = asyncio.run(run())
+    assert theirs == []
+    assert mine == [{"speaker": "You", "message": "secret"}]
+    assert cleared
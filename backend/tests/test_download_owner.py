@@ -0,0 +1,49 @@
+from fastapi import FastAPI
+from fastapi.testclient import TestClient
+from routes import downloads
+from services.database_service import db_service
+
+
+def test_server_downloads_are_only_visible_to_their_owner(monkeypatch, tmp_path):
+    path = tmp_path / "report.pdf"
+    path.write_bytes(b"%PDF")
+    download = {"_id": "d1", "user_id": "alice", "server_side": True, "status": "completed",
+                "save_path": str(path), "filename": "report.pdf"}
+
+    async def get_download(download_id):
+        return download if download_id == "d1" else None
+
+    monkeypatch.setattr(db_service, "get_download", get_download)
+    app = FastAPI()
+    app.include_router(downloads.router)
+    client = TestClient(app)
+
+    assert client.get("/downloads/d1/file?user_id=alice").content == b"%PDF"
+    assert client.get("/downloads/d1/file?user_id=mallory").status_code == 404
+    assert client.post("/downloads/d1/pause?user_id=mallory").status_code == 404
+    assert client.post("/downloads/d1/resume?user_id=mallory").status_code == 404
+
+
+def test_downloads_by_id_are_owner_only(monkeypatch):
+    download = {"_id": "d1", "user_id": "alice", "server_side": True, "status": "in_progress",
+                "save_path": "/tmp/never", "filename": "big.iso"}
+    cancelled = []
+
+    async def get_download(download_id):
+        return download if download_id == "d1" else None
+
+    async def cancel(download_id):
+        cancelled.append(download_id)
+
+    monkeypatch.setattr(db_service, "get_download", get_download)
+    monkeypatch.setattr(downloads.download_engine, "cancel", cancel)
+    app = FastAPI()
+    app.include_router(downloads.router)
+    client = TestClient(app)
+
+    assert client.get("/downloads/d1?user_id=mallory").status_code == 404
+    assert client.put("/downloads/d1?user_id=mallory", json={"status": "completed"}).status_code == 404
+    assert client.delete("/downloads/d1?user_id=mallory").status_code == 404
+    assert not cancelled
+    # Even the owner can't report progress for a download the engine runs
+    assert client.put("/downloads/d1?user_id=alice", json={"status": "completed"}).status_code == 409
@@ -0,0 +1,45 @@
+import asyncio
+from services.database_service import DatabaseService
+from services.live_updates import live_updates, focus_state
+
+
+class Store:
+    def __init__(self, events):
+        self.events = events
+        self.reads = 0
+
+    async def watch(self, collections):
+        for event in self.events:
+            yield event
+
+    async def get_active_focus_session(self, user_id):
+        self.reads += 1
+        return None
+
+
+def test_own_focus_writes_are_not_reloaded_or_pushed():
+    session = {"_id": "s1", "user_id": "u", "active": True, "topic": "math", "urls_checked": 3}
+    older = {**session, "urls_checked": 2}
+    newer = {**session, "urls_checked": 4}
+    store = Store([
+        ("focus_sessions", "u", dict(session)),
+        ("focus_sessions", "u", older),
+        ("focus_sessions", "u", newer),
+    ])
+    service = DatabaseService(store=store)
+    service.focus_cache.set("u", session)
+
+    async def run():
+        subscription = live_updates.subscribe("u", "focus")
+        live_updates.snapshot(subscription, focus_state(session))
+        try:
+            await service.watch_changes()
+            return subscription.pending
+        finally:
+            live_updates.unsubscribe(subscription)
+
+    pending = asyncio.run(run())
+    assert store.reads == 0
+    assert service.focus_cache.get("u") == newer
+    # Only the other worker's check reached the client
+    assert pending["op"] == "update" and pending["fields"] == {"urls_checked": 4}
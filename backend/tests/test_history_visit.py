@@ -0,0 +1,15 @@
+from datetime import datetime
+from routes.data import HistoryVisit
+
+
+def test_visited_at_is_converted_to_naive_utc():
+    visit = HistoryVisit(url="https://a.test", title="A", visited_at="2026-01-01T12:00:00+02:00")
+    assert visit.visited_at == datetime(2026, 1, 1, 10, 0)
+    assert visit.visited_at.tzinfo is None
+    assert visit.visited_at < datetime.utcnow()
+
+
+def test_utc_and_naive_visited_at_keep_their_time():
+    visit = HistoryVisit(url="https://a.test", title="A", visited_at="2026-01-01T12:00:00Z")
+    assert visit.visited_at == datetime(2026, 1, 1, 12, 0)
+    assert HistoryVisit(url="https://a.test", title="A", visited_at="2026-01-01T12:00:00").visited_at.hour == 12
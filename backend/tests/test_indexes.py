@@ -0,0 +1,41 @@
+import asyncio
+from pymongo.errors import OperationFailure
+from database import indexes
+
+
+class Collection:
+    def __init__(self, name, visited):
+        self.name = name
+        self.visited = visited
+
+    async def index_information(self):
+        self.visited.append(self.name)
+        info = {}
+        for model in indexes.INDEX_SPECS[self.name]:
+            spec = model.document
+            ttl = spec.get("expireAfterSeconds")
+            info[spec["name"]] = {"unique": spec.get("unique", False),
+                                  "expireAfterSeconds": None if ttl is None else ttl + 1}
+        return info
+
+
+class Database:
+    def __init__(self):
+        self.visited = []
+
+    def __getitem__(self, name):
+        return Collection(name, self.visited)
+
+    async def command(self, *args, **kwargs):
+        raise OperationFailure("not authorized on lernova to execute command collMod")
+
+
+def test_a_failed_ttl_change_does_not_stop_reconciliation():
+    database = Database()
+    asyncio.run(indexes.reconcile_indexes(database))
+    ttl_indexes = [model for models in indexes.INDEX_SPECS.values() for model in models
+                   if "expireAfterSeconds" in model.document]
+    assert ttl_indexes
+    assert database.visited == list(indexes.INDEX_SPECS)
+    assert indexes.index_status["state"] == "failed"
+    assert len(indexes.index_status["errors"]) == len(ttl_indexes)
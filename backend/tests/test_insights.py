@@ -0,0 +1,34 @@
+import asyncio
+from datetime import datetime
+from services import insights as insights_module
+from services.insights import InsightsAggregator, visit_increments
+
+
+def test_visit_increments_skip_empty_keys():
+    moment = datetime(2026, 1, 1, 12)
+    for url in ("", "#x"):
+        increments = visit_increments(url, moment)
+        assert not any(path.startswith("pages.") or path.startswith("domains.") for path in increments)
+        assert all(not path.endswith(".") for path in increments)
+
+
+def test_flush_requeues_only_retryable_increments(monkeypatch):
+    calls = []
+
+    class Storage:
+        async def increment_rollups(self, increments):
+            calls.append(increments)
+            # The first key fails retryably, the rest were applied
+            first = next(iter(increments))
+            return {first: increments[first]} if len(calls) == 1 else {}
+
+    monkeypatch.setattr(insights_module, "get_storage", lambda: Storage())
+    aggregator = InsightsAggregator()
+    aggregator.record_visit("a", "https://a.test/", datetime(2026, 1, 1))
+    aggregator.record_visit("b", "https://b.test/", datetime(2026, 1, 1))
+
+    asyncio.run(aggregator.flush())
+    assert list(aggregator.pending) == [("a", "2026-01-01")]
+    asyncio.run(aggregator.flush())
+    assert not aggregator.pending
+    assert list(calls[1]) == [("a", "2026-01-01")]
@@ -0,0 +1,20 @@
+from services.live_updates import LiveUpdates
+
+
+def test_changes_while_the_first_subscriber_loads_are_not_lost():
+    hub = LiveUpdates()
+    subscription = hub.subscribe("u", "settings")
+    # Written after the subscriber read {"theme": "light"}, before its snapshot
+    hub.update("u", "settings", {"theme": "dark"})
+    hub.update("u", "settings", {"volume": 3})
+    snapshot = hub.snapshot(subscription, {"theme": "light", "volume": 1, "voice": "a"})
+    assert snapshot["state"] == {"theme": "dark", "volume": 3, "voice": "a"}
+
+
+def test_replace_while_loading_wins_over_the_loaded_state():
+    hub = LiveUpdates()
+    subscription = hub.subscribe("u", "focus")
+    hub.publish("u", "focus", None)
+    assert hub.snapshot(subscription, {"id": "s1", "topic": "math"})["state"] is None
+    hub.publish("u", "focus", {"id": "s2", "topic": "art"})
+    assert subscription.pending == {"op": "replace", "state": {"id": "s2", "topic": "art"}, "version": 1}
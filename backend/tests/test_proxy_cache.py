@@ -0,0 +1,73 @@
+import asyncio
+import httpx
+import pytest
+from fastapi import FastAPI
+from fastapi.testclient import TestClient
+from routes import proxy
+
+
+@pytest.fixture
+def client(monkeypatch):
+    def upstream(request: httpx.Request) -> httpx.Response:
+        headers = {"etag": '"v1"', "cache-control": "max-age=60", "content-type": "text/plain"}
+        if request.headers.get("if-none-match") == '"v1"':
+            return httpx.Response(304, headers=headers, stream=httpx.ByteStream(b""))
+        return httpx.Response(200, headers=headers, stream=httpx.ByteStream(b"hello"))
+
+    mock = httpx.AsyncClient(transport=httpx.MockTransport(upstream))
+    monkeypatch.setattr(proxy, "get_http_client", lambda: mock)
+    app = FastAPI()
+    app.include_router(proxy.router, prefix="/api/proxy")
+    with TestClient(app) as client:
+        yield client
+
+
+def test_conditional_miss_does_not_store_304(client):
+    url = "http://example.test/conditional"
+    first = client.get("/api/proxy/fetch", params={"url": url}, headers={"if-none-match": '"v1"'})
+    assert first.status_code == 304
+    assert first.headers["x-cache"] == "MISS"
+
+    second = client.get("/api/proxy/fetch", params={"url": url})
+    assert second.status_code == 200
+    assert second.content == b"hello"
+    assert second.headers["x-cache"] == "MISS"
+
+    third = client.get("/api/proxy/fetch", params={"url": url})
+    assert third.headers["x-cache"] == "HIT"
+    assert third.content == b"hello"
+
+
+def test_stored_response_answers_client_validators(client):
+    url = "http://example.test/validators"
+    client.get("/api/proxy/fetch", params={"url": url})
+    cached = client.get("/api/proxy/fetch", params={"url": url}, headers={"if-none-match": '"v1"'})
+    assert cached.status_code == 304
+    assert cached.headers["x-cache"] == "HIT"
+
+
+async def _revalidations_done():
+    await asyncio.gather(*proxy._revalidations)
+
+
+def test_background_revalidation_sends_only_the_entry_validators(monkeypatch):
+    seen = []
+
+    def upstream(request: httpx.Request) -> httpx.Response:
+        seen.append((request.headers.get("if-none-match"), request.headers.get("if-modified-since")))
+        headers = {"etag": '"v1"', "cache-control": "max-age=0, stale-while-revalidate=600",
+                   "content-type": "text/plain"}
+        return httpx.Response(200, headers=headers, stream=httpx.ByteStream(b"hello"))
+
+    mock = httpx.AsyncClient(transport=httpx.MockTransport(upstream))
+    monkeypatch.setattr(proxy, "get_http_client", lambda: mock)
+    app = FastAPI()
+    app.include_router(proxy.router, prefix="/api/proxy")
+    url = "http://example.test/stale"
+    with TestClient(app) as client:
+        client.get("/api/proxy/fetch", params={"url": url})
+        stale = client.get("/api/proxy/fetch", params={"url": url}, headers={"if-modified-since": "Wed, 01 Jan 2031 00:00:00 GMT"})
+        assert stale.headers["x-cache"] == "STALE"
+        client.portal.call(_revalidations_done)
+    # The client's If-Modified-Since would let a 304 meant for it refresh the entry
+    assert seen == [(None, None), ('"v1"', None)]
@@ -0,0 +1,19 @@
+from services.readability import extract
+
+ARTICLE = " ".join(["The committee met on Tuesday, reviewed the budget, and approved the new plan."] * 6)
+
+
+def test_a_page_wrapped_in_a_form_keeps_its_text():
+    page = f"""<html><body><form id="aspnetForm" method="post">
+        <input type="hidden" name="__VIEWSTATE" value="x">
+        <div class="content"><p>{ARTICLE}</p><p>{ARTICLE}</p></div>
+        <input type="submit" value="Go">
+    </form></body></html>""".encode()
+    assert "committee met" in extract(page, "https://example.test/")["text"]
+
+
+def test_search_and_login_forms_are_dropped():
+    page = f"""<html><body><article><p>{ARTICLE}</p>
+        <form action="/search"><input name="q"><button>Search the archive</button></form>
+    </article></body></html>""".encode()
+    assert "Search the archive" not in extract(page, "https://example.test/")["text"]
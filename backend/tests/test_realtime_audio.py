@@ -0,0 +1,37 @@
+import struct
+from concurrent.futures import CancelledError
+from fastapi import FastAPI
+from fastapi.testclient import TestClient
+from routes import realtime as realtime_routes
+from services.eleven_labs import eleven_labs_client
+
+
+def test_tts_audio_is_sent_in_binary_frames(monkeypatch):
+    audio = bytes(range(256)) * 300
+
+    async def text_to_speech(text, voice_id=None, return_base64=True):
+        assert not return_base64
+        return audio
+
+    monkeypatch.setattr(eleven_labs_client, "text_to_speech", text_to_speech)
+    app = FastAPI()
+    app.include_router(realtime_routes.router)
+    with TestClient(app) as client:
+        try:
+            with client.websocket_connect("/ws?user_id=u") as websocket:
+                assert websocket.receive_json()["type"] == "hello"
+                websocket.send_json({"id": 9, "ch": "ai", "op": "tts", "data": {"text": "hello"}})
+                received = b""
+                while True:
+                    frame = websocket.receive_bytes()
+                    assert struct.unpack(">I", frame[:4]) == (9,)
+                    if len(frame) == 4:
+                        break
+                    received += frame[4:]
+                result = websocket.receive_json()
+        except CancelledError:
+            # The test client's portal can cancel the server while the socket closes
+            pass
+    assert received == audio
+    assert result["id"] == 9 and result["data"]["text"] == "hello"
+    assert result["data"]["audio_base64"] is None
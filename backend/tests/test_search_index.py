@@ -0,0 +1,65 @@
+import asyncio
+import os
+import tempfile
+from datetime import datetime, timedelta
+from database import sqlite_storage
+from database.sqlite_storage import SQLiteStorage
+from services import search_index
+
+
+def test_tokenize_keeps_letters_of_any_script():
+    assert search_index.tokenize("日本 Café_Crème") == ["日本", "café", "crème"]
+    assert search_index.query_terms("CAFÉ") == ["café"]
+
+
+def _storage() -> SQLiteStorage:
+    return SQLiteStorage(os.path.join(tempfile.mkdtemp(prefix="search-"), "test.db"))
+
+
+def test_candidates_are_the_newest_matches():
+    async def run():
+        store = _storage()
+        start = datetime(2026, 1, 1)
+        for day in range(5):
+            await store.insert_bookmark({
+                "user_id": "u", "url": f"https://example.test/{day}", "title": "Python notes",
+                "created_at": start + timedelta(days=day),
+                "search_terms": search_index.search_terms_for(f"https://example.test/{day}", "Python notes")
+            })
+        docs = await store.search_candidates("bookmarks", "u", ["pyth"], 2)
+        await store.close()
+        return [doc["url"] for doc in docs]
+
+    assert asyncio.run(run()) == ["https://example.test/4", "https://example.test/3"]
+
+
+def test_backfill_retokenizes_stale_terms():
+    async def run():
+        store = _storage()
+        # Terms from the ASCII-only tokenizer
+        await store.insert_bookmark({"user_id": "u", "url": "https://jp.test/", "title": "日本 café",
+                                     "created_at": datetime(2026, 1, 1), "search_terms": ["caf", "jp", "test"]})
+        # Indexed by the current tokenizer: left alone
+        await store.insert_bookmark({"user_id": "u", "url": "https://new.test/", "title": "New",
+                                     "created_at": datetime(2026, 1, 2),
+                                     **search_index.search_fields("https://new.test/", "New")})
+        updated = await store.backfill_search_terms()
+        docs = await store.search_candidates("bookmarks", "u", ["日本"], 10)
+        again = await store.backfill_search_terms()
+        await store.close()
+        return updated, len(docs), again
+
+    assert asyncio.run(run()) == (1, 1, 0)
+
+
+def test_stale_documents_are_found_through_an_index():
+    async def run():
+        store = _storage()
+        await store.backfill_search_terms()
+        plan = await store._run(lambda: store.conn.execute(
+            f"EXPLAIN QUERY PLAN SELECT id FROM history WHERE {sqlite_storage._TERMS_VERSION} < 2"
+        ).fetchall())
+        await store.close()
+        return " ".join(step[3] for step in plan)
+
+    assert "history_terms_version" in asyncio.run(run())
@@ -0,0 +1,36 @@
+import asyncio
+import os
+import tempfile
+from database.sqlite_storage import SQLiteStorage
+from services.database_service import DatabaseService
+
+
+def _service() -> DatabaseService:
+    return DatabaseService(SQLiteStorage(os.path.join(tempfile.mkdtemp(prefix="settings-"), "test.db")))
+
+
+def test_concurrent_first_reads_create_one_settings_document():
+    async def run():
+        service = _service()
+        first = await asyncio.gather(*(service.get_settings("u") for _ in range(5)))
+        count = await service.store._run(lambda: service.store.conn.execute(
+            "SELECT COUNT(*) FROM settings").fetchone()[0])
+        await service.store.close()
+        return first, count
+
+    reads, count = asyncio.run(run())
+    assert count == 1
+    assert len({str(settings["_id"]) for settings in reads}) == 1
+
+
+def test_changing_returned_settings_leaves_the_cache_alone():
+    async def run():
+        service = _service()
+        await service.update_settings("u", {"shortcuts": {"home": "ctrl+h"}})
+        settings = await service.get_settings("u")
+        settings["shortcuts"]["home"] = "ctrl+j"
+        again = await service.get_settings("u")
+        await service.store.close()
+        return again
+
+    assert asyncio.run(run())["shortcuts"] == {"home": "ctrl+h"}
@@ -0,0 +1,35 @@
+import pytest
+from services.site_directory import site_directory
+
+
+@pytest.mark.parametrize("target", [
+    "who won the world cup",
+    "how to keep plants alive",
+    "the box office numbers",
+])
+def test_common_words_in_queries_do_not_resolve(target):
+    assert site_directory.resolve(target) is None
+
+
+@pytest.mark.parametrize("target, url", [
+    ("youtube", "https://www.youtube.com"),
+    ("the youtube website", "https://www.youtube.com"),
+    ("youtube videos", "https://www.youtube.com"),
+    ("youtub", "https://www.youtube.com"),
+    ("new york times crossword", "https://www.nytimes.com"),
+])
+def test_site_names_resolve(target, url):
+    assert site_directory.resolve(target) == url
+
+
+@pytest.mark.parametrize("target", ["red", "goo", "amaz"])
+def test_short_or_ambiguous_prefixes_do_not_resolve(target):
+    assert site_directory.resolve(target) is None
+
+
+@pytest.mark.parametrize("target, url", [
+    ("gmial", "https://mail.google.com"),
+    ("redd", "https://www.reddit.com"),
+])
+def test_transpositions_and_unique_prefixes_resolve(target, url):
+    assert site_directory.resolve(target) == url
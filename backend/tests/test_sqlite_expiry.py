@@ -0,0 +1,43 @@
+import asyncio
+import os
+import tempfile
+from datetime import datetime, timedelta
+from database import sqlite_storage
+from database.sqlite_storage import SQLiteStorage
+
+
+def _storage() -> SQLiteStorage:
+    return SQLiteStorage(os.path.join(tempfile.mkdtemp(prefix="expiry-"), "test.db"))
+
+
+def test_expired_rows_are_not_returned_before_pruning():
+    async def run():
+        store = _storage()
+        await store.connect()
+        past = datetime.utcnow() - timedelta(seconds=1)
+        await store.insert_session({"token": "t", "user_id": "u", "expires_at": past})
+        await store.save_page_context({"_id": "h", "expires_at": past})
+        await store.save_conversation({"_id": "c", "user_id": "u", "turns": [],
+                                       "updated_at": datetime.utcnow() - timedelta(days=1)})
+        found = (await store.find_session("t"), await store.find_page_context("h"),
+                 await store.load_conversation("c"))
+        await store.close()
+        return found
+
+    assert asyncio.run(run()) == (None, None, None)
+
+
+def test_expired_rows_are_pruned_while_running(monkeypatch):
+    monkeypatch.setattr(sqlite_storage, "SQLITE_PRUNE_INTERVAL", 0.01)
+
+    async def run():
+        store = _storage()
+        await store.connect()
+        await store.insert_session({"token": "t", "user_id": "u",
+                                    "expires_at": datetime.utcnow() - timedelta(seconds=1)})
+        await asyncio.sleep(0.1)
+        count = await store._run(lambda: store.conn.execute("SELECT COUNT(*) FROM sessions").fetchone()[0])
+        await store.close()
+        return count
+
+    assert asyncio.run(run()) == 0
@@ -0,0 +1,14 @@
+from routes.voice_navigation import resolve_intent
+
+
+def test_lead_ins_keep_a_command_explicit():
+    for command in ("can you search for cats", "please search for cats", "i want to search for cats",
+                    "could you please look up cats"):
+        response, confident = resolve_intent(command)
+        assert confident, command
+        assert response.url.endswith("q=cats")
+
+
+def test_verb_mid_sentence_is_not_explicit():
+    _, confident = resolve_intent("what's the best way to find a plumber")
+    assert not confident
@@ -24,6 +24,7 @@ function VoiceNavigationMode({ isActive, onClose, onNavigate }) {
   const synthRef = useRef(window.speechSynthesis);
   const silenceTimeoutRef = useRef(null);
   const recordingTimerRef = useRef(null);
+  const conversationIdRef = useRef(null);
   const minRecordingTime = 60000; // 1 minute in milliseconds
 
   // Initialize on mount
@@ -274,12 +275,14 @@ function VoiceNavigationMode({ isActive, onClose, onNavigate }) {
 
     try {
       // Send to AI backend for processing
+      // Conversation context is kept server-side under conversation_id
       const response = await axios.post(`${API_URL}/api/ai/voice-command`, {
         command: command,
-        history: conversationHistory.slice(-5) // Last 5 messages for context
+        conversation_id: conversationIdRef.current
       });
 
-      const { action, response: aiText, url } = response.data;
+      const { action, response: aiText, url, conversation_id } = response.data;
+      conversationIdRef.current = conversation_id;
 
       // Handle different action types
       if (action === 'navigate') {